@@ -1,10 +1,33 @@
 import os
+import json
 
 def analyze_progress():
     """
-    Summarizes the progress.md file.
+    Summarizes progress from knowledge_base/log_index.json
+    (kept up to date by the backend's log writer); falls back to reading progress.md.
     """
-    progress_file = os.path.join(os.getcwd(), "knowledge_base", "progress.md")
+    base = os.path.join(os.getcwd(), "knowledge_base")
+    index_file = os.path.join(base, "log_index.json")
+    if os.path.exists(index_file):
+        with open(index_file, 'r', encoding='utf-8') as f:
+            section = json.load(f).get("progress", {})
+
+        answered = section.get("answered", 0)
+        accuracy = f" ({int(section.get('correct', 0) / answered * 100)}% correct)" if answered else ""
+        print(f"Total sessions logged: {section.get('sessions', 0)}, questions answered: {answered}{accuracy}")
+        by_date = section.get("by_date", {})
+        if by_date:
+            print("Last 7 study days:")
+            for date in sorted(by_date)[-7:]:
+                day = by_date[date]
+                rate = int(day['correct'] / day['answered'] * 100) if day['answered'] else 0
+                print(f"  {date}: {day['sessions']} sessions, {day['correct']}/{day['answered']} ({rate}%)")
+        print("Recent activity:")
+        for line in section.get("recent", [])[-5:]:
+            print(line)
+        return
+
+    progress_file = os.path.join(base, "progress.md")
     if not os.path.exists(progress_file):
         print("No progress log found yet. Keep studying!")
         return
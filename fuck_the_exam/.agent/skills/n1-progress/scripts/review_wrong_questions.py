@@ -1,10 +1,32 @@
 import os
+import json
 
 def review_wrong_questions():
     """
-    Parses knowledge_base/wrong_questions.md and prints a summary.
+    Summarizes the "Black Book" from knowledge_base/log_index.json
+    (kept up to date by the backend's log writer); falls back to parsing wrong_questions.md.
     """
-    wrong_file = os.path.join(os.getcwd(), "knowledge_base", "wrong_questions.md")
+    base = os.path.join(os.getcwd(), "knowledge_base")
+    index_file = os.path.join(base, "log_index.json")
+    if os.path.exists(index_file):
+        with open(index_file, 'r', encoding='utf-8') as f:
+            section = json.load(f).get("wrong_questions", {})
+
+        print(f"Total entries in 'Black Book': {section.get('total', 0)}")
+        by_point = sorted(section.get("by_point", {}).items(), key=lambda kv: kv[1], reverse=True)
+        if by_point:
+            print("Recurring weak points:")
+            for point, count in by_point[:5]:
+                print(f"  {point}: {count}")
+        for entry in section.get("recent", [])[-3:]:
+            print("-" * 20)
+            print(f"Question: [{entry['date']}] {entry['knowledge_point']}")
+            print(f"  {entry['question']}")
+        if section.get("archives"):
+            print(f"(Older entries rotated into: {', '.join(section['archives'])})")
+        return
+
+    wrong_file = os.path.join(base, "wrong_questions.md")
     if not os.path.exists(wrong_file):
         print("No wrong questions log found. Great job!")
         return
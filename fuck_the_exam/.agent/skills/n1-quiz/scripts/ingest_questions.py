@@ -1,24 +1,35 @@
 import requests
 import sys
+import time
 
-def trigger_ingestion():
+def trigger_ingestion(attempts=5):
     """
     Triggers the backend API to ingest questions from JSON files.
-    The ingestion is actually part of the startup and study session logic,
-    but we can trigger it via any endpoint that calls ingest_json_questions.
-    We'll use /api/quiz/study which triggers ingestion.
+    Ingestion is the leader worker's scheduled "ingest" job (every 30 seconds);
+    this runs it right away through the admin jobs endpoint. With several
+    workers only the leader can run it, so a 409 from a follower is retried.
     """
-    url = "http://localhost:8000/api/quiz/study"
-    
-    try:
-        print("Triging ingestion by calling study session endpoint...")
-        response = requests.get(url, timeout=30)
-        response.raise_for_status()
-        print("Successfully triggered ingestion! New questions should be in the DB.")
-        return True
-    except Exception as e:
-        print(f"Error: {e}")
-        return False
+    url = "http://localhost:8000/api/admin/jobs/ingest/run"
+
+    for attempt in range(attempts):
+        try:
+            print("Triggering ingestion job...")
+            response = requests.post(url, timeout=300)
+            if response.status_code == 409 and attempt < attempts - 1:
+                print(f"Not run: {response.json().get('detail')}; retrying...")
+                time.sleep(1)
+                continue
+            response.raise_for_status()
+            result = response.json()
+            if result.get("last_outcome") != "ok":
+                print(f"Ingestion failed: {result.get('last_error')}")
+                return False
+            print("Successfully ran ingestion! New questions should be in the DB.")
+            return True
+        except Exception as e:
+            print(f"Error: {e}")
+            return False
+    return False
 
 if __name__ == "__main__":
-    trigger_ingestion()
+    sys.exit(0 if trigger_ingestion() else 1)
@@ -1,9 +1,13 @@
 import os
 import json
 import hashlib
+import time
 import requests
 from typing import List, Dict
 
+from .services import llm_json
+from .services.metrics import LLM_LATENCY, LLM_REQUESTS, LLM_RETRIES, LLM_TOKENS
+
 # SiliconFlow API Configuration
 API_URL = "https://api.siliconflow.cn/v1/chat/completions"
 # Ideally this should be in an env var like SILICONFLOW_API_KEY
@@ -12,6 +16,26 @@ API_KEY = "sk-dghfpxoqxxsahxgcljjlkoyjebiyulmwdegyrhmztqecyiwt"
 
 MODEL_NAME = "deepseek-ai/DeepSeek-V3"
 
+def _post_chat(stage: str, headers: Dict, data: Dict, timeout: int) -> requests.Response:
+    """requests.post to the chat API, recording latency, outcome and token usage for `stage`."""
+    start = time.perf_counter()
+    try:
+        response = requests.post(API_URL, headers=headers, json=data, timeout=timeout)
+    except Exception:
+        LLM_LATENCY.observe(time.perf_counter() - start, stage=stage)
+        LLM_REQUESTS.inc(stage=stage, outcome="error")
+        raise
+    LLM_LATENCY.observe(time.perf_counter() - start, stage=stage)
+    LLM_REQUESTS.inc(stage=stage, outcome="ok" if response.ok else f"http_{response.status_code}")
+    if response.ok:
+        try:
+            usage = response.json().get("usage") or {}
+            LLM_TOKENS.inc(usage.get("prompt_tokens", 0), stage=stage, kind="prompt")
+            LLM_TOKENS.inc(usage.get("completion_tokens", 0), stage=stage, kind="completion")
+        except ValueError:
+            pass
+    return response
+
 def get_grammar_grounding(topic: str) -> str:
     """
     Looks up the topic in backend/知识点/语法.md to provide grounding.
@@ -92,43 +116,19 @@ def _single_generate_batch(topic_raw: str, batch_size: int, headers: Dict, max_r
     for attempt in range(max_retries):
         try:
             print(f"    [Agent: Generator] Requesting {batch_size} questions...")
-            response = requests.post(API_URL, headers=headers, json=data, timeout=60)
+            if attempt > 0:
+                LLM_RETRIES.inc(stage="generator")
+            response = _post_chat("generator", headers, data, timeout=60)
             response.raise_for_status()
             print(f"    [Agent: Generator] Received response.")
             content = response.json()['choices'][0]['message']['content'].strip()
-            
-            # Robust JSON extraction
-            import re
-            json_match = re.search(r'(\[.*\]|\{.*\})', content, re.DOTALL)
-            if json_match:
-                content = json_match.group(0)
-            
-            questions = json.loads(content)
-            if isinstance(questions, dict) and "questions" in questions: questions = questions["questions"]
-            if isinstance(questions, dict): questions = [questions] # Handle single object return
-            
-            # Flatten explanation if it's an object
-            if questions:
-                for q in questions:
-                    if isinstance(q.get('explanation'), dict):
-                        exp = q['explanation']
-                        flat_exp = "\n".join([f"{k}: {v}" for k, v in exp.items()])
-                        q['explanation'] = flat_exp
-                    
-                    # Ensure basic fields exist
-                    if not q.get('explanation'):
-                        q['explanation'] = "[AI生成辅助] 考点分析加载中，请结合前后文理解。"
-                    if not q.get('memorization_tip'):
-                        q['memorization_tip'] = "记忆点正在整理中。"
-                    if not q.get('knowledge_point'):
-                        q['knowledge_point'] = topic
-                    
-                    # Deduplication: If tip is just a repetition of explanation, clear it or shorten it
-                    exp_text = q['explanation'].strip()
-                    tip_text = q['memorization_tip'].strip()
-                    if tip_text in exp_text and len(tip_text) > 10:
-                        q['memorization_tip'] = "见上方详细解析中的逻辑要点。"
-                break
+
+            # Repair and validate locally; only a reply with no usable question is worth another call
+            questions, report = llm_json.parse_questions(content, topic, stage="generator")
+            print(f"    [Agent: Generator] Parsed: {llm_json.summarize(report)}")
+            if not questions:
+                raise ValueError("no usable questions in response")
+            break
         except Exception as e:
             print(f"  [Generator] Batch Attempt {attempt+1} failed: {e}")
             if 'response' in locals() and response is not None:
@@ -193,20 +193,18 @@ def _review_questions(questions: List[Dict], topic: str, grounding: str, headers
     
     try:
         print(f"    [Agent: Reviewer] Checking {len(questions)} questions...")
-        response = requests.post(API_URL, headers=headers, json=data, timeout=60)
+        response = _post_chat("reviewer", headers, data, timeout=60)
         response.raise_for_status()
         print(f"    [Agent: Reviewer] Decision received.")
         content = response.json()['choices'][0]['message']['content'].strip()
-        
-        json_start = content.find('[')
-        json_end = content.rfind(']') + 1
-        if json_start != -1 and json_end > json_start:
-            content = content[json_start:json_end]
-            
-        return json.loads(content)
+
+        verdicts, report = llm_json.parse_reviews(content, len(questions))
+        print(f"    [Agent: Reviewer] Parsed: {llm_json.summarize(report)}")
+        if verdicts is not None:
+            return verdicts
     except Exception as e:
         print(f"  [Reviewer] Error: {e}")
-        return [{"status": "PASS", "issues": []} for _ in questions]
+    return [{"status": "PASS", "issues": []} for _ in questions]
 
 def _optimize_questions(questions: List[Dict], review_results: List[Dict], topic: str, grounding: str, headers: Dict) -> List[Dict]:
     """
@@ -240,18 +238,21 @@ def _optimize_questions(questions: List[Dict], review_results: List[Dict], topic
     
     try:
         print(f"    [Agent: Optimizer] Fixing issues...")
-        response = requests.post(API_URL, headers=headers, json=data, timeout=90)
+        response = _post_chat("optimizer", headers, data, timeout=90)
         response.raise_for_status()
         print(f"    [Agent: Optimizer] Fixed content received.")
         content = response.json()['choices'][0]['message']['content'].strip()
-        
-        json_start = content.find('[')
-        json_end = content.rfind(']') + 1
-        if json_start != -1 and json_end > json_start:
-            content = content[json_start:json_end]
-            
-        fixed = json.loads(content)
-        return fixed if isinstance(fixed, list) else questions
+
+        fixed, report = llm_json.parse_questions(content, topic, stage="optimizer")
+        print(f"    [Agent: Optimizer] Parsed: {llm_json.summarize(report)}")
+        if report["items"] == len(questions) and not report["dropped"]:
+            return fixed
+        if report["items"] == len(questions):
+            # Keep the original wherever the fix did not survive validation
+            kept = {drop["index"] for drop in report["dropped"]}
+            fixed_iter = iter(fixed)
+            return [questions[i] if i in kept else next(fixed_iter) for i in range(len(questions))]
+        return fixed or questions
     except Exception as e:
         print(f"  [Optimizer] Error: {e}")
         return questions
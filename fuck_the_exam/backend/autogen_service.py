@@ -3,53 +3,67 @@ import threading
 import os
 import json
 import hashlib
-import re
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 from sqlalchemy.orm import Session
 from sqlalchemy import func, distinct
 
 from . import models, ai_client, database
+from .services.metrics import AUTOGEN_CYCLE, GENERATED_QUESTIONS
+from .services.eligibility import EligibilityIndex, UNCATEGORIZED
+from .services.topic_store import TopicStore
+from .services.template_generator import TemplateGenerator
 
 class AutoGenService:
-    def __init__(self, db_session_factory):
+    def __init__(self, db_session_factory, eligibility: EligibilityIndex = None, topic_store: TopicStore = None,
+                 template_generator: TemplateGenerator = None, ai_timeout: float = 180, ai_backoff: float = 1800):
         self.db_session_factory = db_session_factory
+        self.eligibility = eligibility or EligibilityIndex()
+        self.topic_store = topic_store or TopicStore(os.path.join(os.path.dirname(__file__), "json_questions"))
+        # Offline fallback: used when the AI call fails or exceeds ai_timeout, and for
+        # ai_backoff seconds afterwards so an outage or rate limit is not retried per topic
+        self.template_generator = template_generator
+        self.ai_timeout = ai_timeout
+        self.ai_backoff = ai_backoff
+        self._ai_unavailable_until = 0.0
+        self._ai_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="autogen-ai")
         self.is_running = False
-        self.thread = None
+        # Set by stop() so a running cycle ends at the next topic (lets a leader hand over promptly)
+        self._stop_event = threading.Event()
 
     def start(self):
+        """Enables cycles; the leader's scheduler calls run_cycle() every few hours."""
         if not self.is_running:
             self.is_running = True
-            self.thread = threading.Thread(target=self._run, daemon=True)
-            self.thread.start()
+            self._stop_event.clear()
             print("AutoGenService started.")
 
     def stop(self):
         self.is_running = False
-        if self.thread:
-            self.thread.join()
+        self._stop_event.set()
+        self._ai_executor.shutdown(wait=False)
         print("AutoGenService stopped.")
 
-    def _run(self):
-        # Initial delay to allow the main app to start smoothly
-        print("AutoGenService: Initial delay of 60 seconds...")
-        time.sleep(60)
-
-        while self.is_running:
-            print("AutoGenService: Running check for question generation.")
-            try:
-                self.check_and_generate_questions()
-            except Exception as e:
-                print(f"Error in AutoGenService loop: {e}")
-            
-            print(f"AutoGenService: Check finished. Sleeping for 4 hours...")
-            # Sleep for 4 hours
-            time.sleep(4 * 60 * 60)
+    def run_cycle(self):
+        if not self.is_running:
+            return
+        print("AutoGenService: Running check for question generation.")
+        cycle_start = time.perf_counter()
+        outcome = "ok"
+        try:
+            self.check_and_generate_questions()
+        except Exception:
+            outcome = "error"
+            raise
+        finally:
+            AUTOGEN_CYCLE.observe(time.perf_counter() - cycle_start, outcome=outcome)
+        print("AutoGenService: Check finished.")
 
     def check_and_generate_questions(self, min_unanswered=10):
         db = self.db_session_factory()
         try:
-            # 1. Get all distinct knowledge points
-            knowledge_points = db.query(distinct(models.Question.knowledge_point)).all()
-            knowledge_points = [kp[0] for kp in knowledge_points if kp[0]]
+            # 1. Unanswered questions per knowledge point, all points at once (question bitsets)
+            unanswered = self.eligibility.unanswered_by_point(db)
+            knowledge_points = [kp for kp in unanswered if kp != UNCATEGORIZED]
             print(f"AutoGenService: Found {len(knowledge_points)} knowledge points to check.")
 
             for point in knowledge_points:
@@ -57,13 +71,8 @@ class AutoGenService:
                     print("AutoGenService: Stopping check early.")
                     break
                     
-                # 2. For each point, count unanswered questions
-                answered_question_ids = db.query(distinct(models.AnswerAttempt.question_id)).join(models.Question).filter(models.Question.knowledge_point == point).subquery()
-                
-                unanswered_count = db.query(models.Question).filter(
-                    models.Question.knowledge_point == point,
-                    ~models.Question.id.in_(answered_question_ids)
-                ).count()
+                # 2. Unanswered count for this point
+                unanswered_count = unanswered[point]
 
                 print(f"AutoGenService: Knowledge point '{point}' has {unanswered_count} unanswered questions.")
 
@@ -74,16 +83,44 @@ class AutoGenService:
                     self._generate_and_save(point, num_to_generate, db)
                 
                 # Yield control to other threads to avoid blocking the server
-                time.sleep(10)
+                self._stop_event.wait(10)
 
         finally:
             db.close()
 
+    def _generate_with_ai(self, topic: str, num_questions: int) -> list:
+        """AI questions, or [] when the API fails or is slower than ai_timeout (it then backs off)."""
+        if time.time() < self._ai_unavailable_until:
+            return []
+        future = self._ai_executor.submit(ai_client.generate_questions_from_topic, topic, num_questions)
+        try:
+            questions = future.result(timeout=self.ai_timeout)
+        except FutureTimeout:
+            print(f"AutoGenService: AI generation for '{topic}' exceeded {self.ai_timeout}s.")
+            questions = []
+        except Exception as e:
+            print(f"AutoGenService: AI generation for '{topic}' failed: {e}")
+            questions = []
+        if not questions:
+            self._ai_unavailable_until = time.time() + self.ai_backoff
+        return questions
+
+    def _generate(self, topic: str, num_questions: int) -> list:
+        questions = self._generate_with_ai(topic, num_questions)
+        if questions:
+            GENERATED_QUESTIONS.inc(len(questions), source="ai")
+            return questions
+        if self.template_generator is not None and self.template_generator.can_generate(topic):
+            questions = self.template_generator.generate(topic, num_questions)
+            print(f"AutoGenService: Using {len(questions)} template questions for '{topic}'.")
+            GENERATED_QUESTIONS.inc(len(questions), source="template")
+        return questions
+
     def _generate_and_save(self, topic: str, num_questions: int, db: Session):
         # Refactored from backend/main.py
         
-        # 1. Generate from AI
-        generated_questions = ai_client.generate_questions_from_topic(topic, num_questions)
+        # 1. Generate from AI (template questions from 语法.md when the API is unavailable)
+        generated_questions = self._generate(topic, num_questions)
         if not generated_questions:
             print(f"Failed to generate questions for topic '{topic}' from AI.")
             return
@@ -116,42 +153,5 @@ class AutoGenService:
         print(f"Successfully generated and saved {len(generated_questions)} questions for '{topic}'.")
 
     def _save_generated_questions_to_file(self, topic: str, questions: list):
-        # Refactored from backend/main.py
-        safe_topic = re.sub(r'[\\/*?:"<>|]', "", topic).replace(" ", "_")
-        filename = f"{safe_topic}.json"
-        json_dir = os.path.join(os.path.dirname(__file__), "json_questions")
-        if not os.path.exists(json_dir):
-            os.makedirs(json_dir)
-            
-        filepath = os.path.join(json_dir, filename)
-        
-        existing_data = []
-        if os.path.exists(filepath):
-            try:
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    content = f.read().strip()
-                    if content:
-                        existing_data = json.loads(content)
-                        if isinstance(existing_data, dict):
-                            existing_data = [existing_data]
-            except Exception as e:
-                print(f"Error reading existing file {filepath}: {e}")
-                existing_data = []
-
-        existing_hashes = {q.get('hash') for q in existing_data if q.get('hash')}
-
-        new_questions = []
-        for q in questions:
-            if 'hash' not in q:
-                 unique_string = f"{q['content']}-{json.dumps(q['options'], sort_keys=True)}"
-                 q['hash'] = hashlib.sha256(unique_string.encode()).hexdigest()
-
-            if q['hash'] not in existing_hashes:
-                new_questions.append(q)
-                existing_hashes.add(q['hash'])
-        
-        if new_questions:
-            final_data = existing_data + new_questions
-            with open(filepath, 'w', encoding='utf-8') as f:
-                json.dump(final_data, f, indent=2, ensure_ascii=False)
-            print(f"Saved {len(new_questions)} new questions to {filepath}")
+        # Same per-topic JSONL files as manual generation (json_questions/n1/), so ingestion sees them
+        self.topic_store.append(topic, questions, "N1")
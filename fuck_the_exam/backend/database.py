@@ -2,6 +2,7 @@ import os
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -23,6 +24,12 @@ engine = create_engine(
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async engine for the hot endpoints: waiting on SQLite no longer holds a threadpool slot
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", DATABASE_URL.replace("sqlite://", "sqlite+aiosqlite://", 1))
+# (longer busy timeout: it shares SQLite's single writer lock with the sync engine)
+async_engine = create_async_engine(ASYNC_DATABASE_URL, connect_args={"timeout": 15})
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
 def create_db_and_tables():
@@ -34,3 +41,7 @@ def get_db():
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -1,13 +1,24 @@
+import asyncio
 import json
 import os
 import re
 import hashlib
-from fastapi import FastAPI, Depends, HTTPException, Header
+import random
+import threading
+import time
+import numpy as np
+from fastapi import FastAPI, Depends, HTTPException, Header, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse, JSONResponse
+from starlette.routing import Match
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from sqlalchemy import func, and_
+from sqlalchemy.orm import Session, joinedload
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, and_, update, insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from typing import List, Optional, Dict, Any
-from datetime import date, datetime, timedelta
+from datetime import date, datetime, timedelta, timezone
 
 import secrets
 from . import models, database, ai_client
@@ -16,24 +27,81 @@ from .services.markdown_service import MarkdownService
 from .services.knowledge_service import KnowledgeService
 from .services.backup_service import BackupService
 from .services.analysis_service import AnalysisService
+from .services.question_cache import QuestionCache
+from .services.srs_scheduler import ActiveScheduler, get_scheduler, reschedule_all
+from .services.review_queue import ReviewQueue
+from .services.eligibility import EligibilityIndex
+from .services.mastery import MasteryEngine
+from .services.irt import IrtCalibrator
+from .services.similarity import PointNeighbors, suggestion_entries
+from .services.leader_lease import LeaderLease, exclusive_file_lock
+from .services import metrics
+from .services import profiler
+from .services.profiler import RequestProfiler
+from .services.startup import StartupPhases
+from .services import question_bank, change_feed
+from .services.topic_store import TopicStore
+from .services.template_generator import TemplateGenerator
+from .services.attempt_log import AttemptLog
+from .services.scheduler import JobScheduler, IntervalTrigger, CronTrigger
 from .autogen_service import AutoGenService
-from pydantic import BaseModel, Json
-
-# Ensure DB tables are created
-models.Base.metadata.create_all(bind=engine)
+from pydantic import BaseModel, Field, Json
 
 app = FastAPI(title="Japanese N1 Quiz App")
 
 autogen_service_instance = None
+leader_lease = None
 
 # Initialize Services
 markdown_service = MarkdownService(base_path=os.path.join(os.getcwd(), "knowledge_base"))
 knowledge_service = KnowledgeService(base_path=os.path.join(os.getcwd(), "backend"))
+point_neighbors = PointNeighbors(
+    knowledge_service,
+    path=os.getenv("POINT_NEIGHBORS_PATH", os.path.join(os.path.dirname(__file__), "point_neighbors.json"))
+)
+knowledge_service.neighbors = point_neighbors
+knowledge_service.question_bank = lambda: current_question_bank()
+template_generator = TemplateGenerator(knowledge_service)
 backup_service = BackupService(
-    db_path=os.path.join(os.getcwd(), "backend", "n1_app.db"),
-    backup_dir=os.path.join(os.getcwd(), "backend", "backups")
+    db_path=os.path.abspath(database.engine.url.database or os.path.join("backend", "n1_app.db")),
+    backup_dir=os.path.join(os.getcwd(), "backend", "backups"),
+    keep_hourly=int(os.getenv("BACKUP_KEEP_HOURLY", "24")),
+    keep_daily=int(os.getenv("BACKUP_KEEP_DAILY", "7")),
+    keep_weekly=int(os.getenv("BACKUP_KEEP_WEEKLY", "8"))
 )
+# Leader takes a database snapshot this often (0 disables scheduled snapshots)
+BACKUP_INTERVAL_MINUTES = float(os.getenv("BACKUP_INTERVAL_MINUTES", "60"))
 analysis_service = AnalysisService(ai_client=ai_client)
+question_cache = QuestionCache(max_entries=int(os.getenv("QUESTION_CACHE_MAX", "50000")))
+topic_store = TopicStore(os.path.join(os.path.dirname(__file__), "json_questions"))
+# SRS_ALGORITHM until /api/admin/srs/reschedule stores another one in srs_settings
+srs_scheduler = ActiveScheduler(get_scheduler(os.getenv("SRS_ALGORITHM", "sm2")))
+review_queue = ReviewQueue()
+eligibility = EligibilityIndex(max_bytes=int(os.getenv("ELIGIBILITY_CACHE_MB", "64")) * 1024 * 1024)
+mastery = MasteryEngine(
+    eligibility,
+    half_life_days=float(os.getenv("MASTERY_HALF_LIFE_DAYS", "14")),
+    max_bytes=int(os.getenv("MASTERY_CACHE_MB", "64")) * 1024 * 1024
+)
+irt = IrtCalibrator(
+    eligibility,
+    target_p=float(os.getenv("IRT_TARGET_P", "0.7")),
+    min_new_attempts=int(os.getenv("IRT_REFRESH_MIN_ATTEMPTS", "50"))
+)
+# ATTEMPT_LOG=1: submits append to a group-committed log that the leader folds into SQLite in bulk
+attempt_log = AttemptLog(
+    os.getenv("ATTEMPT_LOG_DIR", os.path.join(os.path.dirname(__file__), "attempt_log")),
+    apply_events=lambda events: apply_logged_attempts(events),
+    group_commit_ms=float(os.getenv("ATTEMPT_LOG_GROUP_COMMIT_MS", "0.5"))
+) if os.getenv("ATTEMPT_LOG", "0") == "1" else None
+# The leader's periodic maintenance (see register_maintenance_jobs)
+job_scheduler = JobScheduler(
+    os.getenv("SCHEDULER_STATE_PATH", os.path.join(os.path.dirname(__file__), "scheduler_state.json"))
+)
+startup_phases = StartupPhases()
+request_profiler = RequestProfiler(
+    profile_dir=os.getenv("PROFILE_DIR", os.path.join(os.getcwd(), "backend", "profiles"))
+)
 
 # Add CORS middleware
 origins = [
@@ -54,6 +122,65 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# --- Metrics: per-route latency plus the SQL each request ran ---
+metrics.instrument_engine(engine)
+metrics.instrument_engine(database.async_engine.sync_engine)
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    tally, token = metrics.begin_request_sql()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        metrics.end_request_sql(token)
+        # Route template (not the raw path) keeps label cardinality bounded
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        metrics.HTTP_LATENCY.observe(time.perf_counter() - start, method=request.method, route=route, status=str(status))
+        metrics.HTTP_SQL_STATEMENTS.observe(tally.statements, route=route)
+        metrics.HTTP_SQL_SECONDS.observe(tally.seconds, route=route)
+
+# --- On-demand profiler (armed through /api/admin/profiler) ---
+profiler.instrument_engine(engine, request_profiler)
+profiler.instrument_engine(database.async_engine.sync_engine, request_profiler)
+
+def match_route(scope):
+    for route in app.router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route
+    return None
+
+@app.middleware("http")
+async def profile_requests(request: Request, call_next):
+    if not request_profiler.armed:
+        return await call_next(request)
+
+    route = match_route(request.scope)
+    session = request_profiler.begin(
+        request.method, request.url.path,
+        getattr(route, "path", None), getattr(route, "endpoint", None)
+    )
+    if session is None:
+        return await call_next(request)
+
+    token = profiler.activate(session)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        profiler.deactivate(token)
+        duration_ms = (time.perf_counter() - start) * 1000
+        saved = await run_in_threadpool(request_profiler.end, session, status, duration_ms)
+    if saved:
+        response.headers["X-Profile-Id"] = session.request_id
+    return response
+
 # --- User Management Dependency ---
 def get_current_user_id(x_user_id: Optional[int] = Header(None)):
     if x_user_id is None:
@@ -103,6 +230,27 @@ class AnswerSubmit(BaseModel):
     selected_answer: str
     quality: Optional[int] = None # SM-2 Quality (0-5) or simplified (1-4)
 
+class AnswerBatchItem(BaseModel):
+    client_id: str # Client-generated unique id; re-sending the same id is a no-op
+    question_id: int
+    selected_answer: str
+    quality: Optional[int] = None
+    answered_at: Optional[datetime] = None # Client timestamp (with offset; naive is UTC), defaults to server time
+
+class AnswerBatch(BaseModel):
+    answers: List[AnswerBatchItem]
+
+class ProfilerArmRequest(BaseModel):
+    routes: List[str] = [] # Route templates, e.g. "/api/quiz/gap"; always profiled
+    threshold_ms: Optional[float] = None # Profile every request, keep those slower than this
+    interval_ms: Optional[float] = None
+    max_profiles: Optional[int] = None
+
+class RescheduleRequest(BaseModel):
+    algorithm: str = "sm2"
+    params: Dict[str, Any] = {} # Scheduler tuning, e.g. {"desired_retention": 0.85}
+    user_id: Optional[int] = None # Limit the recompute to one user
+
 class WrongQuestion(BaseModel):
     id: int
     question: Question
@@ -115,6 +263,7 @@ class GenerateRequest(BaseModel):
     topic: str
     num_questions: int = 5
     exam_type: str = "N1"
+    source: str = "ai"  # "ai" (template fallback when the API returns nothing) or "template"
 
 class StatsResponse(BaseModel):
     total_answered: int
@@ -126,9 +275,16 @@ class StatsResponse(BaseModel):
 class QuizSessionPayload(BaseModel):
     session_key: Optional[str] = "default"
     topic: Optional[str] = None
-    questions: List[Dict[str, Any]]
-    results: List[Any]
-    current_index: int = 0
+    questions: List[Dict[str, Any]] = [] # Legacy: full payloads, only their ids are stored
+    question_ids: Optional[List[int]] = None
+    results: List[Any] = []
+    current_index: int = Field(0, ge=0)
+
+class QuizSessionPatch(BaseModel):
+    session_key: Optional[str] = "default"
+    result_index: Optional[int] = None # Slot in results to overwrite with `result`
+    result: Optional[Dict[str, Any]] = None
+    current_index: Optional[int] = Field(None, ge=0) # Must address a question of the session (422 otherwise)
 # --- Auth Utils ---
 def hash_password(password: str, salt: str = None):
     if salt is None:
@@ -141,159 +297,471 @@ def verify_password(password: str, salt: str, phash: str):
 
 # --- API Endpoints ---
 
-@app.on_event("startup")
-def on_startup():
-    global autogen_service_instance
+def run_schema_migrations():
+    """
+    Critical startup phase: creates missing tables and applies only the column/index
+    migrations the schema still lacks (one inspection instead of failing ALTERs).
+    Workers take turns under a file lock, so they never race on a fresh database.
+    """
+    with exclusive_file_lock(os.getenv("SCHEMA_LOCK_PATH", os.path.join(os.getcwd(), "backend", "schema.lock"))):
+        return _run_schema_migrations()
+
+def _run_schema_migrations():
+    from sqlalchemy import text, inspect
     database.create_db_and_tables()
+    inspector = inspect(engine)
+    columns = {t: {c["name"] for c in inspector.get_columns(t)}
+               for t in ("questions", "users", "answer_attempts", "question_calibration", "user_ability")}
+    indexes = {i["name"] for t in ("quiz_sessions", "answer_attempts", "wrong_questions", "user_favorites") for i in inspector.get_indexes(t)}
+    applied = []
+    failed = []
+
     # Migration: Add is_favorite column if it doesn't exist
-    try:
-        from sqlalchemy import text
-        db = database.SessionLocal()
-        db.execute(text('ALTER TABLE questions ADD COLUMN is_favorite BOOLEAN DEFAULT 0'))
-        db.commit()
-        db.close()
-        print("Migration: Added is_favorite column to questions table.")
-    except Exception as e:
-        # Probable cause: column already exists
-        pass
+    if "is_favorite" not in columns["questions"]:
+        try:
+            db = database.SessionLocal()
+            db.execute(text('ALTER TABLE questions ADD COLUMN is_favorite BOOLEAN DEFAULT 0'))
+            db.commit()
+            db.close()
+            applied.append("questions.is_favorite")
+            print("Migration: Added is_favorite column to questions table.")
+        except Exception as e:
+            print(f"Migration: questions.is_favorite failed: {e}")
+            failed.append("questions.is_favorite")
 
     # Migration: Add password columns to users
+    if "password_hash" not in columns["users"]:
+        try:
+            db = database.SessionLocal()
+            db.execute(text('ALTER TABLE users ADD COLUMN password_hash VARCHAR(128)'))
+            db.execute(text('ALTER TABLE users ADD COLUMN salt VARCHAR(32)'))
+            db.commit()
+            db.close()
+            applied.append("users.password_hash")
+            print("Migration: Added password columns to users table.")
+        except Exception as e:
+            print(f"Migration: users password columns failed: {e}")
+            failed.append("users password columns")
+
+    # Migration: Unique (user_id, session_key) for session upserts, keeping the newest duplicate
+    if "uq_quiz_sessions_user_session" not in indexes:
+        try:
+            db = database.SessionLocal()
+            db.execute(text(
+                'DELETE FROM quiz_sessions WHERE id NOT IN '
+                '(SELECT MAX(id) FROM quiz_sessions GROUP BY user_id, session_key)'
+            ))
+            db.execute(text(
+                'CREATE UNIQUE INDEX IF NOT EXISTS uq_quiz_sessions_user_session '
+                'ON quiz_sessions (user_id, session_key)'
+            ))
+            db.commit()
+            db.close()
+            applied.append("uq_quiz_sessions_user_session")
+        except Exception as e:
+            print(f"Migration: quiz_sessions unique index failed: {e}")
+            failed.append("quiz_sessions unique index")
+
+    # Migration: client_id on answer_attempts for idempotent batch sync
+    if "client_id" not in columns["answer_attempts"]:
+        try:
+            db = database.SessionLocal()
+            db.execute(text('ALTER TABLE answer_attempts ADD COLUMN client_id VARCHAR(64)'))
+            db.commit()
+            db.close()
+            applied.append("answer_attempts.client_id")
+            print("Migration: Added client_id column to answer_attempts table.")
+        except Exception as e:
+            print(f"Migration: answer_attempts.client_id failed: {e}")
+            failed.append("answer_attempts.client_id")
+    if "uq_answer_attempts_user_client" not in indexes:
+        try:
+            db = database.SessionLocal()
+            db.execute(text(
+                'CREATE UNIQUE INDEX IF NOT EXISTS uq_answer_attempts_user_client '
+                'ON answer_attempts (user_id, client_id)'
+            ))
+            db.commit()
+            db.close()
+            applied.append("uq_answer_attempts_user_client")
+        except Exception as e:
+            print(f"Migration: answer_attempts client_id index failed: {e}")
+            failed.append("answer_attempts client_id index")
+
+    # Migration: lookup indexes for SRS rows
+    if not {"ix_wrong_questions_user_question", "ix_wrong_questions_user_next_review"} <= indexes:
+        try:
+            db = database.SessionLocal()
+            db.execute(text(
+                'CREATE INDEX IF NOT EXISTS ix_wrong_questions_user_question '
+                'ON wrong_questions (user_id, question_id)'
+            ))
+            db.execute(text(
+                'CREATE INDEX IF NOT EXISTS ix_wrong_questions_user_next_review '
+                'ON wrong_questions (user_id, next_review_at)'
+            ))
+            db.commit()
+            db.close()
+            applied.append("ix_wrong_questions")
+        except Exception as e:
+            print(f"Migration: wrong_questions index failed: {e}")
+            failed.append("wrong_questions index")
+
+    # Migration: favorites by user, and the partial index behind the orphaned-attempt check
+    # (both found as table scans by backend/scripts/check_query_plans.py)
+    if not {"ix_user_favorites_user_question", "ix_answer_attempts_orphans"} <= indexes:
+        try:
+            db = database.SessionLocal()
+            db.execute(text(
+                'CREATE INDEX IF NOT EXISTS ix_user_favorites_user_question '
+                'ON user_favorites (user_id, question_id)'
+            ))
+            db.execute(text(
+                'CREATE INDEX IF NOT EXISTS ix_answer_attempts_orphans '
+                'ON answer_attempts (id) WHERE question_id IS NULL'
+            ))
+            db.commit()
+            db.close()
+            applied.append("ix_user_favorites_user_question")
+            applied.append("ix_answer_attempts_orphans")
+        except Exception as e:
+            print(f"Migration: favorites/orphan index failed: {e}")
+            failed.append("favorites/orphan index")
+
+    # Migration: run_id on the calibration tables, so workers load only the rows a run changed
+    if "run_id" not in columns["question_calibration"] or "run_id" not in columns["user_ability"]:
+        try:
+            db = database.SessionLocal()
+            for table in ("question_calibration", "user_ability"):
+                if "run_id" not in columns[table]:
+                    db.execute(text(f'ALTER TABLE {table} ADD COLUMN run_id INTEGER'))
+                db.execute(text(f'CREATE INDEX IF NOT EXISTS ix_{table}_run_id ON {table} (run_id)'))
+            db.commit()
+            db.close()
+            applied.append("calibration run_id")
+            print("Migration: Added run_id columns to the calibration tables.")
+        except Exception as e:
+            print(f"Migration: calibration run_id failed: {e}")
+            failed.append("calibration run_id")
+
+    # Migration: change-feed triggers for /api/sync (the log is seeded with the existing rows)
+    db = database.SessionLocal()
     try:
-        from sqlalchemy import text
-        db = database.SessionLocal()
-        db.execute(text('ALTER TABLE users ADD COLUMN password_hash VARCHAR(128)'))
-        db.execute(text('ALTER TABLE users ADD COLUMN salt VARCHAR(32)'))
-        db.commit()
-        db.close()
-        print("Migration: Added password columns to users table.")
+        if not change_feed.installed(db):
+            seeded = change_feed.install(db)
+            db.commit()
+            applied.append("sync_changes triggers")
+            print(f"Migration: Installed change-feed triggers ({seeded} existing rows logged).")
     except Exception as e:
-        pass
-    
-    ingest_json_questions()
+        db.rollback()
+        print(f"Migration: change-feed triggers failed: {e}")
+        failed.append("change-feed triggers")
+    finally:
+        db.close()
+    if failed:
+        # Serving on a half-migrated schema fails in odd places: keep the worker unready instead
+        raise RuntimeError(f"migrations failed: {', '.join(failed)} (applied: {', '.join(applied) or 'none'})")
+    return {"applied": applied}
+
+@app.on_event("startup")
+def on_startup():
+    """
+    Critical phase only (schema check and pending migrations), so the worker serves
+    traffic right away. Ingestion, restore and cache warm-up run in the background and
+    are reported by /readyz.
+    """
+    global leader_lease
+    startup_phases.run("schema", run_schema_migrations, required=True)
+    startup_phases.expect("ingest", "restore", "cache_warm")
+
+    # Background jobs run in exactly one worker; the others only serve requests
+    leader_lease = LeaderLease(
+        lock_path=os.getenv("LEADER_LOCK_PATH", os.path.join(os.getcwd(), "backend", "leader.lock")),
+        on_acquire=start_background_services,
+        on_release=stop_background_services
+    )
+    leader_lease.start()
+    if not leader_lease.is_leader:
+        startup_phases.skip("ingest", "follower: the leader worker ingests")
+        startup_phases.skip("restore", "follower: the leader worker restores")
+        threading.Thread(target=startup_phases.run, args=("cache_warm", warm_caches), daemon=True, name="cache-warmup").start()
 
-    # Data Recovery: If no wrong questions but backup exists, restore from JSON.
+@app.on_event("shutdown")
+def on_shutdown():
+    if leader_lease:
+        leader_lease.stop()
+    # Drain queued study-log entries
+    markdown_service.close()
+    if attempt_log:
+        attempt_log.close()
+
+def owns_background_jobs() -> bool:
+    """True in the leader worker (or when no lease is running, e.g. scripts importing the app)."""
+    return leader_lease is None or leader_lease.is_leader
+
+def start_background_services():
+    """Runs once in the worker that wins the leader lease; the work itself runs off the startup path."""
+    threading.Thread(target=run_leader_warmup, daemon=True, name="leader-warmup").start()
+    register_maintenance_jobs()
+    job_scheduler.start()
+
+def run_leader_warmup():
+    startup_phases.run("ingest", ingest_json_questions)
+    startup_phases.run("restore", restore_progress)
+    # After ingestion, so the warm caches include the new questions
+    startup_phases.run("cache_warm", warm_caches)
+
+def restore_progress():
+    """Data Recovery: users with no SRS rows get theirs back from the JSON backup."""
     db_rec = SessionLocal()
     try:
-        if db_rec.query(models.WrongQuestion).count() == 0:
-            restored = backup_service.restore_progress_from_json(db_rec)
-            if restored > 0:
-                print(f"Recovery: Restored {restored} SRS records from backup.")
-    except Exception as e:
-        print(f"Recovery failed: {e}")
+        restored = backup_service.restore_progress_from_json(db_rec)
+        if restored > 0:
+            print(f"Recovery: Restored {restored} SRS records from backup.")
+        return {"restored": restored}
     finally:
         db_rec.close()
 
-    # Start the autogen service
-    autogen_service_instance = AutoGenService(database.SessionLocal)
-    autogen_service_instance.start()
+def warm_caches():
+    """Question payloads (up to QUESTION_CACHE_WARM) and the eligibility catalog."""
+    db = SessionLocal()
+    try:
+        warmed = question_cache.warm(db, int(os.getenv("QUESTION_CACHE_WARM", "20000")))
+        eligibility.warm(db)
+        return {"questions": warmed}
+    finally:
+        db.close()
 
-@app.on_event("shutdown")
-def on_shutdown():
-    global autogen_service_instance
+def stop_background_services():
+    # Ends a running autogen cycle at its next topic, so the scheduler's wait is short
     if autogen_service_instance:
         autogen_service_instance.stop()
+    job_scheduler.stop()
+
+def register_maintenance_jobs():
+    """
+    The leader's periodic work, all on job_scheduler: intervals count from the previous
+    start and survive restarts (scheduler_state.json); run state and durations are in
+    /api/admin/jobs and the scheduler_job_* metrics.
+    """
+    global autogen_service_instance
+    # Mirrors SRS changes made in any worker (and changes requests flagged) into the progress backup
+    job_scheduler.add_job("progress_backup", backup_progress, IntervalTrigger(15))
+    if BACKUP_INTERVAL_MINUTES > 0:
+        job_scheduler.add_job("db_snapshot", take_scheduled_snapshot, IntervalTrigger(BACKUP_INTERVAL_MINUTES * 60), jitter=60)
+    # JSON files dropped into json_questions (the warm-up ingests once at startup)
+    job_scheduler.add_job("ingest", ingest_json_questions, IntervalTrigger(30, initial_delay=30))
+    # Fold deletes/updates appended to topic files once they pile up
+    job_scheduler.add_job("topic_compaction", topic_store.compact_pending, IntervalTrigger(60), jitter=5)
+    # Difficulty/ability calibration: full fit the first time, incremental after new attempts
+    job_scheduler.add_job("calibration", with_session(irt.refresh), IntervalTrigger(60), jitter=10)
+    # Related-point table: full build daily, incremental when points are added
+    job_scheduler.add_job("point_neighbors", with_session(point_neighbors.update), IntervalTrigger(300), jitter=30)
+    job_scheduler.add_job("orphan_attempts", delete_orphan_attempts, IntervalTrigger(3600), jitter=60)
+    # Drops /api/sync log entries superseded by a later change to the same row
+    job_scheduler.add_job("sync_log_compaction", with_session(change_feed.compact), IntervalTrigger(3600), jitter=60)
+    # Rebuilds the catalog and payloads dropped by deletes and reschedules before a request has to
+    job_scheduler.add_job("cache_warm", warm_caches, IntervalTrigger(600, initial_delay=600), jitter=60)
+    job_scheduler.add_job("sqlite_maintenance", run_sqlite_maintenance,
+                          CronTrigger(os.getenv("SQLITE_MAINTENANCE_CRON", "30 3 * * *")))
+    if attempt_log:
+        job_scheduler.add_job("attempt_log_compaction", attempt_log.compact,
+                              IntervalTrigger(float(os.getenv("ATTEMPT_LOG_COMPACT_SECONDS", "1"))))
+
+    # Question generation (AUTOGEN_ENABLED=0 turns it off, e.g. for load tests)
+    if os.getenv("AUTOGEN_ENABLED", "1") != "0":
+        autogen_service_instance = AutoGenService(
+            database.SessionLocal, eligibility, topic_store, template_generator,
+            ai_timeout=float(os.getenv("AUTOGEN_AI_TIMEOUT", "180"))
+        )
+        autogen_service_instance.start()
+        job_scheduler.add_job("autogen", autogen_service_instance.run_cycle,
+                              IntervalTrigger(4 * 60 * 60, initial_delay=60), jitter=300)
+
+def with_session(fn):
+    """Job body calling fn(db) on its own session."""
+    def run():
+        db = SessionLocal()
+        try:
+            return fn(db)
+        finally:
+            db.close()
+    return run
+
+_last_backup_fingerprint = None
+_backup_requested = threading.Event()
+
+def backup_progress():
+    """Exports the progress backup when an SRS row changed in any worker or a request asked for it."""
+    global _last_backup_fingerprint
+    db = SessionLocal()
+    try:
+        fingerprint = tuple(backup_service.progress_fingerprint(db))
+    finally:
+        db.close()
+    if fingerprint == _last_backup_fingerprint and not _backup_requested.is_set():
+        return
+    _backup_requested.clear()
+    export_progress_backup()
+    _last_backup_fingerprint = fingerprint
+
+def request_progress_backup():
+    """
+    Called after a request changed progress: the leader's progress_backup job runs next
+    instead of an export on the request path (requests during a run fold into one follow-up).
+    In a follower this is a no-op; the job's fingerprint check picks the change up.
+    """
+    _backup_requested.set()
+    job_scheduler.run_soon("progress_backup")
+
+def take_scheduled_snapshot():
+    job = backup_service.start_snapshot(reason="scheduled", wait=True)
+    if job.get("error"):
+        raise RuntimeError(job["error"])
+
+def delete_orphan_attempts():
+    """Data hygiene: attempts left with a NULL question_id (checked first, so the common case takes no write lock)."""
+    db = SessionLocal()
+    try:
+        if db.query(models.AnswerAttempt.id).filter(models.AnswerAttempt.question_id == None).first():
+            deleted = db.query(models.AnswerAttempt).filter(models.AnswerAttempt.question_id == None)\
+                .delete(synchronize_session=False)
+            db.commit()
+            print(f"Maintenance: deleted {deleted} attempts without a question.")
+    finally:
+        db.close()
+
+def run_sqlite_maintenance():
+    """Refreshes the planner's statistics and, in WAL mode, truncates the write-ahead log."""
+    with engine.connect() as conn:
+        conn.exec_driver_sql("PRAGMA optimize")
+        if conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal":
+            conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+
+_ingest_lock = threading.Lock()
+QUESTION_BANK_SNAPSHOT = os.getenv("QUESTION_BANK_SNAPSHOT", os.path.join(os.path.dirname(__file__), "question_bank.snap"))
+_question_bank: Optional[question_bank.QuestionBankSnapshot] = None
+_ingested_signature = None
 
 def ingest_json_questions():
     """
-    Scans backend/json_questions for .json files and imports them.
+    Scans backend/json_questions for .json files (through the question bank snapshot) and imports them.
+    Run by the leader's startup warm-up and its "ingest" job (POST /api/admin/jobs/ingest/run
+    to run it now); returns immediately if a scan is already running.
     """
+    if not _ingest_lock.acquire(blocking=False):
+        return
+    try:
+        _ingest_json_questions()
+    finally:
+        _ingest_lock.release()
+
+def _ingest_json_questions():
     json_dir = os.path.join(os.path.dirname(__file__), "json_questions")
     if not os.path.exists(json_dir):
         os.makedirs(json_dir)
         print(f"Created directory: {json_dir}")
         return
 
-    import glob
-    import hashlib
-    
-    # Scan both n1/ and databricks/ subfolders
-    base_json_dir = os.path.join(os.path.dirname(__file__), "json_questions")
-    files = []
-    for mode in ["n1", "databricks"]:
-        mode_dir = os.path.join(base_json_dir, mode)
-        if os.path.exists(mode_dir):
-            files.extend([(f, mode.upper()) for f in glob.glob(os.path.join(mode_dir, "*.json"))])
-    
+    # Re-parses only JSON files whose size/mtime changed since the last build
+    snapshot, changed_files = question_bank.build_snapshot(json_dir, QUESTION_BANK_SNAPSHOT)
+    global _question_bank, _ingested_signature
+    _question_bank = snapshot
+    first_pass = _ingested_signature is None
+    if snapshot.signature == _ingested_signature:
+        return
+
+    # First pass in this process: diff every record against the DB (fresh DB, edits made
+    # while the app was down); afterwards only the re-parsed files
+    if first_pass:
+        candidates = range(len(snapshot))
+    else:
+        candidates = [i for relpath in changed_files for i in snapshot.records_of(relpath)]
+    hashes = snapshot.column("hash")
+
     db = database.SessionLocal()
-    
     try:
-        count = 0
-        for json_file, mode_type in files:
-            try:
-                with open(json_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                original_is_dict = isinstance(data, dict)
-                file_modified = False
-                    
-                if isinstance(data, dict): 
-                     data = [data]
-                
-                default_point = os.path.basename(json_file).replace('.json', '')
-
-                for q_data in data:
-                    # Normalize options if they are flat option_a, option_b etc.
-                    if 'options' not in q_data and 'option_a' in q_data:
-                        q_data['options'] = {
-                            'A': q_data.get('option_a'),
-                            'B': q_data.get('option_b'),
-                            'C': q_data.get('option_c'),
-                            'D': q_data.get('option_d')
-                        }
-                    
-                    # Normalize field names (support both formats)
-                    if 'question' in q_data and 'content' not in q_data:
-                        q_data['content'] = q_data['question']
-                    if 'answer' in q_data and 'correct_answer' not in q_data:
-                        q_data['correct_answer'] = q_data['answer']
-
-                    # Backfill knowledge_point from filename if missing
-                    if not q_data.get('knowledge_point'):
-                        q_data['knowledge_point'] = default_point
-                        file_modified = True
-
-                    # Validate required fields
-                    if 'content' not in q_data or 'options' not in q_data or 'correct_answer' not in q_data:
-                        continue # Silent skip
-
-                    # Generate Hash if missing
-                    if 'hash' not in q_data:
-                        unique_string = f"{q_data['content']}-{json.dumps(q_data['options'], sort_keys=True)}"
-                        q_data['hash'] = hashlib.sha256(unique_string.encode()).hexdigest()
-                    
-                    # Check Duplicate
-                    exists = db.query(models.Question).filter(models.Question.hash == q_data['hash']).first()
-                    if not exists:
-                        db_q = models.Question(
-                            content=q_data['content'],
-                            options=json.dumps(q_data['options'], ensure_ascii=False) if isinstance(q_data['options'], (dict, list)) else q_data['options'],
-                            correct_answer=q_data['correct_answer'],
-                            explanation=q_data.get('explanation'),
-                            memorization_tip=q_data.get('memorization_tip'),
-                            knowledge_point=q_data.get('knowledge_point') or os.path.basename(json_file).replace('.json', ''),
-                            exam_type=mode_type,
-                            hash=q_data['hash']
-                        )
-                        db.add(db_q)
-                        count += 1
-                    else:
-                         # Sync/Update fields even if question exists
-                         if q_data.get('memorization_tip'):
-                             exists.memorization_tip = q_data.get('memorization_tip')
-                         if q_data.get('knowledge_point'):
-                             exists.knowledge_point = q_data.get('knowledge_point')
-                         if q_data.get('explanation') and (not exists.explanation or exists.explanation == "暂无解析"):
-                             exists.explanation = q_data.get('explanation')
-                if file_modified:
-                    with open(json_file, 'w', encoding='utf-8') as f:
-                        json.dump(data[0] if original_is_dict else data, f, indent=2, ensure_ascii=False)
-            except Exception as e:
-                print(f"Error loading {json_file}: {e}")
-        
+        existing = {}
+        wanted = list({hashes[i] for i in candidates})
+        for chunk_start in range(0, len(wanted), 900):
+            chunk = wanted[chunk_start:chunk_start + 900]
+            rows = db.query(models.Question.id, models.Question.hash, models.Question.memorization_tip,
+                            models.Question.knowledge_point, models.Question.explanation)\
+                .filter(models.Question.hash.in_(chunk)).all()
+            existing.update({row.hash: row for row in rows})
+
+        new_rows, updates, seen = [], [], set()
+        for i in candidates:
+            q_hash = hashes[i]
+            if q_hash in seen:
+                continue
+            seen.add(q_hash)
+            q_data = snapshot.record(i)
+            row = existing.get(q_hash)
+            if row is None:
+                new_rows.append({
+                    "content": q_data['content'],
+                    "options": json.dumps(q_data['options'], ensure_ascii=False) if isinstance(q_data['options'], (dict, list)) else q_data['options'],
+                    "correct_answer": q_data['correct_answer'],
+                    "explanation": q_data.get('explanation'),
+                    "memorization_tip": q_data.get('memorization_tip'),
+                    "knowledge_point": q_data.get('knowledge_point'),
+                    "exam_type": q_data['exam_type'],
+                    "hash": q_hash
+                })
+                continue
+            # Sync/Update fields even if question exists
+            values = {}
+            if q_data.get('memorization_tip') and q_data['memorization_tip'] != row.memorization_tip:
+                values["memorization_tip"] = q_data['memorization_tip']
+            if q_data.get('knowledge_point') and q_data['knowledge_point'] != row.knowledge_point:
+                values["knowledge_point"] = q_data['knowledge_point']
+            if q_data.get('explanation') and (not row.explanation or row.explanation == "暂无解析") and q_data['explanation'] != row.explanation:
+                values["explanation"] = q_data['explanation']
+            if values:
+                updates.append((row.id, values))
+
+        if new_rows:
+            db.execute(insert(models.Question), new_rows)
+        for question_id, values in updates:
+            db.query(models.Question).filter(models.Question.id == question_id).update(values, synchronize_session=False)
         db.commit()
-        print(f"Loaded {count} new questions from JSON files.")
+        _ingested_signature = snapshot.signature
+        if new_rows or updates:
+            question_cache.clear()
+            eligibility.invalidate_catalog()
+        print(f"Loaded {len(new_rows)} new questions from JSON files ({len(updates)} updated, {len(changed_files)} files re-parsed).")
     finally:
         db.close()
 
+def current_question_bank() -> Optional[question_bank.QuestionBankSnapshot]:
+    """
+    The question bank snapshot in any worker: the leader's from its last ingest; other
+    workers map the file the leader wrote, and map it again once it has been rebuilt.
+    """
+    global _question_bank
+    snapshot = _question_bank
+    try:
+        st = os.stat(QUESTION_BANK_SNAPSHOT)
+    except OSError:
+        return snapshot
+    if snapshot is None or snapshot.signature != (st.st_mtime_ns, st.st_size):
+        reopened = question_bank.QuestionBankSnapshot.open(QUESTION_BANK_SNAPSHOT)
+        if reopened is not None:
+            _question_bank = snapshot = reopened
+    return snapshot
+
+def _question_json_files(q_hash: str) -> List[str]:
+    """The JSON file holding q_hash according to the bank snapshot, else every JSON file."""
+    import glob
+    json_dir = os.path.join(os.path.dirname(__file__), "json_questions")
+    snapshot = current_question_bank()
+    relpath = snapshot.file_of(q_hash) if snapshot else None
+    if relpath and os.path.exists(os.path.join(json_dir, relpath)):
+        return [os.path.join(json_dir, relpath)]
+    return glob.glob(os.path.join(json_dir, "**", "*.json"), recursive=True) + \
+        glob.glob(os.path.join(json_dir, "**", "*.jsonl"), recursive=True)
+
 def get_safe_filename(topic: str) -> str:
     """
     Consistently sanitizes a topic name for use as a filename.
@@ -302,51 +770,10 @@ def get_safe_filename(topic: str) -> str:
 
 def save_generated_questions_to_file(topic: str, questions: List[Dict], exam_type: str = "N1"):
     """
-    Saves generated questions to backend/json_questions/{topic}.json
-    Appends if file exists.
+    Appends generated questions to backend/json_questions/{mode}/{topic}.jsonl
+    (skipping ones already in the topic).
     """
-    filename = get_safe_filename(topic)
-    mode_subfolder = (exam_type or "N1").lower()
-    json_dir = os.path.join(os.path.dirname(__file__), "json_questions", mode_subfolder)
-    if not os.path.exists(json_dir):
-        os.makedirs(json_dir)
-        
-    filepath = os.path.join(json_dir, filename)
-    
-    existing_data = []
-    if os.path.exists(filepath):
-        try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                content = f.read().strip()
-                if content:
-                    existing_data = json.loads(content)
-                    if isinstance(existing_data, dict):
-                        existing_data = [existing_data]
-        except Exception as e:
-            print(f"Error reading existing file {filepath}: {e}")
-            existing_data = []
-
-    # Dedup against file content (simple hash check)
-    existing_hashes = set()
-    for q in existing_data:
-        unique_string = f"{q.get('content')}-{json.dumps(q.get('options'), sort_keys=True)}"
-        h = hashlib.sha256(unique_string.encode()).hexdigest()
-        existing_hashes.add(h)
-
-    new_questions = []
-    for q in questions:
-        # Client might not generate hash, let's gen it just for check
-        unique_string = f"{q.get('content')}-{json.dumps(q.get('options'), sort_keys=True)}"
-        h = hashlib.sha256(unique_string.encode()).hexdigest()
-        if h not in existing_hashes:
-            new_questions.append(q)
-            existing_hashes.add(h)
-    
-    if new_questions:
-        final_data = existing_data + new_questions
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(final_data, f, indent=2, ensure_ascii=False)
-        print(f"Saved {len(new_questions)} new questions to {filepath}")
+    topic_store.append(topic, questions, exam_type)
 
 @app.get("/api/users", response_model=List[User])
 def get_users(db: Session = Depends(database.get_db)):
@@ -388,11 +815,23 @@ def login_user(payload: UserLogin, db: Session = Depends(database.get_db)):
 @app.post("/api/quiz/generate")
 def generate_quiz(req: GenerateRequest, db: Session = Depends(database.get_db), user_id: int = Depends(get_current_user_id)):
     """
-    Generates N1 questions via AI, deduplicates, saves to file, and saves to DB.
+    Generates N1 questions via AI (or offline from the 语法.md table), deduplicates, saves to file, and saves to DB.
     """
     print(f"--- API CALL: generate_quiz for topic '{req.topic}' ---")
-    # 1. Generate questions from AI
-    generated_questions = ai_client.generate_questions_from_topic(req.topic, req.num_questions)
+    if req.source not in ("ai", "template"):
+        raise HTTPException(status_code=400, detail="source must be 'ai' or 'template'")
+    use_template = req.exam_type == "N1" and template_generator.can_generate(req.topic)
+    if req.source == "template" and not use_template:
+        raise HTTPException(status_code=404, detail=f"No grammar table row with an example sentence for '{req.topic}'")
+
+    # 1. Generate questions from AI, falling back to the template generator
+    generated_questions = []
+    if req.source == "ai":
+        generated_questions = ai_client.generate_questions_from_topic(req.topic, req.num_questions)
+        metrics.GENERATED_QUESTIONS.inc(len(generated_questions), source="ai")
+    if not generated_questions and use_template:
+        generated_questions = template_generator.generate(req.topic, req.num_questions)
+        metrics.GENERATED_QUESTIONS.inc(len(generated_questions), source="template")
     
     if not generated_questions:
         raise HTTPException(status_code=500, detail="Failed to generate questions from AI.")
@@ -429,26 +868,13 @@ def generate_quiz(req: GenerateRequest, db: Session = Depends(database.get_db),
             saved_questions.append(db_q)
     
     db.commit()
+    eligibility.invalidate_catalog()
 
     # 4. Filter mastered questions (unless favorite)
     # Mastered = exists a correct attempt BY THIS USER
     
-    final_questions = []
-    for q in saved_questions:
-        # Check if mastered BY THIS USER
-        is_mastered = db.query(models.AnswerAttempt).filter(
-            models.AnswerAttempt.question_id == q.id,
-            models.AnswerAttempt.user_id == user_id,
-            models.AnswerAttempt.is_correct == 1
-        ).first() is not None
-        
-        is_favorite = db.query(models.UserFavorite).filter(
-            models.UserFavorite.user_id == user_id,
-            models.UserFavorite.question_id == q.id
-        ).first() is not None
-        
-        if not is_mastered or is_favorite:
-            final_questions.append((q, is_favorite))
+    eligible = eligibility.filter_study(db, user_id, [q.id for q in saved_questions])
+    final_questions = [(q, eligibility.is_favorite(db, user_id, q.id)) for q in saved_questions if q.id in eligible]
     
     return [
         {
@@ -464,30 +890,36 @@ def generate_quiz(req: GenerateRequest, db: Session = Depends(database.get_db),
     ]
 
 @app.get("/api/stats", response_model=StatsResponse)
-def get_stats(exam_type: str = "N1", db: Session = Depends(database.get_db), user_id: int = Depends(get_current_user_id)):
+async def get_stats(exam_type: str = "N1", db: AsyncSession = Depends(database.get_async_db), user_id: int = Depends(get_current_user_id)):
     # Total Answered by this user in this mode
-    total = db.query(models.AnswerAttempt).join(models.Question)\
-        .filter(models.AnswerAttempt.user_id == user_id, models.Question.exam_type == exam_type).count()
+    total = (await db.execute(
+        select(func.count(models.AnswerAttempt.id)).join(models.Question)
+        .where(models.AnswerAttempt.user_id == user_id, models.Question.exam_type == exam_type)
+    )).scalar()
     
-    correct = db.query(models.AnswerAttempt).join(models.Question)\
-        .filter(
+    correct = (await db.execute(
+        select(func.count(models.AnswerAttempt.id)).join(models.Question)
+        .where(
             models.AnswerAttempt.user_id == user_id,
             models.AnswerAttempt.is_correct == 1,
             models.Question.exam_type == exam_type
-        ).count()
+        )
+    )).scalar()
     wrong = total - correct
 
     # Daily Stats (Last 7 days) for this user in this mode
     daily_stats = []
-    rows = db.query(
-        func.date(models.AnswerAttempt.attempted_at).label('date'),
-        func.sum(models.AnswerAttempt.is_correct).label('correct'),
-        func.count(models.AnswerAttempt.id).label('total')
-    ).join(models.Question)\
-     .filter(models.AnswerAttempt.user_id == user_id, models.Question.exam_type == exam_type)\
-     .group_by(func.date(models.AnswerAttempt.attempted_at))\
-     .order_by(func.date(models.AnswerAttempt.attempted_at).desc())\
-     .limit(7).all()
+    rows = (await db.execute(
+        select(
+            func.date(models.AnswerAttempt.attempted_at).label('date'),
+            func.sum(models.AnswerAttempt.is_correct).label('correct'),
+            func.count(models.AnswerAttempt.id).label('total')
+        ).join(models.Question)
+        .where(models.AnswerAttempt.user_id == user_id, models.Question.exam_type == exam_type)
+        .group_by(func.date(models.AnswerAttempt.attempted_at))
+        .order_by(func.date(models.AnswerAttempt.attempted_at).desc())
+        .limit(7)
+    )).all()
 
     for r in rows:
         daily_stats.append({
@@ -498,18 +930,20 @@ def get_stats(exam_type: str = "N1", db: Session = Depends(database.get_db), use
     daily_stats.reverse()
 
     # Top Wrong Knowledge Points in this mode
-    wrong_points = db.query(
-        models.Question.knowledge_point,
-        func.count(models.AnswerAttempt.id).label('count')
-    ).join(models.AnswerAttempt, models.Question.id == models.AnswerAttempt.question_id) \
-     .filter(
-         models.AnswerAttempt.is_correct == 0, 
-         models.AnswerAttempt.user_id == user_id,
-         models.Question.exam_type == exam_type
-     ) \
-     .group_by(models.Question.knowledge_point) \
-     .order_by(func.count(models.AnswerAttempt.id).desc()) \
-     .limit(5).all()
+    wrong_points = (await db.execute(
+        select(
+            models.Question.knowledge_point,
+            func.count(models.AnswerAttempt.id).label('count')
+        ).join(models.AnswerAttempt, models.Question.id == models.AnswerAttempt.question_id)
+        .where(
+            models.AnswerAttempt.is_correct == 0,
+            models.AnswerAttempt.user_id == user_id,
+            models.Question.exam_type == exam_type
+        )
+        .group_by(models.Question.knowledge_point)
+        .order_by(func.count(models.AnswerAttempt.id).desc())
+        .limit(5)
+    )).all()
 
     top_wrong = [{"point": p[0], "count": p[1]} for p in wrong_points if p[0]]
 
@@ -521,6 +955,26 @@ def get_stats(exam_type: str = "N1", db: Session = Depends(database.get_db), use
         "top_wrong_points": top_wrong
     }
 
+@app.get("/api/stats/mastery")
+def get_mastery(exam_type: str = "N1", db: Session = Depends(database.get_db), user_id: int = Depends(get_current_user_id)):
+    """
+    Per knowledge point mastery for the current user, column-oriented for heatmaps:
+    every list is aligned with `points`. last_seen is epoch seconds (null if never attempted).
+    """
+    m = mastery.matrix(db, [user_id], exam_type)
+    attempts = m["attempts"][0]
+    return {
+        "exam_type": exam_type,
+        "half_life_days": mastery.half_life_days,
+        "points": m["points"],
+        "attempts": attempts.astype(int).tolist(),
+        "accuracy": np.round(m["accuracy"][0], 4).tolist(),
+        "recency": np.round(m["recency"][0], 4).tolist(),
+        "recent_accuracy": np.round(m["recent_accuracy"][0], 4).tolist(),
+        "trend": np.round(m["trend"][0], 4).tolist(),
+        "last_seen": [int(t) if n else None for t, n in zip(m["last_seen"][0], attempts)]
+    }
+
 @app.get("/api/stats/analysis")
 def get_ai_analysis(db: Session = Depends(database.get_db)):
     """
@@ -531,32 +985,37 @@ def get_ai_analysis(db: Session = Depends(database.get_db)):
 
 @app.get("/api/suggestions")
 def get_suggestions(exam_type: str = "N1", db: Session = Depends(database.get_db)):
-    # Parse markdown files and return list
+    """
+    Knowledge points with questions in the DB (plus, for N1, every 语法.md point so topics can be
+    generated), precomputed with the neighbor table. Until the first build it is derived here.
+    """
+    suggestions = point_neighbors.suggestions(exam_type)
+    if suggestions is not None:
+        return suggestions
     try:
         # Get raw suggestions from service (mode-aware for MD files)
         all_points = knowledge_service.get_all_knowledge_points(exam_type=exam_type)
-        
-        # Further refine: Only show points that have questions in the DB for this exam_type
-        # OR if it's N1 and from the MD file (to allow generating questions for them)
         db_points = db.query(models.Question.knowledge_point)\
             .filter(models.Question.exam_type == exam_type)\
             .distinct().all()
-        db_point_names = {p[0] for p in db_points if p[0]}
-        
-        filtered = []
-        for p in all_points:
-            # If it has questions in DB, definitely keep it
-            if p['point'] in db_point_names:
-                filtered.append(p)
-            # If it's N1 and from MD, keep it (allows user to see topics to generate)
-            elif exam_type == "N1" and p.get('source_file', '').endswith('.md'):
-                filtered.append(p)
-        
-        return filtered
+        return suggestion_entries(all_points, {p[0] for p in db_points if p[0]}, exam_type)
     except Exception as e:
         print(f"Error getting suggestions: {e}")
         return []
 
+@app.get("/api/suggestions/related")
+def get_related_suggestions(exam_type: str = "N1", limit: int = 5, db: Session = Depends(database.get_db), user_id: int = Depends(get_current_user_id)):
+    """
+    Points related to the ones behind this user's current wrong questions: counts per point from
+    the warm eligibility sets, then neighbor table lookups.
+    """
+    wrong_points = eligibility.wrong_by_point(db, user_id, exam_type)
+    return knowledge_service.get_suggestions(wrong_points, exam_type=exam_type, limit=limit)
+
+@app.get("/api/knowledge/related")
+def get_related_points(point: str, exam_type: str = "N1"):
+    return point_neighbors.neighbors(point, exam_type)
+
 @app.get("/api/knowledge/counts")
 def get_knowledge_counts(exam_type: str = "N1", db: Session = Depends(database.get_db)):
     """
@@ -621,11 +1080,13 @@ def toggle_favorite(question_id: int, db: Session = Depends(database.get_db), us
     if existing:
         db.delete(existing)
         db.commit()
+        eligibility.record_favorite(user_id, question_id, False)
         return {"is_favorite": False}
     else:
         new_fav = models.UserFavorite(user_id=user_id, question_id=question_id)
         db.add(new_fav)
         db.commit()
+        eligibility.record_favorite(user_id, question_id, True)
         return {"is_favorite": True}
 
 @app.get("/api/quiz/session")
@@ -637,52 +1098,112 @@ def get_quiz_session(session_key: str = "default", db: Session = Depends(databas
     if not session:
         return {"exists": False}
 
+    entries = json.loads(session.questions_json)
+    results = json.loads(session.results_json)
+
+    # Rehydrate stored ids from the question cache. Inline dicts are legacy rows or id-less questions.
+    payloads = question_cache.get_many(db, [e for e in entries if isinstance(e, int)])
+    favorite_ids = set(r[0] for r in db.query(models.UserFavorite.question_id).filter(models.UserFavorite.user_id == user_id).all())
+
+    questions = []
+    kept_results = []
+    for i, entry in enumerate(entries):
+        if isinstance(entry, int):
+            if entry not in payloads:
+                continue # Question was deleted since the session was saved; drop its result slot too
+            q_dict = dict(payloads[entry])
+            q_dict["is_favorite"] = entry in favorite_ids
+        else:
+            q_dict = entry
+        questions.append(q_dict)
+        kept_results.append(results[i] if i < len(results) else None)
+
     return {
         "exists": True,
         "session_key": session.session_key,
         "topic": session.topic,
-        "questions": json.loads(session.questions_json),
-        "results": json.loads(session.results_json),
-        "current_index": session.current_index,
+        "questions": questions,
+        "results": kept_results,
+        "current_index": min(session.current_index or 0, max(len(questions) - 1, 0)),
         "updated_at": session.updated_at.isoformat() if session.updated_at else None
     }
 
 @app.post("/api/quiz/session")
-def save_quiz_session(payload: QuizSessionPayload, db: Session = Depends(database.get_db), user_id: int = Depends(get_current_user_id)):
+async def save_quiz_session(payload: QuizSessionPayload, db: AsyncSession = Depends(database.get_async_db), user_id: int = Depends(get_current_user_id)):
+    """
+    Stores the session's question ids once (full payloads are rehydrated on GET).
+    Uses a single INSERT ... ON CONFLICT on (user_id, session_key).
+    """
     session_key = payload.session_key or "default"
-    
-    try:
-        # 1. Try to fetch existing
-        existing = db.query(models.QuizSession).filter(
-            models.QuizSession.session_key == session_key,
-            models.QuizSession.user_id == user_id
-        ).first()
-
-        if not existing:
-            # 2. Try to insert new
-            existing = models.QuizSession(session_key=session_key, user_id=user_id)
-            db.add(existing)
-            db.flush() # Try to flush to catch IntegrityError early
-    except:
-        db.rollback()
-        # 3. If insert failed (race condition), fetch again
-        existing = db.query(models.QuizSession).filter(
-            models.QuizSession.session_key == session_key,
-            models.QuizSession.user_id == user_id
-        ).first()
 
-    if existing:
-        existing.topic = payload.topic
-        existing.questions_json = json.dumps(payload.questions, ensure_ascii=False)
-        existing.results_json = json.dumps(payload.results, ensure_ascii=False)
-        existing.current_index = payload.current_index
-        db.commit()
+    if payload.question_ids is not None:
+        entries = list(payload.question_ids)
     else:
-        # Fallback safety (should rarely happen with above logic)
-        raise HTTPException(status_code=500, detail="Failed to sync session due to internal race condition.")
+        entries = [q["id"] if isinstance(q.get("id"), int) else q for q in payload.questions]
+
+    if entries and payload.current_index >= len(entries):
+        raise HTTPException(status_code=422, detail=f"current_index {payload.current_index} is out of range for {len(entries)} questions")
+
+    # Pad results so PATCH can address every question slot
+    results = list(payload.results)[:len(entries)]
+    results += [None] * (len(entries) - len(results))
+
+    values = {
+        "topic": payload.topic,
+        "questions_json": json.dumps(entries, ensure_ascii=False),
+        "results_json": json.dumps(results, ensure_ascii=False),
+        "current_index": payload.current_index,
+        "updated_at": func.now()
+    }
+    stmt = sqlite_insert(models.QuizSession).values(user_id=user_id, session_key=session_key, **values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["user_id", "session_key"],
+        set_={k: stmt.excluded[k] for k in values}
+    )
+    await db.execute(stmt)
+    await db.commit()
 
     return {"message": "Session saved", "session_key": session_key}
 
+@app.patch("/api/quiz/session")
+async def patch_quiz_session(patch: QuizSessionPatch, db: AsyncSession = Depends(database.get_async_db), user_id: int = Depends(get_current_user_id)):
+    """
+    Applies a small delta (one result slot and/or the current index) in a single UPDATE.
+    Returns 404 when there is no saved session, so the client can fall back to a full save,
+    and 422 when an index is past the session's last question.
+    """
+    session_key = patch.session_key or "default"
+    session_filter = (models.QuizSession.user_id == user_id, models.QuizSession.session_key == session_key)
+
+    values = {models.QuizSession.updated_at: func.now()}
+    if patch.result_index is not None:
+        if patch.result_index < 0:
+            raise HTTPException(status_code=400, detail="result_index must be >= 0")
+        values[models.QuizSession.results_json] = func.json_set(
+            models.QuizSession.results_json,
+            f"$[{patch.result_index}]",
+            func.json(json.dumps(patch.result, ensure_ascii=False))
+        )
+    if patch.current_index is not None:
+        values[models.QuizSession.current_index] = patch.current_index
+
+    # Bounds are checked by the UPDATE itself; only a miss costs a second look
+    indexes = [i for i in (patch.result_index, patch.current_index) if i is not None]
+    stmt = update(models.QuizSession).where(*session_filter)
+    if indexes:
+        stmt = stmt.where(func.json_array_length(models.QuizSession.questions_json) > max(indexes))
+    result = await db.execute(stmt.values(values))
+    await db.commit()
+
+    if result.rowcount == 0:
+        row = (await db.execute(
+            select(func.json_array_length(models.QuizSession.questions_json)).where(*session_filter)
+        )).first()
+        if row is not None:
+            raise HTTPException(status_code=422, detail=f"Index {max(indexes)} is out of range for {row[0] or 0} questions")
+        raise HTTPException(status_code=404, detail="Session not found")
+    return {"message": "Session updated", "session_key": session_key}
+
 @app.delete("/api/quiz/session")
 def delete_quiz_session(session_key: str = "default", db: Session = Depends(database.get_db), user_id: int = Depends(get_current_user_id)):
     session = db.query(models.QuizSession).filter(
@@ -697,70 +1218,59 @@ def delete_quiz_session(session_key: str = "default", db: Session = Depends(data
     return {"message": "Session deleted"}
 
 @app.get("/api/quiz/study")
-def get_study_session(limit_new: int = 5, limit_review: int = 10, exam_type: str = "N1", db: Session = Depends(database.get_db), user_id: int = Depends(get_current_user_id)):
-    ingest_json_questions()
-    
+async def get_study_session(limit_new: int = 5, limit_review: int = 10, exam_type: str = "N1", db: AsyncSession = Depends(database.get_async_db), user_id: int = Depends(get_current_user_id)):
+    # Due reviews come from the warm per-user heap; rows and payloads are fetched by id
     now = datetime.now()
-    due_reviews = db.query(models.WrongQuestion).join(models.Question)\
-        .filter(models.WrongQuestion.user_id == user_id, 
-                models.Question.exam_type == exam_type,
-                models.WrongQuestion.next_review_at <= now)\
-        .order_by(models.WrongQuestion.next_review_at)\
-        .limit(limit_review)\
-        .all()
+    due_ids = await db.run_sync(review_queue.due, user_id, exam_type, now, limit_review)
+    wrong_rows = {}
+    if due_ids:
+        wrong_rows = {w.question_id: w for w in (await db.execute(select(models.WrongQuestion).where(
+            models.WrongQuestion.user_id == user_id,
+            models.WrongQuestion.question_id.in_(due_ids)
+        ))).scalars()}
+    payloads = await db.run_sync(question_cache.get_many, due_ids)
     
     review_structure = []
-    for w in due_reviews:
-        q = w.question
-        options = json.loads(q.options) if isinstance(q.options, str) else q.options
-        q_dict = {
-            "id": q.id,
-            "content": q.content,
-            "options": options,
-            "correct_answer": q.correct_answer,
-            "explanation": q.explanation,
-            "memorization_tip": q.memorization_tip,
-            "knowledge_point": q.knowledge_point,
+    for qid in due_ids:
+        w = wrong_rows.get(qid)
+        if not w or qid not in payloads:
+            continue
+        q_dict = dict(payloads[qid])
+        q_dict.update({
             "is_review": True,
             "srs_interval": w.interval,
             "srs_next_review": w.next_review_at.isoformat() if w.next_review_at else None
-        }
+        })
         review_structure.append(q_dict)
 
-    # Answered questions by this user
-    answered_subquery = db.query(models.AnswerAttempt.question_id).filter(
-        models.AnswerAttempt.user_id == user_id,
-        models.AnswerAttempt.is_correct == 1
-    )
-    
-    # Favorite IDs for this user
-    favorite_ids = db.query(models.UserFavorite.question_id).filter(models.UserFavorite.user_id == user_id)
-
-    new_qs = db.query(models.Question)\
-        .filter(models.Question.exam_type == exam_type)\
-        .filter((~models.Question.id.in_(answered_subquery)) | (models.Question.id.in_(favorite_ids)))\
-        .order_by(func.random())\
-        .limit(limit_new)\
-        .all()
-
-    new_structure = []
-    for q in new_qs:
-        options = json.loads(q.options) if isinstance(q.options, str) else q.options
-        q_dict = {
-            "id": q.id,
-            "content": q.content,
-            "options": options,
-            "correct_answer": q.correct_answer,
-            "explanation": q.explanation,
-            "memorization_tip": q.memorization_tip,
-            "knowledge_point": q.knowledge_point
-        }
-        new_structure.append(q_dict)
+    # New questions: not mastered by this user, or favorited (from the user's eligibility bitsets),
+    # picked near the user's calibrated ability
+    pool = await db.run_sync(eligibility.study_pool, user_id, exam_type)
+    new_ids = await db.run_sync(irt.pick, user_id, exam_type, pool, limit_new)
+    new_payloads = await db.run_sync(question_cache.get_many, new_ids)
+    new_structure = [dict(new_payloads[qid]) for qid in new_ids if qid in new_payloads]
     
     return review_structure + new_structure
 
+@app.get("/api/sync")
+async def sync_changes(since: int = 0, limit: int = 1000, exam_type: Optional[str] = None, db: AsyncSession = Depends(database.get_async_db), user_id: int = Depends(get_current_user_id)):
+    """
+    Delta feed for clients keeping a local copy of the bank and their progress: questions,
+    favorites and SRS rows changed after `since` (current rows, plus deletions). Store the
+    returned seq and pass it next time; repeat while more is true; on reset, drop the local
+    copy and apply the response from scratch.
+    """
+    if since < 0 or not 1 <= limit <= 5000:
+        raise HTTPException(status_code=400, detail="since must be >= 0 and limit between 1 and 5000")
+    return await db.run_sync(change_feed.changes_since, user_id, since, limit, exam_type)
+
+@app.get("/api/reviews/due-count")
+async def get_due_review_count(exam_type: str = "N1", db: AsyncSession = Depends(database.get_async_db), user_id: int = Depends(get_current_user_id)):
+    """Cheap badge count of reviews due now, served from the warm per-user heap."""
+    return {"due": await db.run_sync(review_queue.due_count, user_id, exam_type, datetime.now())}
+
 @app.get("/api/quiz/gap")
-def get_gap_quiz(target_total: int = 20, num_per_point: int = 1, exam_type: str = "N1", db: Session = Depends(database.get_db), user_id: int = Depends(get_current_user_id)):
+async def get_gap_quiz(target_total: int = 20, num_per_point: int = 1, exam_type: str = "N1", db: AsyncSession = Depends(database.get_async_db), user_id: int = Depends(get_current_user_id)):
     """
     Selects a mix of:
     1. NEVER attempted questions.
@@ -769,47 +1279,17 @@ def get_gap_quiz(target_total: int = 20, num_per_point: int = 1, exam_type: str
     
     Picks num_per_point from each point until target_total is reached.
     """
-    # 0. Data Hygiene: Clear any attempts with NULL question_id
-    db.query(models.AnswerAttempt).filter(models.AnswerAttempt.question_id == None).delete(synchronize_session=False)
-    db.commit()
-
-    # 1. Subqueries and filters
-    point_filter_base = (models.Question.exam_type == exam_type)
-    attempted_ids = db.query(models.AnswerAttempt.question_id).filter(
-        models.AnswerAttempt.user_id == user_id,
-        models.AnswerAttempt.question_id != None
-    )
-    wrong_ids = db.query(models.WrongQuestion.question_id).filter(models.WrongQuestion.user_id == user_id)
-    favorite_ids = db.query(models.UserFavorite.question_id).filter(models.UserFavorite.user_id == user_id)
-    
-    # 2. Get all distinct knowledge points for this exam_type
-    points_rows = db.query(func.coalesce(models.Question.knowledge_point, "未分类"))\
-        .filter(models.Question.exam_type == exam_type)\
-        .distinct().all()
-    points = [p[0] if p[0] else "未分类" for p in points_rows]
-    import random
+    # 1. Eligible ids per knowledge point: never attempted OR favorite OR wrong (user bitsets)
+    pools = await db.run_sync(eligibility.gap_pools, user_id, exam_type)
+    points = list(pools)
     random.shuffle(points) # Randomize point order
     
-    # 3. Interleave points for maximum diversity
+    # 2. Interleave points for maximum diversity
     selected_questions = []
-    point_pools = {} # point -> list of questions
-    
-    for point in points:
-        point_filter = (models.Question.knowledge_point == point)
-        if point == "未分类":
-            point_filter = (models.Question.knowledge_point == None) | (models.Question.knowledge_point == "")
-
-        point_qs = db.query(models.Question).filter(
-            point_filter,
-            (
-                ~models.Question.id.in_(attempted_ids) | 
-                models.Question.id.in_(favorite_ids) |
-                models.Question.id.in_(wrong_ids)
-            )
-        ).order_by(func.random()).limit(num_per_point).all()
-        
-        if point_qs:
-            point_pools[point] = point_qs
+    # point -> list of question ids, near the user's ability within each point
+    point_pools = await db.run_sync(
+        lambda s: {point: irt.pick(s, user_id, exam_type, pools[point], num_per_point, point) for point in points}
+    )
 
     # Pick round-robin until target_total
     import itertools
@@ -827,9 +1307,14 @@ def get_gap_quiz(target_total: int = 20, num_per_point: int = 1, exam_type: str
     
     # Final shuffle is optional since we interleaved, but let's keep it for intra-point randomness
     random.shuffle(selected_questions)
+    rows = {}
+    if selected_questions:
+        rows = {q.id: q for q in (await db.execute(
+            select(models.Question).where(models.Question.id.in_(selected_questions))
+        )).scalars()}
     
     results = []
-    for q in selected_questions:
+    for q in (rows[qid] for qid in selected_questions if qid in rows):
         q_dict = q.__dict__.copy()
         if isinstance(q_dict.get('options'), str):
             try:
@@ -840,94 +1325,201 @@ def get_gap_quiz(target_total: int = 20, num_per_point: int = 1, exam_type: str
     
     return results
 
+def apply_srs_review(scheduler, db: Optional[Session], wrong_q, question_id: int, user_id: int, quality: int, now: datetime):
+    """
+    Applies one review with `scheduler` (srs_scheduler.get(db), looked up once per request).
+    Creates the WrongQuestion row on the first failure (added to db; with db=None it stays
+    transient, as for the attempt log's in-memory state).
+    Returns the (possibly new) row, or None when a correct answer has no SRS entry.
+    """
+    if not wrong_q:
+        if quality >= 3:
+            return None
+        interval, ease_factor = scheduler.first_lapse(quality)
+        wrong_q = models.WrongQuestion(
+            question_id=question_id,
+            user_id=user_id,
+            review_count=1,
+            interval=interval,
+            ease_factor=ease_factor,
+            next_review_at=now + timedelta(days=interval)
+        )
+        if db is not None:
+            db.add(wrong_q)
+        return wrong_q
+
+    # Time since the previous review (its next_review_at was set `interval` days after it)
+    elapsed_days = 0.0
+    if wrong_q.next_review_at and wrong_q.interval:
+        last_review = wrong_q.next_review_at.replace(tzinfo=None) - timedelta(days=wrong_q.interval)
+        elapsed_days = max(0.0, (now - last_review).total_seconds() / 86400.0)
+
+    wrong_q.interval, wrong_q.ease_factor = scheduler.review(wrong_q.interval, wrong_q.ease_factor, quality, elapsed_days)
+    wrong_q.next_review_at = now + timedelta(days=wrong_q.interval)
+    if quality < 3:
+        if wrong_q.review_count is None: wrong_q.review_count = 0
+        wrong_q.review_count += 1
+    return wrong_q
+
+def _event_time(event: Dict) -> datetime:
+    """An attempt log event's "at" as an aware datetime (UTC; events logged as server-local time have no offset)."""
+    at = datetime.fromisoformat(event["at"])
+    return at if at.tzinfo else at.astimezone()
+
+def apply_logged_attempts(events: List[Dict]) -> int:
+    """
+    Attempt log compaction: replays events in answer-time order in one transaction, through
+    the same SRS path as a direct submit. Events already stored (their id is the attempt's
+    client_id) and events for since-deleted questions are skipped. Returns how many were applied.
+    """
+    events = sorted(events, key=lambda e: (_event_time(e), e["id"]))
+    user_ids = {e["user_id"] for e in events}
+    question_ids = {e["question_id"] for e in events}
+    db = SessionLocal()
+    try:
+        existing_questions, seen, wrong_rows = set(), set(), {}
+        ids = [e["id"] for e in events]
+        for i in range(0, len(ids), 900):
+            seen.update(db.query(models.AnswerAttempt.user_id, models.AnswerAttempt.client_id).filter(
+                models.AnswerAttempt.client_id.in_(ids[i:i + 900])).all())
+        qids = sorted(question_ids)
+        for i in range(0, len(qids), 900):
+            chunk = qids[i:i + 900]
+            existing_questions.update(r[0] for r in db.query(models.Question.id).filter(models.Question.id.in_(chunk)))
+            for w in db.query(models.WrongQuestion).filter(
+                    models.WrongQuestion.user_id.in_(user_ids), models.WrongQuestion.question_id.in_(chunk)):
+                wrong_rows[(w.user_id, w.question_id)] = w
+        scheduler = srs_scheduler.get(db)
+
+        attempt_rows = []
+        for e in events:
+            if (e["user_id"], e["id"]) in seen or e["question_id"] not in existing_questions:
+                continue
+            seen.add((e["user_id"], e["id"]))
+            at = _event_time(e)
+            attempt_rows.append({
+                "question_id": e["question_id"],
+                "user_id": e["user_id"],
+                "selected_answer": e["selected_answer"],
+                "is_correct": 1 if e["is_correct"] else 0,
+                "attempted_at": at.astimezone(timezone.utc).replace(tzinfo=None), # naive UTC, as CURRENT_TIMESTAMP stores it
+                "client_id": e["id"]
+            })
+            key = (e["user_id"], e["question_id"])
+            # SRS due times are server-local, as in the direct submit path
+            wrong_q = apply_srs_review(scheduler, db, wrong_rows.get(key), e["question_id"], e["user_id"], e["quality"],
+                                       at.astimezone().replace(tzinfo=None))
+            if wrong_q is not None:
+                wrong_rows[key] = wrong_q
+        if attempt_rows:
+            db.execute(insert(models.AnswerAttempt), attempt_rows)
+        db.commit()
+        return len(attempt_rows)
+    finally:
+        db.close()
+
+async def logged_srs_row(db: AsyncSession, user_id: int, question_id: int):
+    """
+    SRS state for a logged submit: this worker's pending state when it has one, else a
+    transient copy of the stored row (the database is only written by compaction).
+    """
+    pending = attempt_log.pending_state(user_id, question_id)
+    if pending is not None:
+        return pending
+    row = (await db.execute(select(models.WrongQuestion).where(
+        models.WrongQuestion.question_id == question_id,
+        models.WrongQuestion.user_id == user_id
+    ))).scalars().first()
+    if row is None:
+        return None
+    return models.WrongQuestion(
+        question_id=question_id, user_id=user_id, review_count=row.review_count,
+        interval=row.interval, ease_factor=row.ease_factor, next_review_at=row.next_review_at
+    )
+
+def srs_state(wrong_q) -> Optional[Dict[str, Any]]:
+    if not wrong_q:
+        return None
+    return {
+        "interval": wrong_q.interval,
+        "ease_factor": wrong_q.ease_factor,
+        "review_count": wrong_q.review_count,
+        "next_review_at": wrong_q.next_review_at.isoformat() if wrong_q.next_review_at else None
+    }
+
+def export_progress_backup():
+    """Progress JSON export on its own session (run by the leader's progress_backup job)."""
+    db = SessionLocal()
+    try:
+        backup_service.export_progress_to_json(db)
+    except Exception as e:
+        print(f"Backup failed: {e}")
+    finally:
+        db.close()
+
+def log_wrong_question_to_markdown(question):
+    try:
+        markdown_service.log_wrong_question(question)
+    except Exception as e:
+        print(f"Failed to log wrong question to markdown: {e}")
+
 @app.post("/api/questions/{question_id}/submit")
-def submit_answer_and_log(question_id: int, answer: AnswerSubmit, db: Session = Depends(database.get_db), user_id: int = Depends(get_current_user_id)):
-    db_question = db.query(models.Question).filter(models.Question.id == question_id).first()
+async def submit_answer_and_log(question_id: int, answer: AnswerSubmit, db: AsyncSession = Depends(database.get_async_db), user_id: int = Depends(get_current_user_id)):
+    db_question = await db.get(models.Question, question_id)
     if not db_question:
         raise HTTPException(status_code=404, detail="Question not found")
 
     db_ans = db_question.correct_answer.strip().upper()
     user_ans = answer.selected_answer.strip().upper()
     is_correct = db_ans == user_ans
-    
-    # 1. Record Attempt
-    attempt = models.AnswerAttempt(
-        question_id=question_id,
-        user_id=user_id,
-        selected_answer=answer.selected_answer,
-        is_correct=1 if is_correct else 0
-    )
-    db.add(attempt)
-    db.flush()
-
-    # 2. Update Wrong Question (SRS)
-    wrong_q = db.query(models.WrongQuestion).filter(
-        models.WrongQuestion.question_id == question_id,
-        models.WrongQuestion.user_id == user_id
-    ).first()
 
     # Determine Quality (0-5)
     # If not provided, map is_correct to binary quality
     quality = answer.quality
     if quality is None:
         quality = 4 if is_correct else 1 # 4: Good, 1: Forgot
+    now = datetime.now()
 
-    if quality < 3: # "Forgot" or "Hard-Failure"
-        if not wrong_q:
-            wrong_q = models.WrongQuestion(
-                question_id=question_id,
-                user_id=user_id,
-                review_count=0,
-                interval=1,
-                ease_factor=250,
-                next_review_at=datetime.now() + timedelta(days=1)
-            )
-            db.add(wrong_q)
-        else:
-            wrong_q.interval = 1
-            # Adjust Ease Factor (EF) - Standard SM-2 formula part
-            # EF = EF + (0.1 - (5-q) * (0.08 + (5-q) * 0.02))
-            # Here we simplify slightly for 1-4 scale or 0-5
-            wrong_q.ease_factor = max(130, wrong_q.ease_factor - 20)
-            wrong_q.next_review_at = datetime.now() + timedelta(days=1)
-        
-        if wrong_q.review_count is None: wrong_q.review_count = 0
-        wrong_q.review_count += 1
-        
-        try:
-            markdown_service.log_wrong_question(db_question)
-        except Exception as e:
-            print(f"Failed to log wrong question to markdown: {e}")
-
-    else: # Success (Quality 3, 4, 5)
+    if attempt_log:
+        # Logged path: SRS computed in memory, durable once the group commit fsyncs the event
+        wrong_q = apply_srs_review(await srs_scheduler.get_async(db), None, await logged_srs_row(db, user_id, question_id), question_id, user_id, quality, now)
+        stem = await asyncio.wrap_future(attempt_log.append({
+            "id": attempt_log.next_id(), "user_id": user_id, "question_id": question_id,
+            "selected_answer": answer.selected_answer, "is_correct": is_correct,
+            "quality": quality, "at": now.astimezone(timezone.utc).isoformat()
+        }))
         if wrong_q:
-            if wrong_q.interval is None: wrong_q.interval = 1
-            if wrong_q.ease_factor is None: wrong_q.ease_factor = 250
-            
-            # Standard SM-2 EF adjustment
-            # q=3 (Good-ish), q=4 (Good), q=5 (Easy)
-            # EF' = EF + (0.1 - (5-q) * (0.08 + (5-q) * 0.02))
-            # If q=4, EF change ~= 0. If q=5, EF increases. If q=3, EF decreases.
-            q = quality
-            ef_change = (0.1 - (5-q) * (0.08 + (5-q) * 0.02)) * 100
-            wrong_q.ease_factor = max(130, int(wrong_q.ease_factor + ef_change))
-
-            new_interval = int(wrong_q.interval * (wrong_q.ease_factor / 100.0))
-            if new_interval <= wrong_q.interval: new_interval = wrong_q.interval + 1
-            
-            # Bonus for "Easy" (q=5)
-            if q == 5: new_interval = int(new_interval * 1.3)
-            
-            wrong_q.interval = new_interval
-            wrong_q.next_review_at = datetime.now() + timedelta(days=new_interval)
-
-    db.commit()
-    
-    # Backup after progress change
-    try:
-        backup_service.export_progress_to_json(db)
-    except Exception as e:
-        print(f"Backup failed: {e}")
+            attempt_log.remember(user_id, question_id, wrong_q, stem)
+    else:
+        # 1. Record Attempt
+        attempt = models.AnswerAttempt(
+            question_id=question_id,
+            user_id=user_id,
+            selected_answer=answer.selected_answer,
+            is_correct=1 if is_correct else 0
+        )
+        db.add(attempt)
+
+        # 2. Update Wrong Question (SRS)
+        wrong_q = (await db.execute(select(models.WrongQuestion).where(
+            models.WrongQuestion.question_id == question_id,
+            models.WrongQuestion.user_id == user_id
+        ))).scalars().first()
+        wrong_q = apply_srs_review(await srs_scheduler.get_async(db), db, wrong_q, question_id, user_id, quality, now)
+        await db.commit()
+    next_review_at = wrong_q.next_review_at if wrong_q else None
+    eligibility.record_attempt(user_id, question_id, is_correct)
+    mastery.record_attempt(user_id, question_id, is_correct)
+    if wrong_q:
+        review_queue.update(user_id, db_question.exam_type, question_id, next_review_at)
+        eligibility.record_wrong(user_id, question_id)
+
+    # The markdown log only enqueues; the progress backup is the leader's job
+    # (logged answers reach it through its fingerprint check once compacted)
+    if quality < 3:
+        log_wrong_question_to_markdown(db_question)
+    if not attempt_log:
+        request_progress_backup()
     
     return {
         "is_correct": is_correct,
@@ -936,6 +1528,127 @@ def submit_answer_and_log(question_id: int, answer: AnswerSubmit, db: Session =
         "memorization_tip": db_question.memorization_tip
     }
 
+def client_timestamp(answered_at: Optional[datetime], now: datetime) -> datetime:
+    """
+    A client's answered_at as an aware UTC time: its offset is converted (not dropped), a
+    naive time is taken as UTC, and a time ahead of the server clock is clamped to `now`.
+    """
+    if answered_at is None:
+        return now
+    if answered_at.tzinfo is None:
+        answered_at = answered_at.replace(tzinfo=timezone.utc)
+    return min(answered_at.astimezone(timezone.utc), now)
+
+@app.post("/api/answers/batch")
+def submit_answer_batch(batch: AnswerBatch, db: Session = Depends(database.get_db), user_id: int = Depends(get_current_user_id)):
+    """
+    Applies N answers (e.g. an offline study burst) in one transaction.
+    Items are replayed in client-timestamp order; client_ids already stored for
+    this user are reported as duplicates and not applied again.
+    """
+    now = datetime.now(timezone.utc)
+    items = sorted(batch.answers, key=lambda a: client_timestamp(a.answered_at, now))
+
+    # Bulk lookups: questions, already-synced client ids, current SRS rows
+    question_ids = {a.question_id for a in items}
+    questions = {q.id: q for q in db.query(models.Question).filter(models.Question.id.in_(question_ids)).all()}
+    seen_client_ids = set(r[0] for r in db.query(models.AnswerAttempt.client_id).filter(
+        models.AnswerAttempt.user_id == user_id,
+        models.AnswerAttempt.client_id.in_({a.client_id for a in items})
+    ).all())
+    wrong_rows = {w.question_id: w for w in db.query(models.WrongQuestion).filter(
+        models.WrongQuestion.user_id == user_id,
+        models.WrongQuestion.question_id.in_(question_ids)
+    ).all()}
+    scheduler = srs_scheduler.get(db)
+
+    attempt_rows = []
+    failed_questions = []
+    outcomes = {}
+    for a in items:
+        if a.client_id in outcomes:
+            continue # Repeated within this batch; the first occurrence wins
+        db_question = questions.get(a.question_id)
+        if a.client_id in seen_client_ids:
+            outcomes[a.client_id] = {"status": "duplicate"}
+            continue
+        seen_client_ids.add(a.client_id)
+        if not db_question:
+            outcomes[a.client_id] = {"status": "not_found"}
+            continue
+
+        is_correct = db_question.correct_answer.strip().upper() == a.selected_answer.strip().upper()
+        answered_at = client_timestamp(a.answered_at, now)
+        attempt_rows.append({
+            "question_id": a.question_id,
+            "user_id": user_id,
+            "selected_answer": a.selected_answer,
+            "is_correct": 1 if is_correct else 0,
+            "attempted_at": answered_at.replace(tzinfo=None), # naive UTC, as CURRENT_TIMESTAMP stores it
+            "client_id": a.client_id
+        })
+
+        quality = a.quality
+        if quality is None:
+            quality = 4 if is_correct else 1
+        # SRS due times are server-local, as datetime.now() in the other submit paths
+        wrong_q = apply_srs_review(scheduler, db, wrong_rows.get(a.question_id), a.question_id, user_id, quality,
+                                   answered_at.astimezone().replace(tzinfo=None))
+        if wrong_q is not None:
+            wrong_rows[a.question_id] = wrong_q
+        if quality < 3:
+            failed_questions.append(db_question)
+
+        outcomes[a.client_id] = {
+            "status": "applied",
+            "is_correct": is_correct,
+            "correct_answer": db_question.correct_answer,
+            "srs": srs_state(wrong_q)
+        }
+
+    # Duplicates report the current SRS state so the client can reconcile
+    results = []
+    reported = set()
+    for a in batch.answers:
+        outcome = outcomes[a.client_id]
+        if a.client_id in reported or outcome["status"] == "duplicate":
+            outcome = {"status": "duplicate", "srs": srs_state(wrong_rows.get(a.question_id))}
+        reported.add(a.client_id)
+        results.append({"client_id": a.client_id, "question_id": a.question_id, **outcome})
+
+    if attempt_rows:
+        db.execute(insert(models.AnswerAttempt), attempt_rows)
+    srs_updates = [
+        (questions[qid].exam_type, qid, w.next_review_at)
+        for qid, w in wrong_rows.items() if qid in questions and w in db
+    ]
+    try:
+        db.commit()
+    except IntegrityError:
+        # A concurrent sync stored some of these client_ids first; retrying reports them as duplicates
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Batch overlaps a concurrent sync, please retry.")
+    for exam_type, qid, next_review_at in srs_updates:
+        review_queue.update(user_id, exam_type, qid, next_review_at)
+        eligibility.record_wrong(user_id, qid)
+    for row in attempt_rows:
+        eligibility.record_attempt(user_id, row["question_id"], row["is_correct"] == 1)
+        mastery.record_attempt(user_id, row["question_id"], row["is_correct"] == 1, row["attempted_at"])
+
+    if attempt_rows:
+        for q in failed_questions:
+            try:
+                markdown_service.log_wrong_question(q)
+            except Exception as e:
+                print(f"Failed to log wrong question to markdown: {e}")
+        request_progress_backup()
+
+    return {
+        "applied": len(attempt_rows),
+        "duplicates": sum(1 for r in results if r["status"] == "duplicate"),
+        "results": results
+    }
+
 @app.post("/api/quiz/finish")
 def finish_quiz_session(topic: str, session_data: List[Dict], db: Session = Depends(database.get_db)):
     log_data_questions = []
@@ -952,7 +1665,8 @@ def finish_quiz_session(topic: str, session_data: List[Dict], db: Session = Depe
 
 @app.get("/api/wrong-questions")
 def get_wrong_questions_api(db: Session = Depends(database.get_db), user_id: int = Depends(get_current_user_id)):
-    wqs = db.query(models.WrongQuestion).filter(models.WrongQuestion.user_id == user_id).all()
+    wqs = db.query(models.WrongQuestion).options(joinedload(models.WrongQuestion.question))\
+        .filter(models.WrongQuestion.user_id == user_id).all()
     results = []
     for w in wqs:
         q = w.question
@@ -988,6 +1702,10 @@ def delete_knowledge_point(name: str, db: Session = Depends(database.get_db)):
         count = db.query(models.Question).filter(models.Question.knowledge_point == name).delete()
     
     db.commit()
+    question_cache.clear()
+    review_queue.clear()
+    eligibility.clear()
+    mastery.clear()
     
     # 2. Delete the source JSON file if it exists
     # We check in both n1 and databricks folders or use current mode if we knew it.
@@ -1005,12 +1723,11 @@ def delete_knowledge_point(name: str, db: Session = Depends(database.get_db)):
                 deleted_any = True
             except Exception as e:
                 print(f"Failed to delete JSON file {json_path}: {e}")
+        if topic_store.delete_topic(name, mode):
+            deleted_any = True
             
     # 3. Trigger backup to reflect changes in JSON mirrors
-    try:
-        backup_service.export_progress_to_json(db)
-    except Exception as e:
-        print(f"Post-knowledge-deletion backup failed: {e}")
+    request_progress_backup()
         
     return {"message": f"Successfully deleted knowledge point '{name}' and {count} associated questions."}
 
@@ -1023,12 +1740,13 @@ def delete_question(question_id: int, db: Session = Depends(database.get_db)):
     q_hash = db_question.hash
     db.delete(db_question)
     db.commit()
+    question_cache.invalidate(question_id)
+    review_queue.clear()
+    eligibility.clear()
+    mastery.clear()
     
     # Backup after deletion
-    try:
-        backup_service.export_progress_to_json(db)
-    except Exception as e:
-        print(f"Backup failed: {e}")
+    request_progress_backup()
 
     if q_hash:
         try:
@@ -1038,13 +1756,173 @@ def delete_question(question_id: int, db: Session = Depends(database.get_db)):
 
     return {"message": "Question deleted successfully"}
 
-@app.post("/api/admin/backup")
+@app.post("/api/admin/backup", status_code=202)
 def create_manual_backup():
+    """Starts an online snapshot (or reports the one in progress); poll GET for progress."""
+    return backup_service.start_snapshot(reason="manual")
+
+@app.get("/api/admin/backup")
+def get_backup_status():
+    return {
+        "job": backup_service.snapshot_status(),
+        "snapshots": [
+            {"name": s["name"], "created_at": s["created_at"].isoformat(), "size_bytes": s["size_bytes"]}
+            for s in backup_service.list_snapshots()
+        ]
+    }
+
+@app.get("/healthz")
+def healthz():
+    """Liveness: the process is up and serving (no DB access)."""
+    return {"status": "ok", "pid": os.getpid()}
+
+@app.get("/readyz")
+def readyz():
+    """
+    Readiness: startup warm-up phases have finished and the schema is migrated (503 with
+    the phase table, and any failed phase's error, until then).
+    """
+    status = startup_phases.status()
+    status["leader"] = owns_background_jobs()
+    if not status["ready"]:
+        return JSONResponse(status_code=503, content=status)
+    return status
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Prometheus text exposition of this worker's metrics."""
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/admin/profiler")
+def get_profiler_status():
+    return request_profiler.status()
+
+@app.post("/api/admin/profiler")
+def arm_profiler(req: ProfilerArmRequest):
+    """Arms the sampling profiler for route templates and/or a latency threshold (this worker only)."""
+    known = {getattr(r, "path", None) for r in app.router.routes}
+    unknown = [r for r in req.routes if r not in known]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown routes: {unknown}")
+    if not req.routes and req.threshold_ms is None:
+        raise HTTPException(status_code=400, detail="Provide routes and/or threshold_ms")
+    request_profiler.arm(req.routes, req.threshold_ms, req.interval_ms, req.max_profiles)
+    return request_profiler.status()
+
+@app.delete("/api/admin/profiler")
+def disarm_profiler():
+    request_profiler.disarm()
+    return request_profiler.status()
+
+@app.get("/api/admin/profiles")
+def list_profiles():
+    return request_profiler.list_profiles()
+
+@app.get("/api/admin/profiles/{request_id}")
+def get_profile(request_id: str, format: str = "json"):
+    """Returns a stored profile as JSON (with SQL), collapsed stacks, or a speedscope document."""
+    profile = request_profiler.load(request_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if format == "collapsed":
+        return PlainTextResponse(RequestProfiler.to_collapsed(profile))
+    if format == "speedscope":
+        return RequestProfiler.to_speedscope(profile)
+    if format != "json":
+        raise HTTPException(status_code=400, detail="format must be json, collapsed or speedscope")
+    return profile
+
+@app.get("/api/admin/calibration")
+def get_calibration_status(db: Session = Depends(database.get_db)):
+    return irt.status(db)
+
+@app.post("/api/admin/calibration")
+def run_calibration(db: Session = Depends(database.get_db)):
+    """Full Rasch refit over all attempts (the leader otherwise refreshes incrementally)."""
+    result = irt.refresh(db, full=True)
+    if result is None:
+        raise HTTPException(status_code=409, detail="A calibration is already running")
+    return result
+
+@app.get("/api/admin/neighbors")
+def get_neighbors_status():
+    return point_neighbors.status()
+
+@app.post("/api/admin/neighbors")
+def rebuild_neighbors(db: Session = Depends(database.get_db)):
+    """Full rebuild of the related-point table (text similarity and co-error statistics)."""
+    return point_neighbors.build(db, full=True)
+
+@app.get("/api/admin/attempt-log")
+def get_attempt_log_status():
+    if not attempt_log:
+        return {"enabled": False}
+    return {"enabled": True, **attempt_log.status()}
+
+@app.post("/api/admin/attempt-log/compact")
+def compact_attempt_log():
+    """Folds sealed attempt-log segments into the database now (the leader otherwise does so every second)."""
+    if not attempt_log:
+        raise HTTPException(status_code=404, detail="Attempt log is disabled (ATTEMPT_LOG=1 enables it)")
+    return attempt_log.compact()
+
+@app.get("/api/admin/jobs")
+def get_jobs_status():
+    """The leader's scheduled maintenance jobs: trigger, last run, duration, outcome and next run."""
+    return {
+        "is_leader": owns_background_jobs(),
+        "running": job_scheduler.running,
+        "jobs": job_scheduler.status()
+    }
+
+@app.post("/api/admin/jobs/{name}/run")
+def run_job(name: str):
+    """Runs a maintenance job now, in this request (leader only; 409 while it is already running)."""
+    if not owns_background_jobs():
+        raise HTTPException(status_code=409, detail=f"Jobs run in the leader worker (pid {leader_lease.owner_pid()})")
     try:
-        path = backup_service.backup_db_file()
-        return {"message": "Backup created successfully", "path": path}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        result = job_scheduler.run_now(name)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown job '{name}'")
+    if result is None:
+        raise HTTPException(status_code=409, detail=f"Job '{name}' is already running")
+    return result
+
+@app.get("/api/admin/leader")
+def get_leader_status():
+    """Which worker owns the background jobs (for multi-worker deployments)."""
+    return {
+        "pid": os.getpid(),
+        "is_leader": owns_background_jobs(),
+        "leader_pid": leader_lease.owner_pid() if leader_lease else os.getpid()
+    }
+
+@app.post("/api/admin/srs/reschedule")
+def reschedule_srs(req: RescheduleRequest, db: Session = Depends(database.get_db)):
+    """
+    Switches the active SRS algorithm (and its parameters) and recomputes every
+    WrongQuestion from the attempt history in one vectorized pass. The choice is
+    stored in srs_settings in the same transaction, so every worker grades with it
+    from its next review on, and it survives restarts.
+    """
+    try:
+        scheduler = get_scheduler(req.algorithm, **req.params)
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if req.user_id is None:
+        ActiveScheduler.store(db, scheduler)
+    else:
+        active = srs_scheduler.get(db)
+        if (active.name, active.params) != (scheduler.name, scheduler.params):
+            # Everyone else's rows would stay in the old algorithm's form
+            raise HTTPException(status_code=400, detail=f"The active algorithm is {active.name}; switch it with a reschedule of all users")
+    result = reschedule_all(db, scheduler, user_id=req.user_id)
+    db.commit()
+    review_queue.clear()
+    eligibility.clear()
+    request_progress_backup()
+    return result
 
 @app.post("/api/questions/{question_id}/favorite")
 def toggle_favorite(question_id: int, db: Session = Depends(database.get_db)):
@@ -1058,17 +1936,17 @@ def toggle_favorite(question_id: int, db: Session = Depends(database.get_db)):
     # Sync to source JSON and update backup
     try:
         sync_question_state_to_json(db_question.hash, {"is_favorite": db_question.is_favorite})
-        backup_service.export_progress_to_json(db)
     except Exception as e:
-        print(f"State sync/backup failed: {e}")
+        print(f"State sync failed: {e}")
+    request_progress_backup()
 
     return {"id": db_question.id, "is_favorite": db_question.is_favorite}
 
 def sync_question_state_to_json(q_hash: str, updates: Dict):
-    import glob
-    json_dir = os.path.join(os.path.dirname(__file__), "json_questions")
-    files = glob.glob(os.path.join(json_dir, "**", "*.json"), recursive=True)
-    for json_file in files:
+    for json_file in _question_json_files(q_hash):
+        if json_file.endswith(".jsonl"):
+            topic_store.update(json_file, q_hash, updates)
+            continue
         updated = False
         try:
             with open(json_file, 'r', encoding='utf-8') as f:
@@ -1098,13 +1976,14 @@ def sync_question_state_to_json(q_hash: str, updates: Dict):
             print(f"Error syncing to {json_file}: {e}")
 
 def remove_question_from_json(q_hash: str):
-    import glob
     json_dir = os.path.join(os.path.dirname(__file__), "json_questions")
     if not os.path.exists(json_dir):
         return
 
-    files = glob.glob(os.path.join(json_dir, "**", "*.json"), recursive=True)
-    for json_file in files:
+    for json_file in _question_json_files(q_hash):
+        if json_file.endswith(".jsonl"):
+            topic_store.remove(json_file, q_hash)
+            continue
         updated = False
         try:
             with open(json_file, 'r', encoding='utf-8') as f:
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Boolean, Index, Float, text
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from .database import Base
@@ -44,6 +44,10 @@ class UserFavorite(Base):
     user = relationship("User", back_populates="favorites")
     question = relationship("Question", back_populates="favorited_by")
 
+    __table_args__ = (
+        Index("ix_user_favorites_user_question", "user_id", "question_id"),
+    )
+
 class AnswerAttempt(Base):
     __tablename__ = "answer_attempts"
 
@@ -53,10 +57,17 @@ class AnswerAttempt(Base):
     selected_answer = Column(String(1), nullable=False)
     is_correct = Column(Integer, nullable=False) # 1 for true, 0 for false
     attempted_at = Column(DateTime(timezone=True), server_default=func.now())
+    client_id = Column(String(64), nullable=True) # Client-supplied id for idempotent batch sync
 
     question = relationship("Question", back_populates="attempts")
     user = relationship("User", back_populates="attempts")
 
+    __table_args__ = (
+        Index("uq_answer_attempts_user_client", "user_id", "client_id", unique=True),
+        # Partial (normally empty) index: the gap quiz's orphan check is a lookup, not a table scan
+        Index("ix_answer_attempts_orphans", "id", sqlite_where=text("question_id IS NULL")),
+    )
+
 class WrongQuestion(Base):
     __tablename__ = "wrong_questions"
 
@@ -74,6 +85,11 @@ class WrongQuestion(Base):
     interval = Column(Integer, default=1) # Iteration interval in days
     ease_factor = Column(Integer, default=250) # Multiplied by 100 to store as int (2.5 -> 250)
 
+    __table_args__ = (
+        Index("ix_wrong_questions_user_question", "user_id", "question_id"),
+        Index("ix_wrong_questions_user_next_review", "user_id", "next_review_at"),
+    )
+
 class StudyRecord(Base):
     __tablename__ = "study_records"
 
@@ -91,7 +107,66 @@ class QuizSession(Base):
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=True) # Temporarily nullable
     session_key = Column(String(64), index=True) # Removed unique=True as it's per user now
     topic = Column(Text, nullable=True)
-    questions_json = Column(Text, nullable=False)
+    questions_json = Column(Text, nullable=False) # JSON list of question ids (inline dicts only for id-less questions)
     results_json = Column(Text, nullable=False)
     current_index = Column(Integer, default=0)
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    # Upsert target for session saves (one session per user and key)
+    __table_args__ = (
+        Index("uq_quiz_sessions_user_session", "user_id", "session_key", unique=True),
+    )
+
+class QuestionCalibration(Base):
+    """Rasch (1PL) difficulty per question, fitted by services/irt.py."""
+    __tablename__ = "question_calibration"
+
+    question_id = Column(Integer, ForeignKey("questions.id", ondelete="CASCADE"), primary_key=True)
+    difficulty = Column(Float, nullable=False, default=0.0) # logits; higher is harder
+    attempts = Column(Integer, default=0)
+    run_id = Column(Integer, index=True) # calibration_runs.id that last wrote this row
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class UserAbility(Base):
+    """Rasch (1PL) ability per user, on the same logit scale as QuestionCalibration.difficulty."""
+    __tablename__ = "user_ability"
+
+    user_id = Column(Integer, primary_key=True) # No FK: the fallback user 1 may have no users row
+    ability = Column(Float, nullable=False, default=0.0)
+    attempts = Column(Integer, default=0)
+    run_id = Column(Integer, index=True) # calibration_runs.id that last wrote this row
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class CalibrationRun(Base):
+    __tablename__ = "calibration_runs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String(20), nullable=False) # 'full' or 'incremental'
+    last_attempt_id = Column(Integer, nullable=False) # answer_attempts covered up to this id
+    attempts = Column(Integer, default=0)
+    users = Column(Integer, default=0)
+    questions = Column(Integer, default=0)
+    iterations = Column(Integer, default=0)
+    seconds = Column(Float, default=0.0)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class SyncChange(Base):
+    """Change log for GET /api/sync, appended by SQLite triggers (services/change_feed.py)."""
+    __tablename__ = "sync_changes"
+
+    seq = Column(Integer, primary_key=True) # AUTOINCREMENT: never reused, even after compaction
+    entity = Column(String(16), nullable=False) # 'question', 'favorite' or 'srs'
+    entity_id = Column(Integer, nullable=False) # question id
+    user_id = Column(Integer, nullable=True) # NULL for questions (shared by all users)
+
+    __table_args__ = {"sqlite_autoincrement": True}
+
+class SrsSetting(Base):
+    """The SRS algorithm every worker grades with (one row, id 1), set by /api/admin/srs/reschedule."""
+    __tablename__ = "srs_settings"
+
+    id = Column(Integer, primary_key=True)
+    algorithm = Column(String(20), nullable=False)
+    params = Column(Text, nullable=False, default="{}") # JSON
+    version = Column(Integer, nullable=False, default=1) # bumped on every change; workers rebuild their scheduler on a new one
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
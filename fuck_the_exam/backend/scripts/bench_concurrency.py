@@ -0,0 +1,156 @@
+"""
+Concurrent-user throughput benchmark for the hot endpoints
+(submit, study, gap, stats, session save/patch).
+
+Run it against a live backend, once per build, then compare:
+
+    python backend/scripts/bench_concurrency.py --base-url http://localhost:28888 --out before.json
+    python backend/scripts/bench_concurrency.py --base-url http://localhost:28888 --out after.json
+    python backend/scripts/bench_concurrency.py --compare before.json after.json
+
+Each simulated user has its own X-User-Id so SRS rows and sessions don't collide.
+"""
+import argparse
+import json
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = min(len(values) - 1, max(0, int(round(p / 100.0 * (len(values) - 1)))))
+    return values[k]
+
+class UserLoop:
+    def __init__(self, base_url, user_id, question_ids, exam_type):
+        self.base_url = base_url
+        self.user_id = user_id
+        self.question_ids = question_ids
+        self.exam_type = exam_type
+        self.http = requests.Session()
+        self.http.headers["X-User-Id"] = str(user_id)
+        self.rng = random.Random(user_id)
+
+    def one_request(self):
+        """Picks an endpoint with roughly the traffic mix of a study session."""
+        roll = self.rng.random()
+        qid = self.rng.choice(self.question_ids)
+        if roll < 0.45:
+            name = "submit"
+            r = self.http.post(f"{self.base_url}/api/questions/{qid}/submit",
+                               json={"question_id": qid, "selected_answer": self.rng.choice("ABCD")})
+        elif roll < 0.60:
+            name = "session_patch"
+            r = self.http.patch(f"{self.base_url}/api/quiz/session",
+                                json={"session_key": "bench", "result_index": self.rng.randrange(10),
+                                      "result": {"is_correct": True}, "current_index": self.rng.randrange(10)})
+            if r.status_code == 404:
+                name = "session_save"
+                r = self.http.post(f"{self.base_url}/api/quiz/session",
+                                   json={"session_key": "bench", "topic": "bench",
+                                         "question_ids": self.question_ids[:10], "current_index": 0})
+        elif roll < 0.75:
+            name = "study"
+            r = self.http.get(f"{self.base_url}/api/quiz/study", params={"exam_type": self.exam_type})
+        elif roll < 0.90:
+            name = "stats"
+            r = self.http.get(f"{self.base_url}/api/stats", params={"exam_type": self.exam_type})
+        else:
+            name = "gap"
+            r = self.http.get(f"{self.base_url}/api/quiz/gap", params={"exam_type": self.exam_type, "target_total": 10})
+        return name, r.status_code
+
+def run_level(base_url, concurrency, duration, question_ids, exam_type, first_user_id):
+    latencies = {}
+    errors = 0
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(i):
+        nonlocal errors
+        loop = UserLoop(base_url, first_user_id + i, question_ids, exam_type)
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                name, status = loop.one_request()
+            except requests.RequestException:
+                name, status = "error", 0
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                latencies.setdefault(name, []).append(elapsed)
+                if status >= 500 or status == 0:
+                    errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    wall = time.perf_counter() - started
+
+    all_ms = [ms for values in latencies.values() for ms in values]
+    return {
+        "concurrency": concurrency,
+        "requests": len(all_ms),
+        "errors": errors,
+        "throughput_rps": round(len(all_ms) / wall, 1),
+        "p50_ms": round(percentile(all_ms, 50), 1),
+        "p95_ms": round(percentile(all_ms, 95), 1),
+        "p99_ms": round(percentile(all_ms, 99), 1),
+        "per_endpoint_p50_ms": {k: round(statistics.median(v), 1) for k, v in sorted(latencies.items())}
+    }
+
+def compare(before_path, after_path):
+    with open(before_path, "r", encoding="utf-8") as f:
+        before = {r["concurrency"]: r for r in json.load(f)["levels"]}
+    with open(after_path, "r", encoding="utf-8") as f:
+        after = {r["concurrency"]: r for r in json.load(f)["levels"]}
+
+    print(f"{'users':>6} | {'rps before':>10} {'rps after':>10} {'x':>6} | {'p95 before':>10} {'p95 after':>10}")
+    for c in sorted(set(before) & set(after)):
+        b, a = before[c], after[c]
+        ratio = a["throughput_rps"] / b["throughput_rps"] if b["throughput_rps"] else 0
+        print(f"{c:>6} | {b['throughput_rps']:>10} {a['throughput_rps']:>10} {ratio:>6.2f} | {b['p95_ms']:>10} {a['p95_ms']:>10}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent-user benchmark for the hot API endpoints")
+    parser.add_argument("--base-url", default="http://localhost:28888")
+    parser.add_argument("--levels", default="1,8,32,64", help="Comma-separated concurrent user counts")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per concurrency level")
+    parser.add_argument("--exam-type", default="N1")
+    parser.add_argument("--first-user-id", type=int, default=1000)
+    parser.add_argument("--label", default="")
+    parser.add_argument("--out", help="Write results as JSON to this file")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="Print two result files side by side")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    questions = requests.get(f"{args.base_url}/api/questions",
+                             params={"exam_type": args.exam_type, "limit": 500}).json()
+    question_ids = [q["id"] for q in questions]
+    if not question_ids:
+        print("No questions in the target database, nothing to benchmark.")
+        return
+
+    levels = []
+    for concurrency in [int(x) for x in args.levels.split(",") if x.strip()]:
+        result = run_level(args.base_url, concurrency, args.duration, question_ids, args.exam_type, args.first_user_id)
+        print(f"{concurrency:>4} users: {result['throughput_rps']} req/s, p50 {result['p50_ms']}ms, "
+              f"p95 {result['p95_ms']}ms, p99 {result['p99_ms']}ms, errors {result['errors']}")
+        levels.append(result)
+
+    report = {"label": args.label, "base_url": args.base_url, "question_count": len(question_ids), "levels": levels}
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.out}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""
+Query-plan regression check for the hot endpoints.
+
+Calls each endpoint in-process (FastAPI TestClient, no background services) against a
+synthetic DB, records every SQL statement it runs, and checks it against the expectations
+in query_plans.json:
+
+- each statement's EXPLAIN QUERY PLAN, reduced to how every table is reached
+  (SEARCH via an index, or SCAN); a SCAN where a SEARCH is expected fails, as does a
+  new statement that scans a table
+- the number of statements per request (cold: first call, caches empty; warm: second
+  call), so an N+1 loop shows up as a higher count
+
+    python backend/scripts/check_query_plans.py            # check (builds the default synthetic DB)
+    python backend/scripts/check_query_plans.py --update   # re-record after an intended change
+    python backend/scripts/check_query_plans.py --db /tmp/synthetic.db --expect /tmp/plans-large.json --update
+
+Plans depend on the sqlite_stat1 statistics, so expectations are tied to the DB they were
+recorded on; the default is a small seeded DB from generate_synthetic_db.py. Exits 1 on a
+regression; improvements (fewer statements, a SCAN turned SEARCH) are reported and pass.
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+from typing import Dict, List
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+DEFAULT_EXPECT = os.path.join(os.path.dirname(__file__), "query_plans.json")
+DEFAULT_DB_ARGS = ["--questions", "5000", "--users", "50", "--attempts", "300000", "--points", "400", "--seed", "42"]
+PLANNED_VERBS = ("SELECT", "WITH", "UPDATE", "DELETE")
+
+def normalize_sql(statement: str) -> str:
+    """Whitespace collapsed, expanded IN lists folded, so the same query always gets one key."""
+    sql = " ".join(statement.split())
+    sql = re.sub(r"\?(?:\s*,\s*\?)+", "?...", sql)
+    sql = re.sub(r"\(\?\.\.\.\)(?:\s*,\s*\(\?\.\.\.\))+", "(?...)...", sql)
+    return sql
+
+def sql_key(sql: str) -> str:
+    return hashlib.sha1(sql.encode("utf-8")).hexdigest()[:12]
+
+def table_access(plan_rows) -> List[str]:
+    """'SEARCH answer_attempts USING INDEX ix (user_id=?)' -> 'SEARCH answer_attempts USING INDEX ix', sorted."""
+    access = set()
+    for row in plan_rows:
+        detail = row[-1]
+        m = re.match(r"(SEARCH|SCAN) (?:TABLE )?(\S+)", detail)
+        if not m or m.group(2).startswith("(") or m.group(2) == "CONSTANT":
+            continue  # subquery results and constant rows are not table accesses
+        index = re.search(r"USING (COVERING )?INDEX (\S+)", detail)
+        if "PRIMARY KEY" in detail:
+            how = " USING rowid"
+        elif index:
+            how = f" USING {'covering ' if index.group(1) else ''}{index.group(2)}"
+        else:
+            how = ""
+        access.add(f"{m.group(1)} {m.group(2)}{how}")
+    return sorted(access)
+
+class StatementRecorder:
+    """before_cursor_execute hook on both engines, collecting (statement, parameters) while armed."""
+    def __init__(self):
+        self.statements = []
+        self.armed = False
+        self._lock = threading.Lock()
+
+    def install(self, engine):
+        from sqlalchemy import event
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def _record(conn, cursor, statement, parameters, context, executemany):
+            if self.armed:
+                if executemany and parameters:
+                    parameters = parameters[0]
+                with self._lock:
+                    self.statements.append((statement, tuple(parameters) if parameters else ()))
+
+    def take(self):
+        with self._lock:
+            taken, self.statements = self.statements, []
+        return taken
+
+def build_default_db(path: str):
+    subprocess.check_call([sys.executable, os.path.join(os.path.dirname(__file__), "generate_synthetic_db.py"),
+                           "--out", path] + DEFAULT_DB_ARGS, cwd=REPO_ROOT)
+
+def endpoint_calls(db_path: str) -> Dict[str, Dict]:
+    """Request specs for the hot endpoints, with ids and topics taken from the DB."""
+    conn = sqlite3.connect(db_path)
+    try:
+        user_id = conn.execute("SELECT user_id FROM answer_attempts GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 1").fetchone()[0]
+        qids = [r[0] for r in conn.execute("SELECT id FROM questions WHERE exam_type = 'N1' ORDER BY id LIMIT 40")]
+        topic = conn.execute("SELECT knowledge_point FROM questions WHERE exam_type = 'N1' "
+                             "GROUP BY knowledge_point ORDER BY COUNT(*) DESC LIMIT 1").fetchone()[0]
+    finally:
+        conn.close()
+    headers = {"X-User-Id": str(user_id)}
+    return {
+        "submit": {"method": "POST", "url": f"/api/questions/{qids[0]}/submit", "headers": headers,
+                   "json": {"question_id": qids[0], "selected_answer": "A"}},
+        "answers_batch": {"method": "POST", "url": "/api/answers/batch", "headers": headers,
+                          "json": {"answers": [{"client_id": f"plan-{{call}}-{i}", "question_id": q, "selected_answer": "B"}
+                                               for i, q in enumerate(qids[1:11])]}},
+        "study": {"method": "GET", "url": "/api/quiz/study", "headers": headers, "params": {"exam_type": "N1"}},
+        "gap": {"method": "GET", "url": "/api/quiz/gap", "headers": headers, "params": {"exam_type": "N1", "target_total": 20}},
+        "stats": {"method": "GET", "url": "/api/stats", "headers": headers, "params": {"exam_type": "N1"}},
+        "mastery": {"method": "GET", "url": "/api/stats/mastery", "headers": headers, "params": {"exam_type": "N1"}},
+        "questions": {"method": "GET", "url": "/api/questions", "headers": headers,
+                      "params": {"exam_type": "N1", "topic": topic, "limit": 100}},
+        "wrong_questions": {"method": "GET", "url": "/api/wrong-questions", "headers": headers, "params": {"exam_type": "N1"}},
+        "due_count": {"method": "GET", "url": "/api/reviews/due-count", "headers": headers, "params": {"exam_type": "N1"}},
+        "sync": {"method": "GET", "url": "/api/sync", "headers": headers, "params": {"since": 0, "limit": 500}},
+        "session_get": {"method": "GET", "url": "/api/quiz/session", "headers": headers, "params": {"session_key": "plan"}},
+        "session_save": {"method": "POST", "url": "/api/quiz/session", "headers": headers,
+                         "json": {"session_key": "plan", "topic": topic, "question_ids": qids[:20], "current_index": 0}},
+    }
+
+def capture(db_path: str, workdir: str) -> Dict:
+    """{endpoint: {"cold": n, "warm": n, "statements": {key: {"sql", "access"}}}} for one fresh app process state."""
+    os.environ.update(DATABASE_URL=f"sqlite:///{db_path}", AUTOGEN_ENABLED="0", BACKUP_INTERVAL_MINUTES="0",
+                      QUESTION_BANK_SNAPSHOT=os.path.join(workdir, "question_bank.snap"),
+                      POINT_NEIGHBORS_PATH=os.path.join(workdir, "point_neighbors.json"),
+                      SCHEMA_LOCK_PATH=os.path.join(workdir, "schema.lock"))
+    os.environ.pop("ATTEMPT_LOG", None)
+    # Backups, the study log and profiles are written under the cwd: keep them out of the repo
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_ROOT)
+    from fastapi.testclient import TestClient
+    from backend import main, database
+
+    main.run_schema_migrations()
+    main.ingest_json_questions()  # as the leader's startup warm-up would (no lifespan here)
+    recorder = StatementRecorder()
+    recorder.install(database.engine)
+    recorder.install(database.async_engine.sync_engine)
+    client = TestClient(main.app)  # not entered: no lifespan, so no leader threads issuing SQL
+    plan_conn = sqlite3.connect(db_path)
+
+    results = {}
+    for name, spec in endpoint_calls(db_path).items():
+        counts, statements = {}, {}
+        for phase in ("cold", "warm"):
+            body = json.loads(json.dumps(spec.get("json")).replace("{call}", phase)) if spec.get("json") else None
+            recorder.armed = True
+            try:
+                response = client.request(spec["method"], spec["url"], headers=spec["headers"],
+                                          params=spec.get("params"), json=body)
+            finally:
+                recorder.armed = False
+            if response.status_code >= 400:
+                raise RuntimeError(f"{name}: HTTP {response.status_code} {response.text[:200]}")
+            executed = recorder.take()
+            counts[phase] = len(executed)
+            for statement, params in executed:
+                sql = normalize_sql(statement)
+                if not sql.upper().startswith(PLANNED_VERBS) or sql_key(sql) in statements:
+                    continue
+                try:
+                    plan = plan_conn.execute("EXPLAIN QUERY PLAN " + statement, params).fetchall()
+                except sqlite3.Error as e:
+                    plan = [(0, 0, 0, f"EXPLAIN failed: {e}")]
+                statements[sql_key(sql)] = {"sql": sql[:300], "access": table_access(plan)}
+        results[name] = {"cold": counts["cold"], "warm": counts["warm"], "statements": statements}
+    plan_conn.close()
+    return results
+
+def compare(expected: Dict, actual: Dict):
+    """(regressions, notes) between two capture() results."""
+    regressions, notes = [], []
+    for name, got in actual.items():
+        want = expected.get(name)
+        if want is None:
+            notes.append(f"{name}: no expectations recorded")
+            continue
+        for phase in ("cold", "warm"):
+            if got[phase] > want[phase]:
+                regressions.append(f"{name}: {got[phase]} statements on a {phase} call, expected {want[phase]}")
+            elif got[phase] < want[phase]:
+                notes.append(f"{name}: {got[phase]} statements on a {phase} call, down from {want[phase]}")
+        for key, stmt in got["statements"].items():
+            scans = [a for a in stmt["access"] if a.startswith("SCAN ") and not a.split()[1].startswith("(")]
+            before = want["statements"].get(key)
+            if before is None:
+                if scans:
+                    regressions.append(f"{name}: new statement scans {', '.join(scans)}\n    {stmt['sql']}")
+                continue
+            for access in scans:
+                table = access.split()[1]
+                if access not in before["access"] and any(a.startswith(f"SEARCH {table} ") for a in before["access"]):
+                    regressions.append(f"{name}: {access} where SEARCH was expected\n    {stmt['sql']}")
+            for access in before["access"]:
+                if access.startswith("SCAN ") and access not in stmt["access"]:
+                    notes.append(f"{name}: no longer {access}")
+    return regressions, notes
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the hot endpoints' SQL plans and statement counts")
+    parser.add_argument("--db", help="Synthetic DB to run against (copied first); default: a small seeded one")
+    parser.add_argument("--expect", default=DEFAULT_EXPECT)
+    parser.add_argument("--update", action="store_true", help="Record the current plans as the expectations")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="n1-plans-")
+    try:
+        db_path = os.path.join(workdir, "plans.db")
+        if args.db:
+            shutil.copyfile(args.db, db_path)
+        else:
+            build_default_db(db_path)
+        actual = capture(db_path, workdir)
+    finally:
+        os.chdir(REPO_ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.update:
+        with open(args.expect, "w", encoding="utf-8") as f:
+            json.dump(actual, f, indent=2, ensure_ascii=False, sort_keys=True)
+            f.write("\n")
+        print(f"Recorded {sum(len(r['statements']) for r in actual.values())} statements "
+              f"over {len(actual)} endpoints to {args.expect}")
+        return
+
+    with open(args.expect, "r", encoding="utf-8") as f:
+        expected = json.load(f)
+    regressions, notes = compare(expected, actual)
+    for note in notes:
+        print(f"note: {note}")
+    for regression in regressions:
+        print(f"REGRESSION: {regression}")
+    if regressions:
+        sys.exit(1)
+    print(f"OK: {len(actual)} endpoints match {os.path.relpath(args.expect, REPO_ROOT)}")
+
+if __name__ == "__main__":
+    main()
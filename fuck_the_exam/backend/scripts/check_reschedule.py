@@ -0,0 +1,129 @@
+"""
+Checks that bulk rescheduling agrees with the submit path.
+
+Replays every (user, question) attempt history of a synthetic DB through the submit
+path's SRS step (main.apply_srs_review, one attempt at a time, in server-local time as
+the endpoint sees it) and compares interval / ease_factor / review_count / next_review_at
+with what srs_scheduler.reschedule_all writes. Runs under a few time zones, one of them
+with DST, so a frame mix-up between attempted_at (naive UTC) and next_review_at (naive
+server-local) shows up as a mismatch.
+
+    python backend/scripts/check_reschedule.py                   # builds a small seeded DB
+    python backend/scripts/check_reschedule.py --db /tmp/synthetic.db --tz UTC Asia/Tokyo --algorithm fsrs
+
+Exits 1 on any mismatch.
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Dict, Tuple
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+DEFAULT_DB_ARGS = ["--questions", "500", "--users", "10", "--attempts", "20000", "--points", "40",
+                   "--days", "400", "--seed", "7"]
+DEFAULT_TZS = ["UTC", "Asia/Tokyo", "America/New_York"]
+
+def build_default_db(path: str):
+    subprocess.check_call([sys.executable, os.path.join(os.path.dirname(__file__), "generate_synthetic_db.py"),
+                           "--out", path] + DEFAULT_DB_ARGS, cwd=REPO_ROOT, stdout=subprocess.DEVNULL)
+
+def replay_submits(db_path: str, scheduler) -> Dict[Tuple[int, int], Tuple]:
+    """{(user, question): (interval, ease_factor, review_count, next_review_at)} via apply_srs_review."""
+    import sqlite3
+    from backend import main
+    from backend.services.srs_scheduler import quality_from_correct
+
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute("""
+            SELECT user_id, question_id, is_correct, attempted_at FROM answer_attempts
+            WHERE user_id IS NOT NULL AND question_id IS NOT NULL AND attempted_at IS NOT NULL
+            ORDER BY user_id, question_id, attempted_at
+        """).fetchall()
+    finally:
+        conn.close()
+    state = {}
+    for user_id, question_id, is_correct, attempted_at in rows:
+        # attempted_at is naive UTC; the endpoint's datetime.now() was the same instant, server-local
+        now = datetime.fromisoformat(attempted_at).replace(tzinfo=timezone.utc).astimezone().replace(tzinfo=None)
+        key = (user_id, question_id)
+        wrong_q = main.apply_srs_review(scheduler, None, state.get(key), question_id, user_id,
+                                        quality_from_correct(is_correct), now)
+        if wrong_q is not None:
+            state[key] = wrong_q
+    return {key: (w.interval, w.ease_factor, w.review_count, w.next_review_at) for key, w in state.items()}
+
+def reschedule(db_path: str, scheduler) -> Dict[Tuple[int, int], Tuple]:
+    import sqlite3
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from backend.services.srs_scheduler import reschedule_all
+
+    engine = create_engine(f"sqlite:///{db_path}")
+    db = sessionmaker(bind=engine)()
+    try:
+        reschedule_all(db, scheduler)
+    finally:
+        db.close()
+        engine.dispose()
+    conn = sqlite3.connect(db_path)
+    try:
+        return {(u, q): (i, e, n, datetime.fromisoformat(at))
+                for u, q, i, e, n, at in conn.execute(
+                    "SELECT user_id, question_id, interval, ease_factor, review_count, next_review_at FROM wrong_questions")}
+    finally:
+        conn.close()
+
+def check(db_path: str, workdir: str, tz: str, algorithm: str) -> int:
+    from backend.services.srs_scheduler import get_scheduler
+    os.environ["TZ"] = tz
+    time.tzset()
+    copy = os.path.join(workdir, f"reschedule-{tz.replace('/', '_')}.db")
+    shutil.copyfile(db_path, copy)
+    scheduler = get_scheduler(algorithm)
+    expected = replay_submits(copy, scheduler)
+    actual = reschedule(copy, scheduler)
+    mismatches = [(key, want, actual.get(key)) for key, want in expected.items() if actual.get(key) != want]
+    for key, want, got in mismatches[:5]:
+        print(f"MISMATCH [{tz}] user {key[0]} question {key[1]}: submit path {want}, reschedule_all {got}")
+    print(f"{tz}: {len(expected)} SRS items replayed, {len(mismatches)} mismatches")
+    return len(mismatches)
+
+def main():
+    parser = argparse.ArgumentParser(description="Check reschedule_all against replaying the submit path")
+    parser.add_argument("--db", help="Synthetic DB to run against (copied first); default: a small seeded one")
+    parser.add_argument("--tz", nargs="+", default=DEFAULT_TZS, help="Server time zones to check under")
+    parser.add_argument("--algorithm", default="sm2")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="n1-reschedule-")
+    os.environ.update(DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'app.db')}", AUTOGEN_ENABLED="0",
+                      BACKUP_INTERVAL_MINUTES="0",
+                      QUESTION_BANK_SNAPSHOT=os.path.join(workdir, "question_bank.snap"),
+                      POINT_NEIGHBORS_PATH=os.path.join(workdir, "point_neighbors.json"),
+                      SCHEMA_LOCK_PATH=os.path.join(workdir, "schema.lock"))
+    os.environ.pop("ATTEMPT_LOG", None)
+    sys.path.insert(0, REPO_ROOT)
+    try:
+        # main writes backups and study logs under the cwd: keep them out of the repo
+        os.chdir(workdir)
+        db_path = os.path.join(workdir, "history.db")
+        if args.db:
+            shutil.copyfile(args.db, db_path)
+        else:
+            build_default_db(db_path)
+        failures = sum(check(db_path, workdir, tz, args.algorithm) for tz in args.tz)
+    finally:
+        os.chdir(REPO_ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+    if failures:
+        sys.exit(1)
+    print(f"OK: reschedule_all matches the submit path under {', '.join(args.tz)}")
+
+if __name__ == "__main__":
+    main()
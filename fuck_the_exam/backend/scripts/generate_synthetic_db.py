@@ -0,0 +1,190 @@
+"""
+Builds a seeded, realistic SQLite database for benchmarks and load tests.
+
+    python backend/scripts/generate_synthetic_db.py --out /tmp/synthetic.db \
+        --questions 100000 --users 1000 --attempts 10000000
+
+- Knowledge points have Zipf-like sizes; ~10% of questions are Databricks.
+- User activity and question popularity are skewed (a few heavy users / hot questions).
+- Correctness follows a logistic model of user skill vs. question difficulty.
+- Attempts are spread over the last `--days` days.
+- SRS state (wrong_questions) is derived by replaying the attempts with the same
+  bulk rescheduler the app uses, so it matches what the live submit path would produce.
+- Favorites and one saved quiz session per user are added on top.
+
+The schema is created from backend.models, so the file can be pointed at directly
+with DATABASE_URL=sqlite:////path/to/synthetic.db.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from backend import models
+from backend.services.srs_scheduler import get_scheduler, reschedule_all
+
+CHUNK = 500_000
+
+def log(msg, started):
+    print(f"[{time.perf_counter() - started:7.1f}s] {msg}", flush=True)
+
+def create_schema(path):
+    if os.path.exists(path):
+        os.remove(path)
+    engine = create_engine(f"sqlite:///{path}")
+    models.Base.metadata.create_all(bind=engine)
+    return engine
+
+def insert_users(conn, n_users):
+    rows = [(i, f"user_{i}") for i in range(1, n_users + 1)]
+    conn.executemany("INSERT INTO users (id, username, created_at) VALUES (?, ?, CURRENT_TIMESTAMP)", rows)
+
+def insert_questions(conn, rng, n_questions, n_points, databricks_share):
+    # Zipf-like knowledge point sizes
+    weights = 1.0 / np.arange(1, n_points + 1) ** 0.8
+    point_of = rng.choice(n_points, size=n_questions, p=weights / weights.sum())
+    is_databricks = rng.random(n_questions) < databricks_share
+    answers = rng.choice(list("ABCD"), size=n_questions)
+
+    rows = []
+    for i in range(n_questions):
+        qid = i + 1
+        exam_type = "Databricks" if is_databricks[i] else "N1"
+        point = f"{'DBX' if is_databricks[i] else '文法'}-{point_of[i]:04d}"
+        content = f"［合成{qid}］彼の説明を聞い（　）、ようやく事情が飲み込めた。#{qid}"
+        options = {k: f"選択肢{k}-{qid}" for k in "ABCD"}
+        options_json = json.dumps(options, ensure_ascii=False)
+        unique = f"{content}-{json.dumps(options, sort_keys=True)}"
+        rows.append((
+            qid, content, options_json, str(answers[i]),
+            f"【解析】{point} の用法。", "要点：前後の文脈で判断する。",
+            point, exam_type, hashlib.sha256(unique.encode()).hexdigest()
+        ))
+        if len(rows) >= CHUNK:
+            conn.executemany(
+                "INSERT INTO questions (id, content, options, correct_answer, explanation, memorization_tip, "
+                "knowledge_point, exam_type, hash, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)", rows)
+            rows = []
+    if rows:
+        conn.executemany(
+            "INSERT INTO questions (id, content, options, correct_answer, explanation, memorization_tip, "
+            "knowledge_point, exam_type, hash, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)", rows)
+    return answers
+
+def insert_attempts(conn, rng, n_attempts, n_users, n_questions, answers, days, started):
+    user_weights = rng.pareto(1.5, n_users) + 0.05
+    user_p = user_weights / user_weights.sum()
+    question_weights = rng.pareto(2.0, n_questions) + 0.1
+    question_p = question_weights / question_weights.sum()
+    skill = rng.normal(0.8, 0.7, n_users)
+    difficulty = rng.normal(0.0, 1.0, n_questions)
+
+    now = np.datetime64("now", "us")
+    span_us = np.int64(days * 86400 * 1_000_000)
+    answers_arr = np.array(list(answers))
+    wrong_choice = {"A": "B", "B": "C", "C": "D", "D": "A"}
+
+    inserted = 0
+    while inserted < n_attempts:
+        n = min(CHUNK, n_attempts - inserted)
+        users = rng.choice(n_users, size=n, p=user_p)
+        questions = rng.choice(n_questions, size=n, p=question_p)
+        p_correct = 1.0 / (1.0 + np.exp(-(skill[users] - difficulty[questions])))
+        correct = (rng.random(n) < p_correct).astype(np.int64)
+        offsets = (rng.random(n) * span_us).astype(np.int64)
+        stamps = np.datetime_as_string(now - offsets.astype("timedelta64[us]"), unit="us")
+        right = answers_arr[questions]
+
+        rows = [
+            (int(u) + 1, int(q) + 1, r if c else wrong_choice[r], int(c), str(t).replace("T", " "))
+            for u, q, r, c, t in zip(users, questions, right, correct, stamps)
+        ]
+        conn.executemany(
+            "INSERT INTO answer_attempts (user_id, question_id, selected_answer, is_correct, attempted_at) "
+            "VALUES (?, ?, ?, ?, ?)", rows)
+        inserted += n
+        log(f"attempts: {inserted:,}/{n_attempts:,}", started)
+
+def insert_favorites(conn, rng, n_users, n_questions, favorites_per_user):
+    rows = set()
+    for user_id in range(1, n_users + 1):
+        k = int(rng.poisson(favorites_per_user))
+        for qid in rng.integers(1, n_questions + 1, size=k):
+            rows.add((user_id, int(qid)))
+    conn.executemany(
+        "INSERT INTO user_favorites (user_id, question_id, created_at) VALUES (?, ?, CURRENT_TIMESTAMP)", sorted(rows))
+    return len(rows)
+
+def insert_sessions(conn, rng, n_users, n_questions):
+    rows = []
+    for user_id in range(1, n_users + 1):
+        ids = [int(i) for i in rng.integers(1, n_questions + 1, size=20)]
+        answered = int(rng.integers(0, 20))
+        results = [{"selected_answer": "A", "is_correct": bool(rng.random() < 0.7)} for _ in range(answered)]
+        results += [None] * (20 - answered)
+        rows.append((user_id, "default", "综合练习", json.dumps(ids), json.dumps(results), answered))
+    conn.executemany(
+        "INSERT INTO quiz_sessions (user_id, session_key, topic, questions_json, results_json, current_index, updated_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)", rows)
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a seeded synthetic quiz database")
+    parser.add_argument("--out", default="synthetic.db")
+    parser.add_argument("--questions", type=int, default=100_000)
+    parser.add_argument("--users", type=int, default=1_000)
+    parser.add_argument("--attempts", type=int, default=10_000_000)
+    parser.add_argument("--points", type=int, default=400, help="Number of knowledge points")
+    parser.add_argument("--databricks-share", type=float, default=0.1)
+    parser.add_argument("--favorites-per-user", type=float, default=15)
+    parser.add_argument("--days", type=int, default=180, help="Attempts are spread over this many past days")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    rng = np.random.default_rng(args.seed)
+    out = os.path.abspath(args.out)
+
+    engine = create_schema(out)
+    conn = sqlite3.connect(out)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+
+    insert_users(conn, args.users)
+    answers = insert_questions(conn, rng, args.questions, args.points, args.databricks_share)
+    conn.commit()
+    log(f"users: {args.users:,}, questions: {args.questions:,}", started)
+
+    insert_attempts(conn, rng, args.attempts, args.users, args.questions, answers, args.days, started)
+    conn.commit()
+
+    favorites = insert_favorites(conn, rng, args.users, args.questions, args.favorites_per_user)
+    insert_sessions(conn, rng, args.users, args.questions)
+    conn.commit()
+    conn.close()
+    log(f"favorites: {favorites:,}, sessions: {args.users:,}", started)
+
+    # Realistic SRS state: replay the attempts exactly as the app would have scheduled them
+    db = sessionmaker(bind=engine)()
+    try:
+        stats = reschedule_all(db, get_scheduler("sm2"))
+    finally:
+        db.close()
+    log(f"SRS rows: {stats}", started)
+
+    conn = sqlite3.connect(out)
+    conn.execute("ANALYZE")
+    conn.close()
+    engine.dispose()
+    log(f"Done: {out} ({os.path.getsize(out) / 1e6:.1f} MB)", started)
+
+if __name__ == "__main__":
+    main()
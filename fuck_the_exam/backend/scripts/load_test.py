@@ -0,0 +1,206 @@
+"""
+Per-endpoint load suite: submit, study, gap, stats, session save and questions listing.
+
+Against a running backend:
+    python backend/scripts/load_test.py --base-url http://localhost:28888 --out results.json
+
+Or let it start a backend on a synthetic DB (see generate_synthetic_db.py):
+    python backend/scripts/load_test.py --spawn --db /tmp/synthetic.db --out results.json
+
+Each endpoint is driven on its own for --requests requests at --concurrency, with the
+X-User-Id spread over --users users. The JSON report has p50/p95/p99, mean and
+throughput per endpoint plus the git revision, so builds can be compared directly.
+Submits and session saves write to the DB: run each build on a fresh copy.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+ENDPOINTS = ["submit", "study", "gap", "stats", "session_save", "questions"]
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = min(len(values) - 1, max(0, int(round(p / 100.0 * (len(values) - 1)))))
+    return values[k]
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, text=True).strip()
+    except Exception:
+        return None
+
+class Workload:
+    def __init__(self, base_url, users, exam_type, question_ids, topics, seed):
+        self.base_url = base_url
+        self.users = users
+        self.exam_type = exam_type
+        self.question_ids = question_ids
+        self.topics = topics
+        self.seed = seed
+        self._local = threading.local()
+
+    def _http(self):
+        if not hasattr(self._local, "http"):
+            self._local.http = requests.Session()
+            self._local.rng = random.Random(self.seed + threading.get_ident())
+        return self._local.http, self._local.rng
+
+    def call(self, endpoint):
+        http, rng = self._http()
+        headers = {"X-User-Id": str(rng.randint(1, self.users))}
+        base = self.base_url
+        if endpoint == "submit":
+            qid = rng.choice(self.question_ids)
+            return http.post(f"{base}/api/questions/{qid}/submit", headers=headers,
+                             json={"question_id": qid, "selected_answer": rng.choice("ABCD")})
+        if endpoint == "study":
+            return http.get(f"{base}/api/quiz/study", headers=headers, params={"exam_type": self.exam_type})
+        if endpoint == "gap":
+            return http.get(f"{base}/api/quiz/gap", headers=headers, params={"exam_type": self.exam_type, "target_total": 20})
+        if endpoint == "stats":
+            return http.get(f"{base}/api/stats", headers=headers, params={"exam_type": self.exam_type})
+        if endpoint == "session_save":
+            ids = rng.sample(self.question_ids, min(20, len(self.question_ids)))
+            return http.post(f"{base}/api/quiz/session", headers=headers,
+                             json={"session_key": "load", "topic": "load", "question_ids": ids, "current_index": 0})
+        if endpoint == "questions":
+            return http.get(f"{base}/api/questions", headers=headers,
+                            params={"exam_type": self.exam_type, "topic": rng.choice(self.topics), "limit": 100})
+        raise ValueError(endpoint)
+
+def run_endpoint(workload, endpoint, n_requests, concurrency):
+    latencies, errors = [], 0
+    lock = threading.Lock()
+
+    def one(_):
+        nonlocal errors
+        start = time.perf_counter()
+        try:
+            status = workload.call(endpoint).status_code
+        except requests.RequestException:
+            status = 0
+        elapsed = (time.perf_counter() - start) * 1000
+        with lock:
+            latencies.append(elapsed)
+            if status == 0 or status >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(n_requests)))
+    wall = time.perf_counter() - started
+    return {
+        "requests": n_requests,
+        "errors": errors,
+        "throughput_rps": round(n_requests / wall, 2),
+        "mean_ms": round(sum(latencies) / len(latencies), 2),
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "max_ms": round(max(latencies), 2)
+    }
+
+def spawn_backend(db_path, port):
+    """Starts uvicorn against db_path from a scratch cwd, so backups and logs stay out of the repo."""
+    workdir = tempfile.mkdtemp(prefix="n1-load-")
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.abspath(db_path)}",
+               PYTHONPATH=REPO_ROOT, AUTOGEN_ENABLED="0", BACKUP_INTERVAL_MINUTES="0")
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "backend.main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=workdir, env=env
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    for _ in range(600):
+        try:
+            # Wait for warm-up too, so the first measured requests don't race ingestion
+            if requests.get(f"{base_url}/readyz", timeout=1).status_code == 200:
+                return proc, base_url, workdir
+        except requests.RequestException:
+            pass
+        if proc.poll() is not None:
+            raise RuntimeError("Backend exited during startup")
+        time.sleep(0.5)
+    proc.terminate()
+    raise RuntimeError("Backend did not come up")
+
+def main():
+    parser = argparse.ArgumentParser(description="Endpoint load suite with JSON results")
+    parser.add_argument("--base-url", default="http://localhost:28888")
+    parser.add_argument("--spawn", action="store_true", help="Start a backend on --db instead of using --base-url")
+    parser.add_argument("--db", help="SQLite file for --spawn")
+    parser.add_argument("--port", type=int, default=28990)
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS))
+    parser.add_argument("--requests", type=int, default=300, help="Requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=20, help="Unmeasured requests per endpoint")
+    parser.add_argument("--users", type=int, default=1000, help="X-User-Id is drawn from 1..users")
+    parser.add_argument("--exam-type", default="N1")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--label", default="")
+    parser.add_argument("--out", help="Write the JSON report here (printed otherwise)")
+    args = parser.parse_args()
+
+    proc = workdir = None
+    base_url = args.base_url
+    if args.spawn:
+        if not args.db:
+            parser.error("--spawn needs --db")
+        proc, base_url, workdir = spawn_backend(args.db, args.port)
+
+    try:
+        sample = requests.get(f"{base_url}/api/questions", params={"exam_type": args.exam_type, "limit": 2000}).json()
+        question_ids = [q["id"] for q in sample]
+        topics = sorted({q["knowledge_point"] for q in sample if q.get("knowledge_point")}) or [None]
+        if not question_ids:
+            print("No questions in the target database, nothing to test.")
+            return
+        workload = Workload(base_url, args.users, args.exam_type, question_ids, topics, args.seed)
+
+        results = {}
+        for endpoint in [e.strip() for e in args.endpoints.split(",") if e.strip()]:
+            if endpoint not in ENDPOINTS:
+                parser.error(f"Unknown endpoint {endpoint}; choose from {ENDPOINTS}")
+            if args.warmup:
+                run_endpoint(workload, endpoint, args.warmup, args.concurrency)
+            results[endpoint] = run_endpoint(workload, endpoint, args.requests, args.concurrency)
+            r = results[endpoint]
+            print(f"{endpoint:>13}: {r['throughput_rps']:>8} req/s  p50 {r['p50_ms']:>8}ms  "
+                  f"p95 {r['p95_ms']:>8}ms  p99 {r['p99_ms']:>8}ms  errors {r['errors']}")
+
+        report = {
+            "label": args.label,
+            "git_revision": git_revision(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "config": {k: v for k, v in vars(args).items() if k not in ("out",)},
+            "endpoints": results
+        }
+        if args.out:
+            with open(args.out, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2, ensure_ascii=False)
+            print(f"Results written to {args.out}")
+        else:
+            print(json.dumps(report, indent=2, ensure_ascii=False))
+    finally:
+        if proc:
+            proc.terminate()
+            try:
+                proc.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+            shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
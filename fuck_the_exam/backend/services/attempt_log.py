@@ -0,0 +1,328 @@
+"""
+Optional write path for answer submissions (ATTEMPT_LOG=1): instead of a SQLite transaction
+per answer, each worker appends the attempt as a JSON line to its own log segment and
+acknowledges it once the line is fsync'd. Concurrent submissions share one write + fsync
+(group commit), so the per-answer cost is an append rather than a turn on SQLite's single
+writer lock. The leader's compaction job folds sealed segments into answer_attempts and
+wrong_questions in large transactions, then deletes them.
+
+    <log_dir>/<pid>-<boot>-<n>.open   segment being appended to by worker <pid>
+    <log_dir>/<pid>-<boot>-<n>.log    sealed segment, waiting for compaction
+
+Segments are sealed (renamed) after `segment_seconds` or `segment_bytes`, and on shutdown.
+After a crash, compaction seals `.open` segments whose worker is gone, dropping a torn
+last line: an answer is durable once append() resolves. Every event carries a unique id
+stored as answer_attempts.client_id, so re-applying a segment after a crash between the
+commit and the delete is a no-op.
+"""
+import json
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .leader_lease import exclusive_file_lock
+
+def _fsync_dir(path: str):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+def read_segment(path: str) -> List[Dict]:
+    """Complete event lines of a segment; a torn or corrupt line is skipped."""
+    events = []
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                print(f"Attempt log: skipping corrupt line in {path}")
+    return events
+
+class AttemptLog:
+    def __init__(self, log_dir: str, apply_events: Callable[[List[Dict]], int],
+                 group_commit_ms: float = 0.5, max_batch: int = 1024,
+                 segment_seconds: float = 1.0, segment_bytes: int = 4 * 1024 * 1024,
+                 max_compact_events: int = 50000,
+                 stale_seconds: float = 3600):
+        self.log_dir = log_dir
+        self.apply_events = apply_events
+        self.group_commit_ms = group_commit_ms
+        self.max_batch = max_batch
+        self.segment_seconds = segment_seconds
+        self.segment_bytes = segment_bytes
+        self.max_compact_events = max_compact_events
+        self.stale_seconds = stale_seconds
+
+        self._boot = secrets.token_hex(4)
+        self._seq = 0
+        self._segment_no = 0
+        self._fd: Optional[int] = None
+        self._segment: Optional[str] = None  # stem of the open segment
+        self._segment_opened = 0.0
+        self._segment_size = 0
+
+        self._queue: List[Tuple[bytes, Future]] = []
+        self._cond = threading.Condition()
+        self._writer: Optional[threading.Thread] = None
+        self._closed = False
+
+        # (user_id, question_id) -> (SRS state, segment stem of its latest event)
+        self._pending: Dict[Tuple[int, int], Tuple[Any, str]] = {}
+        self._pending_lock = threading.Lock()
+
+        self._stats = {"appended": 0, "fsyncs": 0, "segments_compacted": 0, "events_applied": 0}
+
+    # --- Appending (every worker) ---
+    def next_id(self) -> str:
+        with self._cond:
+            self._seq += 1
+            return f"log:{os.getpid()}:{self._boot}:{self._seq}"
+
+    def append(self, event: Dict) -> Future:
+        """Queues the event; the future resolves to its segment stem once the event is on disk."""
+        line = (json.dumps(event, ensure_ascii=False, separators=(",", ":"), default=str) + "\n").encode("utf-8")
+        future: Future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("attempt log is closed")
+            self._queue.append((line, future))
+            if self._writer is None:
+                os.makedirs(self.log_dir, exist_ok=True)
+                self._writer = threading.Thread(target=self._run_writer, daemon=True, name="attempt-log-writer")
+                self._writer.start()
+            self._cond.notify()
+        return future
+
+    def _open_segment(self):
+        self._segment_no += 1
+        self._segment = f"{os.getpid()}-{self._boot}-{self._segment_no:06d}"
+        self._fd = os.open(os.path.join(self.log_dir, self._segment + ".open"),
+                           os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        _fsync_dir(self.log_dir)
+        self._segment_opened = time.monotonic()
+        self._segment_size = 0
+
+    def _seal_segment(self):
+        if self._fd is None:
+            return
+        os.close(self._fd)
+        self._fd = None
+        base = os.path.join(self.log_dir, self._segment)
+        try:
+            os.replace(base + ".open", base + ".log")
+            _fsync_dir(self.log_dir)
+        except OSError as e:
+            # Left as .open; the compactor recovers it once this worker is gone
+            print(f"Attempt log: could not seal {base}.open: {e}")
+
+    def _seal_due(self) -> bool:
+        return self._fd is not None and (
+            self._segment_size >= self.segment_bytes
+            or time.monotonic() - self._segment_opened >= self.segment_seconds)
+
+    def _run_writer(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed and not self._seal_due():
+                    timeout = None
+                    if self._fd is not None:
+                        timeout = max(0.0, self.segment_seconds - (time.monotonic() - self._segment_opened))
+                    self._cond.wait(timeout)
+                if not self._queue:
+                    if self._fd is not None:
+                        self._seal_segment()
+                    if self._closed:
+                        return
+                    continue
+            if self.group_commit_ms > 0 and len(self._queue) < self.max_batch:
+                # Let submissions arriving during this window share the fsync
+                time.sleep(self.group_commit_ms / 1000.0)
+            with self._cond:
+                batch, self._queue = self._queue[:self.max_batch], self._queue[self.max_batch:]
+            self._write_batch(batch)
+
+    def _discard_partial(self):
+        """
+        After a failed write or fsync: cut the segment back to its last acknowledged byte, so
+        a torn line cannot swallow the next batch's first event. If even that fails, the
+        segment is sealed as is (read_segment drops the torn tail) and the next batch starts
+        a new one.
+        """
+        try:
+            os.ftruncate(self._fd, self._segment_size)
+            (getattr(os, "fdatasync", None) or os.fsync)(self._fd)
+        except OSError as e:
+            print(f"Attempt log: could not truncate {self._segment}.open after a failed write ({e}), sealing it")
+            try:
+                self._seal_segment()
+            except OSError:
+                self._fd = None
+
+    def _write_batch(self, batch: List[Tuple[bytes, Future]]):
+        try:
+            if self._fd is None:
+                self._open_segment()
+            data = b"".join(line for line, _ in batch)
+            view = memoryview(data)
+            try:
+                while view:
+                    view = view[os.write(self._fd, view):]
+                (getattr(os, "fdatasync", None) or os.fsync)(self._fd)
+            except OSError:
+                self._discard_partial()
+                raise
+            self._segment_size += len(data)
+            stem = self._segment
+            self._stats["appended"] += len(batch)
+            self._stats["fsyncs"] += 1
+            if self._seal_due():
+                self._seal_segment()
+        except OSError as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for _, future in batch:
+            future.set_result(stem)
+
+    def close(self, timeout: float = 10.0):
+        """Flushes queued events and seals the open segment."""
+        with self._cond:
+            self._closed = True
+            writer = self._writer
+            self._cond.notify()
+        if writer is not None:
+            writer.join(timeout)
+
+    # --- In-memory SRS state for answers not yet compacted ---
+    def remember(self, user_id: int, question_id: int, state: Any, stem: str):
+        with self._pending_lock:
+            self._pending[(user_id, question_id)] = (state, stem)
+
+    def _segment_exists(self, stem: str) -> bool:
+        base = os.path.join(self.log_dir, stem)
+        return os.path.exists(base + ".log") or os.path.exists(base + ".open")
+
+    def pending_state(self, user_id: int, question_id: int) -> Optional[Any]:
+        """This worker's latest SRS state for the pair, while its event still awaits compaction."""
+        with self._pending_lock:
+            entry = self._pending.get((user_id, question_id))
+        if entry is None:
+            return None
+        if not self._segment_exists(entry[1]):
+            # Compacted: the database has it now
+            with self._pending_lock:
+                if self._pending.get((user_id, question_id)) is entry:
+                    del self._pending[(user_id, question_id)]
+            return None
+        return entry[0]
+
+    def _prune_pending(self):
+        with self._pending_lock:
+            stems = {stem for _, stem in self._pending.values()}
+        gone = {stem for stem in stems if not self._segment_exists(stem)}
+        if gone:
+            with self._pending_lock:
+                for key in [k for k, (_, stem) in self._pending.items() if stem in gone]:
+                    del self._pending[key]
+
+    # --- Compaction (leader) ---
+    def _orphaned(self, name: str) -> bool:
+        """
+        Whether an .open segment is no longer being written. Segments are owned by (pid, boot):
+        after a container restart the new process often has the old pid (1 under exec-form
+        uvicorn), so a matching pid alone proves nothing.
+        """
+        try:
+            pid_text, boot, _ = name[:-len(".open")].split("-", 2)
+            pid = int(pid_text)
+        except ValueError:
+            return False
+        if pid == os.getpid():
+            # Ours, unless it is the segment this instance has open; an earlier boot's is orphaned
+            return name[:-len(".open")] != self._segment
+        try:
+            stale = time.time() - os.stat(os.path.join(self.log_dir, name)).st_mtime > self.stale_seconds
+        except OSError:
+            return False
+        return not _pid_alive(pid) or stale
+
+    def _claimable(self) -> List[str]:
+        """Sealed segments, plus open ones left behind by dead (or long stuck) workers, sealed here."""
+        try:
+            names = sorted(os.listdir(self.log_dir))
+        except OSError:
+            return []
+        paths = []
+        for name in names:
+            path = os.path.join(self.log_dir, name)
+            if name.endswith(".log"):
+                paths.append(path)
+            elif name.endswith(".open") and self._orphaned(name):
+                sealed = path[:-len(".open")] + ".log"
+                try:
+                    os.replace(path, sealed)
+                except OSError:
+                    continue
+                print(f"Attempt log: recovered segment {name}")
+                paths.append(sealed)
+        return paths
+
+    def compact(self) -> Dict:
+        """Applies every claimable segment (in batches of about max_compact_events) and deletes it."""
+        started = time.perf_counter()
+        segments = applied = 0
+        with exclusive_file_lock(os.path.join(self.log_dir, "compact.lock")):
+            paths = self._claimable()
+            while paths:
+                batch_paths, events = [], []
+                while paths and (not events or len(events) < self.max_compact_events):
+                    path = paths.pop(0)
+                    batch_paths.append(path)
+                    events.extend(read_segment(path))
+                if events:
+                    applied += self.apply_events(events)
+                for path in batch_paths:
+                    os.remove(path)
+                segments += len(batch_paths)
+            if segments:
+                _fsync_dir(self.log_dir)
+        self._prune_pending()
+        self._stats["segments_compacted"] += segments
+        self._stats["events_applied"] += applied
+        return {"segments": segments, "applied": applied, "seconds": round(time.perf_counter() - started, 3)}
+
+    def status(self) -> Dict:
+        backlog = {"open": 0, "sealed": 0, "bytes": 0}
+        try:
+            for name in os.listdir(self.log_dir):
+                kind = "open" if name.endswith(".open") else "sealed" if name.endswith(".log") else None
+                if kind:
+                    backlog[kind] += 1
+                    backlog["bytes"] += os.path.getsize(os.path.join(self.log_dir, name))
+        except OSError:
+            pass
+        with self._pending_lock:
+            pending = len(self._pending)
+        return {"log_dir": self.log_dir, "segments": backlog, "pending_srs": pending,
+                **self._stats}
@@ -1,32 +1,237 @@
 import os
 import json
+import gzip
 import shutil
+import sqlite3
+import tempfile
+import threading
+import time
 from datetime import datetime
 from sqlalchemy.orm import Session
+from sqlalchemy import func, insert, select
 from .. import models
 
+try:
+    import zstandard
+except ImportError:  # optional: snapshots fall back to gzip
+    zstandard = None
+
+SNAPSHOT_PREFIX = "n1_app_"
+SNAPSHOT_TIME_FORMAT = "%Y%m%d_%H%M%S"
+
 class BackupService:
-    def __init__(self, db_path: str, backup_dir: str):
+    def __init__(self, db_path: str, backup_dir: str, step_pages: int = 256, step_sleep: float = 0.005,
+                 keep_hourly: int = 24, keep_daily: int = 7, keep_weekly: int = 8):
         self.db_path = db_path
         self.backup_dir = backup_dir
+        # Online backup: copy step_pages pages, then release the read lock for step_sleep seconds
+        self.step_pages = step_pages
+        self.step_sleep = step_sleep
+        self.keep_hourly = keep_hourly
+        self.keep_daily = keep_daily
+        self.keep_weekly = keep_weekly
+        self._job = None
+        self._job_lock = threading.Lock()
         if not os.path.exists(backup_dir):
             os.makedirs(backup_dir)
 
-    def backup_db_file(self):
-        """Creates a timestamped copy of the SQLite database file."""
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_path = os.path.join(self.backup_dir, f"n1_app_{timestamp}.db.bak")
-        shutil.copy2(self.db_path, backup_path)
-        return backup_path
+    # --- Database snapshots ---
+    def start_snapshot(self, reason: str = "manual", wait: bool = False):
+        """
+        Starts a snapshot in a background thread (or joins the one already running) and
+        returns its status; poll snapshot_status() for progress. wait=True runs it in the
+        calling thread instead (scheduled snapshots, timed by the scheduler).
+        """
+        with self._job_lock:
+            if self._job and self._job["state"] == "running":
+                return dict(self._job)
+            self._job = {
+                "state": "running",
+                "reason": reason,
+                "started_at": datetime.now().isoformat(),
+                "finished_at": None,
+                "pages_total": None,
+                "pages_done": 0,
+                "restarts": 0,
+                "progress": 0.0,
+                "path": None,
+                "size_bytes": None,
+                "integrity": None,
+                "pruned": [],
+                "error": None
+            }
+            job = self._job
+        if wait:
+            self._run_snapshot(job)
+            return dict(job)
+        threading.Thread(target=self._run_snapshot, args=(job,), daemon=True, name="db-snapshot").start()
+        return dict(job)
+
+    def snapshot_status(self):
+        with self._job_lock:
+            return dict(self._job) if self._job else {"state": "idle"}
+
+    def last_snapshot_time(self):
+        snapshots = self.list_snapshots()
+        return snapshots[0]["created_at"] if snapshots else None
+
+    def _run_snapshot(self, job):
+        started = time.perf_counter()
+        timestamp = datetime.now().strftime(SNAPSHOT_TIME_FORMAT)
+        fd, raw_path = tempfile.mkstemp(prefix=f".{SNAPSHOT_PREFIX}{timestamp}_", suffix=".partial", dir=self.backup_dir)
+        os.close(fd)
+        state = "failed"
+        try:
+            self._copy_online(raw_path, job)
+
+            # Verify the copy before it can replace anything older
+            check = sqlite3.connect(f"file:{raw_path}?mode=ro", uri=True)
+            try:
+                result = check.execute("PRAGMA integrity_check").fetchone()[0]
+            finally:
+                check.close()
+            job["integrity"] = result
+            if result != "ok":
+                raise RuntimeError(f"integrity_check failed: {result}")
+
+            base_path = os.path.join(self.backup_dir, f"{SNAPSHOT_PREFIX}{timestamp}.db")
+            n = 1
+            while any(os.path.exists(base_path + ext) for ext in (".zst", ".gz")):
+                n += 1
+                base_path = os.path.join(self.backup_dir, f"{SNAPSHOT_PREFIX}{timestamp}_{n}.db")
+            final_path = self._compress(raw_path, base_path)
+            job["path"] = final_path
+            job["size_bytes"] = os.path.getsize(final_path)
+            job["pruned"] = self.apply_retention()
+            state = "done"
+            print(f"Backup: snapshot {os.path.basename(final_path)} written in {time.perf_counter() - started:.1f}s")
+        except Exception as e:
+            job["error"] = str(e)
+            print(f"Backup: snapshot failed: {e}")
+        finally:
+            if os.path.exists(raw_path):
+                os.remove(raw_path)
+            job["finished_at"] = datetime.now().isoformat()
+            job["state"] = state
+
+    def _copy_online(self, raw_path: str, job):
+        """
+        SQLite online backup API, a bounded number of pages per step so writers are never
+        stalled for long. A write from another connection restarts the copy; each restart
+        quadruples the step, so under constant writes it converges on a single-step copy
+        (one short read lock) instead of starving.
+        """
+        class Restarted(Exception):
+            pass
+
+        steps = [0]
+
+        def progress(status, remaining, total):
+            # Without a restart, step n leaves exactly min(n * step, total) pages copied
+            steps[0] += 1
+            done = total - remaining
+            if step > 0 and done < min(steps[0] * step, total):
+                raise Restarted()
+            job["pages_total"] = total
+            job["pages_done"] = done
+            job["progress"] = round(done / total, 4) if total else 1.0
+
+        if not os.path.exists(self.db_path):
+            raise FileNotFoundError(self.db_path)
+        src = sqlite3.connect(self.db_path, timeout=15)
+        step = self.step_pages
+        try:
+            while True:
+                dst = sqlite3.connect(raw_path)
+                try:
+                    src.backup(dst, pages=step, progress=progress, sleep=self.step_sleep)
+                    break
+                except Restarted:
+                    job["restarts"] += 1
+                    job["pages_done"] = 0
+                    steps[0] = 0
+                    step = -1 if job["pages_total"] and step * 4 >= job["pages_total"] else step * 4
+                finally:
+                    dst.close()
+        finally:
+            src.close()
+        job["progress"] = 1.0
+
+    @staticmethod
+    def _compress(raw_path: str, base_path: str) -> str:
+        """Streams the raw copy into <base>.zst (zstandard installed) or <base>.gz."""
+        suffix = ".zst" if zstandard is not None else ".gz"
+        final_path = base_path + suffix
+        tmp_path = final_path + ".tmp"
+        with open(raw_path, "rb") as src:
+            if zstandard is not None:
+                with open(tmp_path, "wb") as dst:
+                    zstandard.ZstdCompressor(level=10, threads=-1).copy_stream(src, dst)
+            else:
+                with gzip.open(tmp_path, "wb", compresslevel=6) as dst:
+                    shutil.copyfileobj(src, dst, 1024 * 1024)
+        os.replace(tmp_path, final_path)
+        return final_path
+
+    def list_snapshots(self):
+        """Snapshots in backup_dir, newest first (legacy .db.bak copies included)."""
+        snapshots = []
+        for name in os.listdir(self.backup_dir):
+            if not name.startswith(SNAPSHOT_PREFIX) or not name.endswith((".db.zst", ".db.gz", ".db.bak")):
+                continue
+            try:
+                created = datetime.strptime(name[len(SNAPSHOT_PREFIX):len(SNAPSHOT_PREFIX) + 15], SNAPSHOT_TIME_FORMAT)
+            except ValueError:
+                continue
+            path = os.path.join(self.backup_dir, name)
+            snapshots.append({"name": name, "path": path, "created_at": created, "size_bytes": os.path.getsize(path)})
+        snapshots.sort(key=lambda s: s["created_at"], reverse=True)
+        return snapshots
+
+    def apply_retention(self):
+        """
+        Keeps the newest snapshot of each of the last keep_hourly hours, keep_daily days
+        and keep_weekly ISO weeks (the newest snapshot is always kept); deletes the rest.
+        """
+        snapshots = self.list_snapshots()
+        keep = set()
+        if snapshots:
+            keep.add(snapshots[0]["name"])
+        for count, bucket in (
+            (self.keep_hourly, lambda d: d.strftime("%Y%m%d%H")),
+            (self.keep_daily, lambda d: d.strftime("%Y%m%d")),
+            (self.keep_weekly, lambda d: "%d-%02d" % d.isocalendar()[:2])
+        ):
+            seen = []
+            for snap in snapshots:
+                key = bucket(snap["created_at"])
+                if key in seen:
+                    continue
+                if len(seen) >= count:
+                    break
+                seen.append(key)
+                keep.add(snap["name"])
+
+        pruned = []
+        for snap in snapshots:
+            if snap["name"] not in keep:
+                try:
+                    os.remove(snap["path"])
+                    pruned.append(snap["name"])
+                except OSError as e:
+                    print(f"Backup: could not prune {snap['name']}: {e}")
+        return pruned
 
     def export_progress_to_json(self, db: Session):
         """Mirror SRS state (wrong_questions) to a JSON file."""
-        wqs = db.query(models.WrongQuestion).all()
+        rows = db.query(models.WrongQuestion, models.Question.hash).join(
+            models.Question, models.WrongQuestion.question_id == models.Question.id
+        ).all()
         export_data = []
-        for w in wqs:
-            q = w.question
+        for w, q_hash in rows:
             export_data.append({
-                "question_hash": q.hash,
+                "user_id": w.user_id,
+                "question_hash": q_hash,
                 "review_count": w.review_count,
                 "interval": w.interval,
                 "ease_factor": w.ease_factor,
@@ -35,12 +240,31 @@ class BackupService:
             })
         
         filepath = os.path.join(self.backup_dir, "progress_backup.json")
-        with open(filepath, 'w', encoding='utf-8') as f:
+        # Write-then-rename so a concurrent reader (restore in another worker) never sees a partial file
+        tmp_path = f"{filepath}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
             json.dump(export_data, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, filepath)
         return filepath
 
-    def restore_progress_from_json(self, db: Session):
-        """Restore SRS state from JSON back into the database."""
+    def progress_fingerprint(self, db: Session):
+        """Cheap summary of wrong_questions that changes whenever an SRS row is added, removed or reviewed."""
+        return db.query(
+            func.count(models.WrongQuestion.id),
+            func.total(models.WrongQuestion.review_count),
+            func.total(func.julianday(models.WrongQuestion.next_review_at))
+        ).one()
+
+    def restore_progress_from_json(self, db: Session, only_empty_users: bool = True, default_user_id: int = 1):
+        """
+        Restore SRS state from JSON back into the database, in bulk: one query resolves all
+        question hashes, one reads the existing (user, question) pairs, and the missing rows
+        are inserted with a single executemany.
+
+        Entries without a user_id (backups from before multi-user) belong to default_user_id.
+        With only_empty_users, users that already have SRS rows are left untouched, so a
+        restart never resurrects rows they removed. Returns the number of rows inserted.
+        """
         filepath = os.path.join(self.backup_dir, "progress_backup.json")
         if not os.path.exists(filepath):
             return 0
@@ -48,29 +272,49 @@ class BackupService:
         try:
             with open(filepath, 'r', encoding='utf-8') as f:
                 data = json.load(f)
-            
-            count = 0
+            if not data:
+                return 0
+
+            wq = models.WrongQuestion.__table__
+            user_ids = {item.get('user_id') or default_user_id for item in data}
+
+            hashes = {item['question_hash'] for item in data}
+            id_by_hash = {}
+            hash_list = list(hashes)
+            for i in range(0, len(hash_list), 900):  # stay under SQLite's bound-parameter limit
+                chunk = hash_list[i:i + 900]
+                id_by_hash.update(db.execute(
+                    select(models.Question.hash, models.Question.id).where(models.Question.hash.in_(chunk))
+                ).all())
+
+            existing = set(db.execute(
+                select(wq.c.user_id, wq.c.question_id).where(wq.c.user_id.in_(user_ids))
+            ).all())
+            if only_empty_users:
+                user_ids -= {uid for uid, _ in existing}
+
+            rows = []
             for item in data:
-                q = db.query(models.Question).filter(models.Question.hash == item['question_hash']).first()
-                if not q:
+                user_id = item.get('user_id') or default_user_id
+                question_id = id_by_hash.get(item['question_hash'])
+                if user_id not in user_ids or question_id is None or (user_id, question_id) in existing:
                     continue
-                
-                # Check if entry already exists
-                existing = db.query(models.WrongQuestion).filter(models.WrongQuestion.question_id == q.id).first()
-                if not existing:
-                    new_w = models.WrongQuestion(
-                        question_id=q.id,
-                        review_count=item['review_count'],
-                        interval=item['interval'],
-                        ease_factor=item['ease_factor'],
-                        next_review_at=datetime.fromisoformat(item['next_review_at']) if item['next_review_at'] else None,
-                        last_reviewed_at=datetime.fromisoformat(item['last_reviewed_at']) if item['last_reviewed_at'] else None
-                    )
-                    db.add(new_w)
-                    count += 1
-            
+                existing.add((user_id, question_id))  # first entry wins on duplicates
+                rows.append({
+                    "user_id": user_id,
+                    "question_id": question_id,
+                    "review_count": item['review_count'],
+                    "interval": item['interval'],
+                    "ease_factor": item['ease_factor'],
+                    "next_review_at": datetime.fromisoformat(item['next_review_at']) if item['next_review_at'] else None,
+                    "last_reviewed_at": datetime.fromisoformat(item['last_reviewed_at']) if item['last_reviewed_at'] else None
+                })
+
+            if rows:
+                db.execute(insert(wq), rows)
             db.commit()
-            return count
+            return len(rows)
         except Exception as e:
+            db.rollback()
             print(f"Failed to restore progress: {e}")
             return 0
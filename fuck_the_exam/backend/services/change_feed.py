@@ -0,0 +1,164 @@
+"""
+Change feed behind GET /api/sync: every insert, update and delete of a question, a favorite
+or an SRS row appends (seq, entity, entity_id, user_id) to sync_changes, written by SQLite
+triggers so that every write path (ORM, bulk inserts, attempt-log compaction, scripts) is
+covered. SQLite has one writer, so seq order is commit order: a client that has seen
+everything up to seq never misses a later change.
+
+A client keeps its last seq and asks for what changed since. Each changed entity is
+reported once, with its current row, or as deleted if the row is gone:
+
+    {"seq": 1234, "more": false, "reset": false,
+     "upserts": {"questions": [payload, ...], "favorites": [question_id, ...], "srs": [{...}, ...]},
+     "deletes": {"questions": [id, ...], "favorites": [question_id, ...], "srs": [question_id, ...]}}
+
+Entries superseded by a later one for the same entity are pruned (compact); the latest,
+including tombstones, is kept, so since=0 pages through the whole bank and progress.
+"""
+from typing import Dict, List, Optional
+
+from sqlalchemy import func, text
+from sqlalchemy.orm import Session
+from .. import models
+from .question_cache import QuestionCache
+
+QUESTION = "question"
+FAVORITE = "favorite"
+SRS = "srs"
+IN_CHUNK = 900  # SQLite bound-parameter limit
+
+# Question triggers fire on payload columns only: calibration and the legacy is_favorite
+# flag do not touch them
+_QUESTION_COLUMNS = "content, options, correct_answer, explanation, memorization_tip, knowledge_point, exam_type"
+
+def _keyed_triggers(table: str, entity: str) -> List[str]:
+    """Rows keyed by (user_id, question_id): an update that moves a row reports both keys."""
+    log = "INSERT INTO sync_changes (entity, entity_id, user_id) VALUES ('{e}', {r}.question_id, {r}.user_id);"
+    return [
+        f"CREATE TRIGGER IF NOT EXISTS sync_{table}_insert AFTER INSERT ON {table} BEGIN "
+        f"{log.format(e=entity, r='NEW')} END",
+        f"CREATE TRIGGER IF NOT EXISTS sync_{table}_update AFTER UPDATE ON {table} BEGIN "
+        f"{log.format(e=entity, r='NEW')} "
+        f"INSERT INTO sync_changes (entity, entity_id, user_id) SELECT '{entity}', OLD.question_id, OLD.user_id "
+        f"WHERE OLD.question_id IS NOT NEW.question_id OR OLD.user_id IS NOT NEW.user_id; END",
+        f"CREATE TRIGGER IF NOT EXISTS sync_{table}_delete AFTER DELETE ON {table} BEGIN "
+        f"{log.format(e=entity, r='OLD')} END",
+    ]
+
+TRIGGERS = [
+    "CREATE TRIGGER IF NOT EXISTS sync_questions_insert AFTER INSERT ON questions BEGIN "
+    f"INSERT INTO sync_changes (entity, entity_id) VALUES ('{QUESTION}', NEW.id); END",
+    f"CREATE TRIGGER IF NOT EXISTS sync_questions_update AFTER UPDATE OF {_QUESTION_COLUMNS} ON questions BEGIN "
+    f"INSERT INTO sync_changes (entity, entity_id) VALUES ('{QUESTION}', NEW.id); END",
+    "CREATE TRIGGER IF NOT EXISTS sync_questions_delete AFTER DELETE ON questions BEGIN "
+    f"INSERT INTO sync_changes (entity, entity_id) VALUES ('{QUESTION}', OLD.id); END",
+] + _keyed_triggers("user_favorites", FAVORITE) + _keyed_triggers("wrong_questions", SRS)
+TRIGGER_NAMES = [t.split()[5] for t in TRIGGERS]
+
+def installed(db: Session) -> bool:
+    names = {r[0] for r in db.execute(text("SELECT name FROM sqlite_master WHERE type = 'trigger'"))}
+    return all(name in names for name in TRIGGER_NAMES)
+
+def install(db: Session) -> int:
+    """
+    Creates the triggers and, if the log is empty, seeds it with one entry per existing row
+    (so since=0 returns them); returns the number of seeded entries. Caller commits.
+    """
+    seeded = 0
+    if db.query(models.SyncChange.seq).first() is None:
+        seeded += db.execute(text(
+            f"INSERT INTO sync_changes (entity, entity_id) SELECT '{QUESTION}', id FROM questions ORDER BY id"
+        )).rowcount
+        seeded += db.execute(text(
+            f"INSERT INTO sync_changes (entity, entity_id, user_id) SELECT DISTINCT '{FAVORITE}', question_id, user_id "
+            "FROM user_favorites"
+        )).rowcount
+        seeded += db.execute(text(
+            f"INSERT INTO sync_changes (entity, entity_id, user_id) SELECT DISTINCT '{SRS}', question_id, user_id "
+            "FROM wrong_questions"
+        )).rowcount
+    for ddl in TRIGGERS:
+        db.execute(text(ddl))
+    return seeded
+
+def _chunks(ids: List[int]):
+    for i in range(0, len(ids), IN_CHUNK):
+        yield ids[i:i + IN_CHUNK]
+
+def changes_since(db: Session, user_id: int, since: int = 0, limit: int = 1000,
+                  exam_type: Optional[str] = None) -> Dict:
+    """
+    Entities changed after `since`, oldest change first, at most `limit` of them. With
+    more=True, call again with since=seq. A since ahead of the log (the database was
+    restored or replaced) returns reset=True and everything from the start.
+    """
+    # Upper bound first: entries committed while this runs are left for the next call
+    head = db.query(func.max(models.SyncChange.seq)).scalar() or 0
+    reset = since > head
+    if reset:
+        since = 0
+    latest = db.query(models.SyncChange.entity, models.SyncChange.entity_id, func.max(models.SyncChange.seq).label("seq"))\
+        .filter(models.SyncChange.seq > since, models.SyncChange.seq <= head,
+                (models.SyncChange.entity == QUESTION) | (models.SyncChange.user_id == user_id))\
+        .group_by(models.SyncChange.entity, models.SyncChange.entity_id)\
+        .order_by(text("seq")).limit(limit + 1).all()
+    more = len(latest) > limit
+    latest = latest[:limit]
+
+    changed = {QUESTION: [], FAVORITE: [], SRS: []}
+    for entity, entity_id, _ in latest:
+        changed[entity].append(entity_id)
+
+    upserts = {"questions": [], "favorites": [], "srs": []}
+    deletes = {"questions": [], "favorites": [], "srs": []}
+    found = set()
+    for chunk in _chunks(changed[QUESTION]):
+        for q in db.query(models.Question).filter(models.Question.id.in_(chunk)):
+            found.add(q.id)
+            if exam_type is None or q.exam_type == exam_type:
+                upserts["questions"].append(QuestionCache.serialize(q))
+    deletes["questions"] = [i for i in changed[QUESTION] if i not in found]
+
+    found = set()
+    for chunk in _chunks(changed[FAVORITE]):
+        found.update(qid for (qid,) in db.query(models.UserFavorite.question_id).filter(
+            models.UserFavorite.user_id == user_id, models.UserFavorite.question_id.in_(chunk)))
+    upserts["favorites"] = [i for i in changed[FAVORITE] if i in found]
+    deletes["favorites"] = [i for i in changed[FAVORITE] if i not in found]
+
+    rows = {}
+    for chunk in _chunks(changed[SRS]):
+        for w in db.query(models.WrongQuestion).filter(
+                models.WrongQuestion.user_id == user_id, models.WrongQuestion.question_id.in_(chunk)):
+            rows[w.question_id] = w
+    for qid in changed[SRS]:
+        w = rows.get(qid)
+        if w is None:
+            deletes["srs"].append(qid)
+        else:
+            upserts["srs"].append({
+                "question_id": qid,
+                "interval": w.interval,
+                "ease_factor": w.ease_factor,
+                "review_count": w.review_count,
+                "last_reviewed_at": w.last_reviewed_at.isoformat() if w.last_reviewed_at else None,
+                "next_review_at": w.next_review_at.isoformat() if w.next_review_at else None
+            })
+
+    return {
+        "since": since,
+        "seq": latest[-1][2] if more else head,
+        "more": more,
+        "reset": reset,
+        "upserts": upserts,
+        "deletes": deletes
+    }
+
+def compact(db: Session) -> int:
+    """Deletes entries superseded by a later one for the same entity; returns how many."""
+    deleted = db.execute(text(
+        "DELETE FROM sync_changes WHERE seq NOT IN "
+        "(SELECT MAX(seq) FROM sync_changes GROUP BY entity, entity_id, user_id)"
+    )).rowcount
+    db.commit()
+    return deleted
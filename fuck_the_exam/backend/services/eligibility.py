@@ -0,0 +1,287 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from .. import models
+from .metrics import CACHE_REQUESTS
+
+UNCATEGORIZED = "未分类"
+
+# --- Packed bitsets over question ids (bit i = question id i, little bit order) ---
+def _nbytes(max_id: int) -> int:
+    return max_id // 8 + 1
+
+def _bitset(ids: Iterable[int], nbytes: int) -> np.ndarray:
+    """Packed set of ids; grows past nbytes if an id does not fit."""
+    ids = np.fromiter((i for i in ids if i is not None), dtype=np.int64)
+    if ids.size:
+        nbytes = max(nbytes, _nbytes(int(ids.max())))
+    bits = np.zeros(nbytes * 8, dtype=bool)
+    bits[ids] = True
+    return np.packbits(bits, bitorder="little")
+
+def _fit(bits: np.ndarray, nbytes: int) -> np.ndarray:
+    if bits.size >= nbytes:
+        return bits[:nbytes]
+    return np.concatenate([bits, np.zeros(nbytes - bits.size, dtype=np.uint8)])
+
+def _set_bit(bits: np.ndarray, question_id: int, on: bool = True) -> np.ndarray:
+    if question_id // 8 >= bits.size:
+        if not on:
+            return bits
+        bits = _fit(bits, _nbytes(question_id))
+    if on:
+        bits[question_id // 8] |= np.uint8(1 << (question_id % 8))
+    else:
+        bits[question_id // 8] &= np.uint8(~(1 << (question_id % 8)) & 0xFF)
+    return bits
+
+def _test_bit(bits: np.ndarray, question_id: int) -> bool:
+    return question_id // 8 < bits.size and bool(bits[question_id // 8] >> (question_id % 8) & 1)
+
+def _ids(bits: np.ndarray) -> np.ndarray:
+    return np.flatnonzero(np.unpackbits(bits, bitorder="little"))
+
+class _Catalog:
+    """Question universe: one bitset per exam type and the knowledge point code of every id."""
+    def __init__(self, rows):
+        max_id = max((qid for qid, _, _ in rows), default=0)
+        self.nbytes = _nbytes(max_id)
+        self.point_names: List[str] = []
+        codes: Dict[str, int] = {}
+        self.point_code = np.full(self.nbytes * 8, -1, dtype=np.int32)
+        by_exam: Dict[str, List[int]] = {}
+        for qid, exam_type, point in rows:
+            point = point or UNCATEGORIZED
+            if point not in codes:
+                codes[point] = len(self.point_names)
+                self.point_names.append(point)
+            self.point_code[qid] = codes[point]
+            by_exam.setdefault(exam_type, []).append(qid)
+        self.exams = {exam: _bitset(ids, self.nbytes) for exam, ids in by_exam.items()}
+        self.built_at = time.monotonic()
+
+    def exam_mask(self, exam_type: str) -> np.ndarray:
+        mask = self.exams.get(exam_type)
+        return mask if mask is not None else np.zeros(self.nbytes, dtype=np.uint8)
+
+    def exam_ids(self, exam_type: str) -> np.ndarray:
+        return _ids(self.exam_mask(exam_type))
+
+class _UserSets:
+    __slots__ = ("attempted", "correct", "favorite", "wrong", "built_at")
+
+    def __init__(self, attempted, correct, favorite, wrong):
+        self.attempted = attempted
+        self.correct = correct
+        self.favorite = favorite
+        self.wrong = wrong
+        self.built_at = time.monotonic()
+
+    @property
+    def nbytes(self) -> int:
+        return self.attempted.size + self.correct.size + self.favorite.size + self.wrong.size
+
+class EligibilityIndex:
+    """
+    Per-user bitsets over question ids ("attempted", "answered correctly", "favorite",
+    "in SRS"), built from the DB on first use and kept in step by `record_*` on submit,
+    favorite and SRS changes. The candidate pools the quiz paths draw from become a few
+    vectorized bit operations instead of nested IN subqueries over answer_attempts:
+
+      study: not mastered OR favorite
+      gap:   never attempted OR favorite OR wrong
+
+    Inactive users are evicted LRU-first once the sets exceed `max_bytes`; `ttl_seconds`
+    bounds staleness from writes made in other workers or scripts (as in ReviewQueue).
+    Builds run outside the lock; one that overlapped a `record_*`, `invalidate_catalog` or
+    `clear` is served once but not cached, checked and swapped under the same lock.
+    """
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, ttl_seconds: int = 300):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._users: "OrderedDict[int, _UserSets]" = OrderedDict()
+        self._bytes = 0
+        self._catalog: Optional[_Catalog] = None
+        self._catalog_version = 0  # bumped by invalidate_catalog / clear
+        self._loading: Dict[int, int] = {}  # user_id -> loads in flight
+        self._writes: Dict[int, int] = {}  # user_id -> writes seen while loading
+        self._lock = threading.Lock()
+
+    # --- Building ---
+    def _get_catalog(self, db: Session) -> _Catalog:
+        catalog = self._catalog
+        if catalog and time.monotonic() - catalog.built_at < self.ttl_seconds:
+            return catalog
+        with self._lock:
+            version = self._catalog_version
+        rows = db.query(models.Question.id, models.Question.exam_type, models.Question.knowledge_point).all()
+        catalog = _Catalog(rows)
+        with self._lock:
+            if self._catalog_version == version:
+                self._catalog = catalog
+        return catalog
+
+    def _load_user(self, db: Session, user_id: int, nbytes: int) -> _UserSets:
+        attempts = db.query(models.AnswerAttempt.question_id, func.max(models.AnswerAttempt.is_correct))\
+            .filter(models.AnswerAttempt.user_id == user_id, models.AnswerAttempt.question_id != None)\
+            .group_by(models.AnswerAttempt.question_id).all()
+        favorites = db.query(models.UserFavorite.question_id).filter(models.UserFavorite.user_id == user_id).all()
+        wrong = db.query(models.WrongQuestion.question_id).filter(models.WrongQuestion.user_id == user_id).all()
+        return _UserSets(
+            _bitset((qid for qid, _ in attempts), nbytes),
+            _bitset((qid for qid, correct in attempts if correct), nbytes),
+            _bitset((qid for (qid,) in favorites), nbytes),
+            _bitset((qid for (qid,) in wrong), nbytes)
+        )
+
+    def _get_user(self, db: Session, user_id: int, nbytes: int) -> _UserSets:
+        with self._lock:
+            sets = self._users.get(user_id)
+            if sets and time.monotonic() - sets.built_at < self.ttl_seconds:
+                self._users.move_to_end(user_id)
+                CACHE_REQUESTS.inc(cache="eligibility", result="hit")
+                return sets
+            self._loading[user_id] = self._loading.get(user_id, 0) + 1
+            writes = self._writes.get(user_id, 0)
+        CACHE_REQUESTS.inc(cache="eligibility", result="miss")
+
+        sets = None
+        try:
+            sets = self._load_user(db, user_id, nbytes)
+        finally:
+            with self._lock:
+                fresh = self._writes.get(user_id, 0) == writes
+                self._loading[user_id] -= 1
+                if not self._loading[user_id]:
+                    del self._loading[user_id]
+                    self._writes.pop(user_id, None)
+                if sets is not None and fresh:
+                    old = self._users.pop(user_id, None)
+                    if old:
+                        self._bytes -= old.nbytes
+                    self._users[user_id] = sets
+                    self._bytes += sets.nbytes
+                    while self._bytes > self.max_bytes and len(self._users) > 1:
+                        _, evicted = self._users.popitem(last=False)
+                        self._bytes -= evicted.nbytes
+        return sets
+
+    def _snapshot(self, db: Session, user_id: int):
+        """Catalog plus the user's four sets, sized to the catalog."""
+        catalog = self._get_catalog(db)
+        sets = self._get_user(db, user_id, catalog.nbytes)
+        n = catalog.nbytes
+        with self._lock:
+            return catalog, _fit(sets.attempted, n), _fit(sets.correct, n), _fit(sets.favorite, n), _fit(sets.wrong, n)
+
+    def catalog(self, db: Session) -> _Catalog:
+        """The shared question universe (ids per exam type, knowledge point per id)."""
+        return self._get_catalog(db)
+
+    def warm(self, db: Session):
+        """Builds the question catalog ahead of the first request."""
+        self._get_catalog(db)
+
+    # --- Candidate pools ---
+    def study_pool(self, db: Session, user_id: int, exam_type: str) -> np.ndarray:
+        """Question ids of exam_type that are not mastered (no correct attempt) or are favorites."""
+        catalog, _, correct, favorite, _ = self._snapshot(db, user_id)
+        return _ids((~correct | favorite) & catalog.exam_mask(exam_type))
+
+    def gap_pools(self, db: Session, user_id: int, exam_type: str) -> Dict[str, np.ndarray]:
+        """{knowledge point: question ids} never attempted, favorite or in SRS, for exam_type."""
+        catalog, attempted, _, favorite, wrong = self._snapshot(db, user_id)
+        ids = _ids((~attempted | favorite | wrong) & catalog.exam_mask(exam_type))
+        codes = catalog.point_code[ids]
+        order = np.argsort(codes, kind="stable")
+        ids, codes = ids[order], codes[order]
+        bounds = np.flatnonzero(np.diff(codes)) + 1
+        return {catalog.point_names[group_codes[0]]: group_ids
+                for group_ids, group_codes in zip(np.split(ids, bounds), np.split(codes, bounds)) if group_ids.size}
+
+    def wrong_by_point(self, db: Session, user_id: int, exam_type: str) -> Dict[str, int]:
+        """{knowledge point: the user's SRS questions of exam_type there}, from the warm sets."""
+        catalog, _, _, _, wrong = self._snapshot(db, user_id)
+        counts = np.bincount(catalog.point_code[_ids(wrong & catalog.exam_mask(exam_type))],
+                             minlength=len(catalog.point_names))
+        return {catalog.point_names[code]: int(counts[code]) for code in np.flatnonzero(counts)
+                if catalog.point_names[code] != UNCATEGORIZED}
+
+    def filter_study(self, db: Session, user_id: int, question_ids: Iterable[int]) -> Set[int]:
+        """The subset of question_ids that belongs in a study set (not mastered, or favorite)."""
+        question_ids = list(question_ids)
+        max_id = max(question_ids, default=0)
+        sets = self._get_user(db, user_id, _nbytes(max_id))
+        with self._lock:
+            return {qid for qid in question_ids
+                    if not _test_bit(sets.correct, qid) or _test_bit(sets.favorite, qid)}
+
+    def is_favorite(self, db: Session, user_id: int, question_id: int) -> bool:
+        sets = self._get_user(db, user_id, _nbytes(question_id))
+        with self._lock:
+            return _test_bit(sets.favorite, question_id)
+
+    def unanswered_by_point(self, db: Session) -> Dict[str, int]:
+        """Questions nobody has attempted yet, per knowledge point (fresh catalog, one DISTINCT scan)."""
+        self.invalidate_catalog()
+        catalog = self._get_catalog(db)
+        attempted = _bitset((qid for (qid,) in db.query(models.AnswerAttempt.question_id).distinct()), catalog.nbytes)
+        universe = np.zeros(catalog.nbytes, dtype=np.uint8)
+        for mask in catalog.exams.values():
+            universe |= mask
+        counts = np.bincount(catalog.point_code[_ids(universe & ~attempted)], minlength=len(catalog.point_names))
+        return {name: int(counts[code]) for code, name in enumerate(catalog.point_names)}
+
+    # --- Incremental updates (users that are not warm are left to the next lazy build) ---
+    def _update(self, user_id: int, fn):
+        with self._lock:
+            if user_id in self._loading:
+                self._writes[user_id] = self._writes.get(user_id, 0) + 1
+            sets = self._users.get(user_id)
+            if sets is None:
+                return
+            before = sets.nbytes
+            fn(sets)
+            self._bytes += sets.nbytes - before
+
+    def record_attempt(self, user_id: int, question_id: int, is_correct: bool):
+        def apply(sets):
+            sets.attempted = _set_bit(sets.attempted, question_id)
+            if is_correct:
+                sets.correct = _set_bit(sets.correct, question_id)
+        self._update(user_id, apply)
+
+    def record_favorite(self, user_id: int, question_id: int, is_favorite: bool):
+        def apply(sets):
+            sets.favorite = _set_bit(sets.favorite, question_id, is_favorite)
+        self._update(user_id, apply)
+
+    def record_wrong(self, user_id: int, question_id: int):
+        def apply(sets):
+            sets.wrong = _set_bit(sets.wrong, question_id)
+        self._update(user_id, apply)
+
+    def invalidate_catalog(self):
+        """New or changed questions: rebuild the question universe on next use, keep user sets."""
+        with self._lock:
+            self._catalog = None
+            self._catalog_version += 1
+
+    def clear(self):
+        """Drops all user sets and the catalog (bulk changes: ingestion, deletions, restores)."""
+        with self._lock:
+            self._users.clear()
+            self._bytes = 0
+            self._catalog = None
+            self._catalog_version += 1
+            for user_id in self._loading:
+                self._writes[user_id] = self._writes.get(user_id, 0) + 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"users": len(self._users), "bytes": self._bytes, "max_bytes": self.max_bytes}
@@ -0,0 +1,470 @@
+"""
+Rasch (1PL) calibration and difficulty-sorted adaptive selection.
+
+P(correct | user u, question q) = sigmoid(ability_u - difficulty_q), fitted by vectorized
+Newton steps (np.bincount over all attempts) with a N(0, prior_sd^2) prior on both sides, so
+questions everyone gets right (or wrong) and new users still get finite estimates.
+
+    python -m backend.services.irt calibrate [--full]
+"""
+import argparse
+import math
+import random
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import func, or_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+from .. import models
+from .eligibility import EligibilityIndex
+
+def _sigmoid(x: np.ndarray) -> np.ndarray:
+    return 1.0 / (1.0 + np.exp(-x))
+
+def _lookup(difficulty: np.ndarray, ids: np.ndarray) -> np.ndarray:
+    """difficulty[ids], with uncalibrated (out of range) questions at the prior mean."""
+    out = np.zeros(ids.size)
+    inside = ids < difficulty.size
+    out[inside] = difficulty[ids[inside]]
+    return out
+
+def _chunks(values: List[int], size: int = 900):
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+def fit_rasch(users: np.ndarray, questions: np.ndarray, correct: np.ndarray,
+              ability: np.ndarray, difficulty: np.ndarray,
+              free_users: Optional[np.ndarray] = None, free_questions: Optional[np.ndarray] = None,
+              prior_sd: float = 1.5, max_iter: int = 50, tol: float = 1e-3) -> int:
+    """
+    Alternating Newton steps on `ability` / `difficulty` (indexed by the dense codes in
+    users / questions), in place. free_* masks limit which parameters move (incremental
+    refresh); the rest stay fixed. Returns the number of iterations run.
+    """
+    precision = 1.0 / prior_sd ** 2
+    n_users, n_questions = ability.size, difficulty.size
+    y = correct.astype(np.float64)
+    for iteration in range(1, max_iter + 1):
+        p = _sigmoid(ability[users] - difficulty[questions])
+        grad = np.bincount(users, weights=y - p, minlength=n_users) - precision * ability
+        hess = np.bincount(users, weights=p * (1 - p), minlength=n_users) + precision
+        step_u = grad / hess
+        if free_users is not None:
+            step_u[~free_users] = 0.0
+        ability += step_u
+
+        p = _sigmoid(ability[users] - difficulty[questions])
+        grad = np.bincount(questions, weights=p - y, minlength=n_questions) - precision * difficulty
+        hess = np.bincount(questions, weights=p * (1 - p), minlength=n_questions) + precision
+        step_q = grad / hess
+        if free_questions is not None:
+            step_q[~free_questions] = 0.0
+        difficulty += step_q
+
+        # The likelihood is flat along a common shift of both sides; only the prior pins it
+        # down, which alternating steps resolve slowly. Take the prior's optimum directly.
+        if free_users is None and free_questions is None:
+            shift = (ability.sum() + difficulty.sum()) / (n_users + n_questions)
+            ability -= shift
+            difficulty -= shift
+
+        if max(np.abs(step_u).max(initial=0.0), np.abs(step_q).max(initial=0.0)) < tol:
+            break
+    return iteration
+
+class _SortedIndex:
+    """Question ids sorted by difficulty (one per exam type, and per knowledge point within it)."""
+    __slots__ = ("difficulty", "ids", "_by_id")
+
+    def __init__(self, ids: np.ndarray, difficulty: np.ndarray):
+        d = _lookup(difficulty, ids)
+        order = np.argsort(d, kind="stable")
+        self.difficulty = d[order]
+        self.ids = ids[order]
+        self._by_id = None  # (ids sorted by id, their positions in self.ids), built on first restrict
+
+    @classmethod
+    def _from_sorted(cls, ids: np.ndarray, difficulty: np.ndarray) -> "_SortedIndex":
+        index = object.__new__(cls)
+        index.ids, index.difficulty, index._by_id = ids, difficulty, None
+        return index
+
+    def updated(self, changed_ids: np.ndarray, difficulty: np.ndarray) -> "_SortedIndex":
+        """
+        Copy with changed_ids moved to their new difficulty: the rest stays sorted, so the
+        moved ids are merged back in by searchsorted instead of re-sorting the whole index.
+        """
+        moved = np.isin(self.ids, changed_ids)
+        if not moved.any():
+            return self
+        ids = self.ids[moved]
+        d = _lookup(difficulty, ids)
+        order = np.argsort(d, kind="stable")
+        ids, d = ids[order], d[order]
+        keep_d, keep_ids = self.difficulty[~moved], self.ids[~moved]
+        at = np.searchsorted(keep_d, d)
+        return _SortedIndex._from_sorted(np.insert(keep_ids, at, ids), np.insert(keep_d, at, d))
+
+    def restrict(self, candidates: np.ndarray, difficulty: np.ndarray) -> "_SortedIndex":
+        """
+        The index limited to candidates, still sorted by difficulty: a vectorized lookup of
+        the candidates' positions (no re-sort of the difficulties). Candidates the index does
+        not hold (questions added since it was built) are merged in at their current difficulty.
+        """
+        if self._by_id is None:
+            order = np.argsort(self.ids, kind="stable")
+            self._by_id = (self.ids[order], order)
+        sorted_ids, positions = self._by_id
+        inside = np.zeros(candidates.size, dtype=bool)
+        if sorted_ids.size:
+            at = np.minimum(np.searchsorted(sorted_ids, candidates), sorted_ids.size - 1)
+            inside = sorted_ids[at] == candidates
+            keep = np.sort(positions[at[inside]])
+        else:
+            keep = np.zeros(0, dtype=np.int64)
+        ids, d = self.ids[keep], self.difficulty[keep]
+        outside = candidates[~inside]
+        if outside.size:
+            od = _lookup(difficulty, outside)
+            order = np.argsort(od, kind="stable")
+            outside, od = outside[order], od[order]
+            at = np.searchsorted(d, od)
+            ids, d = np.insert(ids, at, outside), np.insert(d, at, od)
+        return _SortedIndex._from_sorted(ids, d)
+
+    def pick(self, target: float, taken: set) -> Optional[int]:
+        """
+        Id closest in difficulty to target that is not taken: a binary search, then at most
+        len(taken) steps outward.
+        """
+        hi = int(np.searchsorted(self.difficulty, target))
+        lo = hi - 1
+        n = self.ids.size
+        while lo >= 0 or hi < n:
+            if hi >= n or (lo >= 0 and target - self.difficulty[lo] <= self.difficulty[hi] - target):
+                qid, lo = int(self.ids[lo]), lo - 1
+            else:
+                qid, hi = int(self.ids[hi]), hi + 1
+            if qid not in taken:
+                return qid
+        return None
+
+class IrtCalibrator:
+    """
+    Persists the fitted parameters (question_calibration, user_ability, calibration_runs) and
+    serves adaptive picks: each pick aims at the difficulty where the user's predicted success
+    is `target_p` (plus some jitter, so sessions vary) and takes the nearest eligible question
+    by binary search over the difficulty-sorted index restricted to the candidate pool.
+
+    `refresh` is incremental: only users and questions touched by attempts since the last run
+    move, using all of their attempts, while everything else stays fixed. A full refit runs
+    when there is no calibration yet or the new attempts exceed `full_refit_ratio` of the total.
+    Every row records the run that wrote it, so workers (which pick up new parameters within
+    `ttl_seconds`) load only the rows changed by incremental runs and patch their sorted
+    indexes in place; only a full refit, which rewrites every row anyway, reloads everything.
+    """
+    def __init__(self, eligibility: EligibilityIndex, target_p: float = 0.7, jitter: float = 0.5,
+                 prior_sd: float = 1.5, min_new_attempts: int = 50, full_refit_ratio: float = 0.2,
+                 ttl_seconds: int = 60):
+        self.eligibility = eligibility
+        self.target_p = target_p
+        self.jitter = jitter
+        self.prior_sd = prior_sd
+        self.min_new_attempts = min_new_attempts
+        self.full_refit_ratio = full_refit_ratio
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._fit_lock = threading.Lock()
+        # (run id, difficulty by id, {user: ability}, loaded_at, (previous run id, changed question ids) or None)
+        self._params = None
+        self._indexes: Dict[Tuple, _SortedIndex] = {}
+        self._index_key = None
+
+    # --- Fitting ---
+    def refresh(self, db: Session, full: bool = False) -> Optional[Dict]:
+        """Brings the calibration up to date; None if there was nothing (or too little) to do."""
+        if not self._fit_lock.acquire(blocking=False):
+            return None
+        try:
+            last_run = db.query(models.CalibrationRun).order_by(models.CalibrationRun.id.desc()).first()
+            max_id = db.query(func.max(models.AnswerAttempt.id)).scalar() or 0
+            since = last_run.last_attempt_id if last_run else 0
+            new_attempts = db.query(func.count(models.AnswerAttempt.id))\
+                .filter(models.AnswerAttempt.id > since, models.AnswerAttempt.question_id != None).scalar()
+            if not full and last_run and new_attempts < self.min_new_attempts:
+                return None
+            if not new_attempts and not full:
+                return None
+            total = db.query(func.count(models.AnswerAttempt.id)).scalar() or 0
+            if full or last_run is None or new_attempts > self.full_refit_ratio * total:
+                result = self._fit_full(db, max_id)
+            else:
+                result = self._fit_incremental(db, since, max_id)
+            params = self._params
+            if params:  # expire, so the next pick loads the new rows
+                self._params = params[:3] + (-math.inf,) + params[4:]
+            return result
+        finally:
+            self._fit_lock.release()
+
+    def _fit_full(self, db: Session, max_id: int) -> Dict:
+        started = time.perf_counter()
+        rows = db.query(models.AnswerAttempt.user_id, models.AnswerAttempt.question_id, models.AnswerAttempt.is_correct)\
+            .filter(models.AnswerAttempt.id <= max_id, models.AnswerAttempt.question_id != None).all()
+        raw_users = np.fromiter((r[0] or 1 for r in rows), dtype=np.int64, count=len(rows))
+        raw_questions = np.fromiter((r[1] for r in rows), dtype=np.int64, count=len(rows))
+        correct = np.fromiter((r[2] or 0 for r in rows), dtype=np.int8, count=len(rows))
+        user_ids, users = np.unique(raw_users, return_inverse=True)
+        question_ids, questions = np.unique(raw_questions, return_inverse=True)
+
+        ability, difficulty = np.zeros(user_ids.size), np.zeros(question_ids.size)
+        iterations = fit_rasch(users, questions, correct, ability, difficulty, prior_sd=self.prior_sd)
+
+        now = datetime.now()
+        run = self._start_run(db, "full", max_id)
+        db.query(models.QuestionCalibration).delete(synchronize_session=False)
+        db.query(models.UserAbility).delete(synchronize_session=False)
+        q_counts = np.bincount(questions, minlength=question_ids.size)
+        u_counts = np.bincount(users, minlength=user_ids.size)
+        if question_ids.size:
+            db.execute(sqlite_insert(models.QuestionCalibration), [
+                {"question_id": int(qid), "difficulty": float(d), "attempts": int(n), "run_id": run.id, "updated_at": now}
+                for qid, d, n in zip(question_ids, difficulty, q_counts)
+            ])
+        if user_ids.size:
+            db.execute(sqlite_insert(models.UserAbility), [
+                {"user_id": int(uid), "ability": float(a), "attempts": int(n), "run_id": run.id, "updated_at": now}
+                for uid, a, n in zip(user_ids, ability, u_counts)
+            ])
+        return self._finish_run(db, run, len(rows), user_ids.size, question_ids.size, iterations, started)
+
+    def _fit_incremental(self, db: Session, since: int, max_id: int) -> Dict:
+        started = time.perf_counter()
+        touched = db.query(models.AnswerAttempt.user_id, models.AnswerAttempt.question_id)\
+            .filter(models.AnswerAttempt.id > since, models.AnswerAttempt.id <= max_id,
+                    models.AnswerAttempt.question_id != None).distinct().all()
+        touched_users = sorted({u or 1 for u, _ in touched})
+        touched_questions = sorted({q for _, q in touched})
+
+        # Every attempt involving a touched user or question (chunked IN lists)
+        rows = {}
+        for column, values in ((models.AnswerAttempt.user_id, touched_users), (models.AnswerAttempt.question_id, touched_questions)):
+            for chunk in _chunks(values):
+                filters = [column.in_(chunk)]
+                if column is models.AnswerAttempt.user_id and 1 in chunk:
+                    filters.append(models.AnswerAttempt.user_id == None)
+                for r in db.query(models.AnswerAttempt.id, models.AnswerAttempt.user_id, models.AnswerAttempt.question_id,
+                                  models.AnswerAttempt.is_correct)\
+                        .filter(or_(*filters), models.AnswerAttempt.id <= max_id, models.AnswerAttempt.question_id != None):
+                    rows[r[0]] = r
+        rows = list(rows.values())
+        raw_users = np.fromiter((r[1] or 1 for r in rows), dtype=np.int64, count=len(rows))
+        raw_questions = np.fromiter((r[2] for r in rows), dtype=np.int64, count=len(rows))
+        correct = np.fromiter((r[3] or 0 for r in rows), dtype=np.int8, count=len(rows))
+        user_ids, users = np.unique(raw_users, return_inverse=True)
+        question_ids, questions = np.unique(raw_questions, return_inverse=True)
+
+        # Warm start from the stored parameters of the users / questions in play; untouched ones stay fixed
+        stored_q, stored_u = {}, {}
+        for chunk in _chunks(question_ids.tolist()):
+            stored_q.update(db.query(models.QuestionCalibration.question_id, models.QuestionCalibration.difficulty)
+                            .filter(models.QuestionCalibration.question_id.in_(chunk)))
+        for chunk in _chunks(user_ids.tolist()):
+            stored_u.update(db.query(models.UserAbility.user_id, models.UserAbility.ability)
+                            .filter(models.UserAbility.user_id.in_(chunk)))
+        ability = np.array([stored_u.get(int(u), 0.0) for u in user_ids])
+        difficulty = np.array([stored_q.get(int(q), 0.0) for q in question_ids])
+        free_users = np.isin(user_ids, touched_users)
+        free_questions = np.isin(question_ids, touched_questions)
+        iterations = fit_rasch(users, questions, correct, ability, difficulty, free_users, free_questions,
+                               prior_sd=self.prior_sd, max_iter=20)
+
+        now = datetime.now()
+        run = self._start_run(db, "incremental", max_id)
+        q_counts = np.bincount(questions, minlength=question_ids.size)
+        u_counts = np.bincount(users, minlength=user_ids.size)
+        q_rows = [{"question_id": int(qid), "difficulty": float(d), "attempts": int(n), "run_id": run.id, "updated_at": now}
+                  for qid, d, n, free in zip(question_ids, difficulty, q_counts, free_questions) if free]
+        u_rows = [{"user_id": int(uid), "ability": float(a), "attempts": int(n), "run_id": run.id, "updated_at": now}
+                  for uid, a, n, free in zip(user_ids, ability, u_counts, free_users) if free]
+        if q_rows:
+            stmt = sqlite_insert(models.QuestionCalibration)
+            db.execute(stmt.on_conflict_do_update(index_elements=["question_id"], set_={
+                "difficulty": stmt.excluded.difficulty, "attempts": stmt.excluded.attempts,
+                "run_id": stmt.excluded.run_id, "updated_at": stmt.excluded.updated_at
+            }), q_rows)
+        if u_rows:
+            stmt = sqlite_insert(models.UserAbility)
+            db.execute(stmt.on_conflict_do_update(index_elements=["user_id"], set_={
+                "ability": stmt.excluded.ability, "attempts": stmt.excluded.attempts,
+                "run_id": stmt.excluded.run_id, "updated_at": stmt.excluded.updated_at
+            }), u_rows)
+        return self._finish_run(db, run, len(rows), len(u_rows), len(q_rows), iterations, started)
+
+    def _start_run(self, db: Session, kind: str, max_id: int) -> models.CalibrationRun:
+        """Flushes the run row first: its id tags the parameter rows written in the same transaction."""
+        run = models.CalibrationRun(kind=kind, last_attempt_id=max_id)
+        db.add(run)
+        db.flush()
+        return run
+
+    def _finish_run(self, db: Session, run: models.CalibrationRun, attempts: int, users: int, questions: int,
+                    iterations: int, started: float) -> Dict:
+        kind, max_id = run.kind, run.last_attempt_id
+        run.attempts, run.users, run.questions, run.iterations = attempts, int(users), int(questions), iterations
+        run.seconds = round(time.perf_counter() - started, 3)
+        db.commit()
+        result = {"kind": kind, "last_attempt_id": max_id, "attempts": attempts, "users": int(users),
+                  "questions": int(questions), "iterations": iterations, "seconds": run.seconds}
+        print(f"IRT: {kind} calibration over {attempts} attempts ({users} users, {questions} questions, "
+              f"{iterations} iterations) in {run.seconds}s")
+        return result
+
+    # --- Parameters and indexes ---
+    def _get_params(self, db: Session):
+        params = self._params
+        if params and time.monotonic() - params[3] < self.ttl_seconds:
+            return params
+        runs = []
+        if params and params[0] is not None:
+            runs = db.query(models.CalibrationRun.id, models.CalibrationRun.kind)\
+                .filter(models.CalibrationRun.id > params[0]).order_by(models.CalibrationRun.id).all()
+        if params and params[0] is not None and not runs:
+            params = params[:3] + (time.monotonic(), params[4])
+        elif runs and all(kind == "incremental" for _, kind in runs):
+            params = self._apply_increments(db, params, runs[-1][0])
+        else:
+            run_id = db.query(func.max(models.CalibrationRun.id)).scalar()
+            if run_id is None:
+                params = (None, None, {}, time.monotonic(), None)
+            else:
+                params = self._load_all(db, run_id)
+        self._params = params
+        return params
+
+    def _load_all(self, db: Session, run_id: int):
+        rows = db.query(models.QuestionCalibration.question_id, models.QuestionCalibration.difficulty).all()
+        max_id = max((qid for qid, _ in rows), default=0)
+        difficulty = np.zeros(max_id + 1)
+        for qid, d in rows:
+            difficulty[qid] = d
+        abilities = dict(db.query(models.UserAbility.user_id, models.UserAbility.ability).all())
+        return (run_id, difficulty, abilities, time.monotonic(), None)
+
+    def _apply_increments(self, db: Session, params, run_id: int):
+        """
+        Only the rows written by incremental runs after params[0] (found through the run_id
+        index). A run committing meanwhile may already show up here; it is applied again next
+        time, which is harmless.
+        """
+        base_id, difficulty, abilities = params[0], params[1], params[2]
+        rows = db.query(models.QuestionCalibration.question_id, models.QuestionCalibration.difficulty)\
+            .filter(models.QuestionCalibration.run_id > base_id).all()
+        changed = np.fromiter((qid for qid, _ in rows), dtype=np.int64, count=len(rows))
+        values = np.fromiter((d for _, d in rows), dtype=np.float64, count=len(rows))
+        # Readers may still hold the old array: write into a copy (grown for newly calibrated ids)
+        size = max(difficulty.size, int(changed.max()) + 1 if changed.size else 0)
+        updated = np.zeros(size)
+        updated[:difficulty.size] = difficulty
+        updated[changed] = values
+        abilities = dict(abilities)
+        abilities.update(db.query(models.UserAbility.user_id, models.UserAbility.ability)
+                         .filter(models.UserAbility.run_id > base_id))
+        return (run_id, updated, abilities, time.monotonic(), (base_id, changed))
+
+    def _index(self, db: Session, exam_type: str, point: Optional[str] = None) -> Optional[_SortedIndex]:
+        run_id, difficulty, _, _, changes = self._get_params(db)
+        if run_id is None:
+            return None
+        catalog = self.eligibility.catalog(db)
+        with self._lock:
+            if self._index_key != (run_id, id(catalog)):
+                # Same catalog and one incremental step ahead: move only the changed ids
+                if changes and self._index_key == (changes[0], id(catalog)):
+                    self._indexes = {key: index.updated(changes[1], difficulty) for key, index in self._indexes.items()}
+                else:
+                    self._indexes = {}
+                self._index_key = (run_id, id(catalog))
+            key = (exam_type, point)
+            index = self._indexes.get(key)
+            if index is None:
+                ids = catalog.exam_ids(exam_type)
+                if point is not None:
+                    codes = catalog.point_code[ids]
+                    code = catalog.point_names.index(point) if point in catalog.point_names else -2
+                    ids = ids[codes == code]
+                index = _SortedIndex(ids, difficulty)
+                self._indexes[key] = index
+            return index
+
+    def ability(self, db: Session, user_id: int) -> float:
+        return self._get_params(db)[2].get(user_id, 0.0)
+
+    def difficulty(self, db: Session, question_id: int) -> Optional[float]:
+        difficulty = self._get_params(db)[1]
+        if difficulty is None or question_id >= difficulty.size:
+            return None
+        return float(difficulty[question_id])
+
+    # --- Selection ---
+    def pick(self, db: Session, user_id: int, exam_type: str, candidates: np.ndarray, k: int,
+             point: Optional[str] = None) -> List[int]:
+        """
+        Up to k ids from candidates near the user's ability (random when uncalibrated).
+        The index is restricted to the candidates once (vectorized); each pick is then a
+        binary search over that view, O(log n).
+        """
+        k = min(k, len(candidates))
+        if k <= 0:
+            return []
+        index = self._index(db, exam_type, point)
+        if index is None:
+            return [int(candidates[i]) for i in random.sample(range(len(candidates)), k)]
+
+        view = index.restrict(np.asarray(candidates, dtype=np.int64), self._get_params(db)[1])
+        center = self.ability(db, user_id) - math.log(self.target_p / (1 - self.target_p))
+        picked, taken = [], set()
+        for _ in range(k):
+            qid = view.pick(random.gauss(center, self.jitter), taken)
+            if qid is None:
+                break
+            picked.append(qid)
+            taken.add(qid)
+        return picked
+
+    def status(self, db: Session) -> Dict:
+        run = db.query(models.CalibrationRun).order_by(models.CalibrationRun.id.desc()).first()
+        if run is None:
+            return {"calibrated": False}
+        return {
+            "calibrated": True,
+            "kind": run.kind,
+            "last_attempt_id": run.last_attempt_id,
+            "attempts": run.attempts,
+            "users": run.users,
+            "questions": run.questions,
+            "seconds": run.seconds,
+            "at": run.created_at.isoformat() if run.created_at else None
+        }
+
+def main():
+    from .. import database
+    parser = argparse.ArgumentParser(description="Fit Rasch difficulty/ability parameters")
+    parser.add_argument("command", choices=["calibrate"])
+    parser.add_argument("--full", action="store_true", help="refit everything instead of an incremental refresh")
+    args = parser.parse_args()
+
+    database.create_db_and_tables()
+    db = database.SessionLocal()
+    try:
+        result = IrtCalibrator(EligibilityIndex(), min_new_attempts=1).refresh(db, full=args.full)
+        print(result or "Calibration is up to date.")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
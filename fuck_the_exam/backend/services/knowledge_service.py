@@ -1,11 +1,24 @@
 import os
 import re
+from collections import Counter
 from typing import List, Dict
 
 class KnowledgeService:
     def __init__(self, base_path: str):
         self.base_path = base_path
         self.knowledge_dir = os.path.join(base_path, "knowledge_base")
+        self.neighbors = None  # similarity.PointNeighbors, set by the app
+        self.question_bank = None  # callable returning the current QuestionBankSnapshot (or None), set by the app
+
+    @staticmethod
+    def _mode_dir(parent: str, exam_type: str = None) -> str:
+        """parent/<exam type> regardless of case (knowledge_base/N1 on case-sensitive filesystems)."""
+        mode_subfolder = (exam_type or "N1").lower()
+        if os.path.isdir(parent):
+            for name in os.listdir(parent):
+                if name.lower() == mode_subfolder and os.path.isdir(os.path.join(parent, name)):
+                    return os.path.join(parent, name)
+        return os.path.join(parent, mode_subfolder)
 
     def get_all_knowledge_points(self, exam_type: str = None) -> List[Dict]:
         """
@@ -14,8 +27,7 @@ class KnowledgeService:
         If exam_type is provided, filters points that belong to that exam type.
         """
         points = []
-        mode_subfolder = (exam_type or "N1").lower()
-        target_dir = os.path.join(self.knowledge_dir, mode_subfolder)
+        target_dir = self._mode_dir(self.knowledge_dir, exam_type)
         
         if os.path.exists(target_dir):
             for filename in os.listdir(target_dir):
@@ -66,15 +78,22 @@ class KnowledgeService:
         # Scan generated JSON questions
         mode_subfolder = (exam_type or "N1").lower()
         json_dir = os.path.join(os.path.dirname(self.base_path), "backend", "json_questions", mode_subfolder)
+        # Question counts per topic file from the bank snapshot's index (no file is read)
+        snapshot = self.question_bank() if self.question_bank else None
+        counts = {}
+        if snapshot is not None:
+            counts = {os.path.basename(relpath): meta["count"] for relpath, meta in snapshot.files.items()
+                      if relpath.split("/", 1)[0] == mode_subfolder}
         if os.path.exists(json_dir):
             existing_points = {p['point'] for p in points}
             for filename in os.listdir(json_dir):
-                if filename.endswith(".json"):
-                    # Use filename as point name (removing .json)
-                    point_name = filename[:-5]
+                if filename.endswith((".json", ".jsonl")):
+                    # Use filename as point name (removing .json / .jsonl)
+                    point_name = os.path.splitext(filename)[0]
                     
                     # If this point is not already in the list (from markdown), add it
                     if point_name not in existing_points:
+                        existing_points.add(point_name)
                         # Try to get description or count from the json file if possible, 
                         # but purely reading filename is faster. 
                         # Let's read file to be robust or just add simple entry. 
@@ -86,17 +105,25 @@ class KnowledgeService:
                                 "source_file": filename,
                                 "description": "AI Generated Topic", 
                                 "col_2": "Generated", # Level/Type
-                                "col_3": "N/A" # Count/Tag
+                                "col_3": str(counts[filename]) if filename in counts else "N/A" # Count/Tag
                             })
                         except Exception as e:
                              print(f"Error processing json point {filename}: {e}")
 
         return points
 
-    def get_suggestions(self, wrong_question_topics: list) -> List[Dict]:
-         # Basic matching logic
-         knowledge_map = {p['point']: p for p in self.get_all_knowledge_points()}
-         suggestions = []
-         # Logic to find relevant knowledge points based on failures
-         # For now return all as suggestions with a flag if it matches a wrong topic
-         return list(knowledge_map.values())[:5] # Mock return top 5
+    def get_suggestions(self, wrong_question_topics, exam_type: str = "N1", limit: int = 5) -> List[Dict]:
+        """
+        Points related to the ones answered wrong (a list of points, or {point: weight}), from
+        the precomputed neighbor table; each entry carries its 语法.md columns when it has any
+        (parsed at build time and stored with the table).
+        """
+        if self.neighbors is None:
+            return self.get_all_knowledge_points(exam_type=exam_type)[:limit]
+        knowledge_map = self.neighbors.entries(exam_type)
+        if not isinstance(wrong_question_topics, dict):
+            wrong_question_topics = Counter(wrong_question_topics)
+        suggestions = []
+        for entry in self.neighbors.related(wrong_question_topics, exam_type=exam_type, limit=limit):
+            suggestions.append({**knowledge_map.get(entry["point"], {"point": entry["point"]}), **entry})
+        return suggestions
@@ -0,0 +1,113 @@
+import os
+import threading
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: no flock, assume a single process
+    fcntl = None
+
+@contextmanager
+def exclusive_file_lock(path: str):
+    """Blocking flock on `path` for the duration of the block (serializes work across the API workers)."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a") as fh:
+        if fcntl is not None:
+            fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+
+class LeaderLease:
+    """
+    Elects one process among the API workers on this host to own the background jobs
+    (autogen, ingestion, backups). The lease is an exclusive, non-blocking flock on
+    `lock_path`: it is held for the life of the leader and released by the OS if that
+    worker exits or crashes, after which a follower's retry picks it up.
+
+    `on_acquire` runs once when this process becomes leader and `on_release` on a
+    clean stop; the leader's periodic work is scheduled by `on_acquire` (JobScheduler).
+    """
+    def __init__(self, lock_path: str,
+                 on_acquire: Optional[Callable[[], None]] = None,
+                 on_release: Optional[Callable[[], None]] = None,
+                 retry_seconds: float = 15.0):
+        self.lock_path = lock_path
+        self.on_acquire = on_acquire
+        self.on_release = on_release
+        self.retry_seconds = retry_seconds
+        self._fh = None
+        self._is_leader = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self._is_leader
+
+    def _try_acquire(self) -> bool:
+        if fcntl is None:
+            return True
+        os.makedirs(os.path.dirname(self.lock_path) or ".", exist_ok=True)
+        fh = open(self.lock_path, "a+")
+        try:
+            fcntl.flock(fh.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            fh.close()
+            return False
+        # Record the owner for diagnostics (the lock, not the content, is authoritative)
+        fh.seek(0)
+        fh.truncate()
+        fh.write(str(os.getpid()))
+        fh.flush()
+        self._fh = fh
+        return True
+
+    def _become_leader(self):
+        self._is_leader = True
+        print(f"LeaderLease: pid {os.getpid()} owns background services.")
+        if self.on_acquire:
+            try:
+                self.on_acquire()
+            except Exception as e:
+                print(f"LeaderLease: on_acquire failed: {e}")
+
+    def start(self):
+        """Tries the lease once synchronously (so startup knows its role), then keeps retrying in the background."""
+        if self._try_acquire():
+            self._become_leader()
+        else:
+            print(f"LeaderLease: pid {os.getpid()} is a follower (serving requests only).")
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.retry_seconds):
+            if not self._is_leader and self._try_acquire():
+                self._become_leader()
+
+    def owner_pid(self) -> Optional[int]:
+        try:
+            with open(self.lock_path, "r") as f:
+                return int(f.read().strip() or 0) or None
+        except (OSError, ValueError):
+            return None
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+        if self._is_leader and self.on_release:
+            try:
+                self.on_release()
+            except Exception as e:
+                print(f"LeaderLease: on_release failed: {e}")
+        self._is_leader = False
+        if self._fh:
+            if fcntl is not None:
+                fcntl.flock(self._fh.fileno(), fcntl.LOCK_UN)
+            self._fh.close()
+            self._fh = None
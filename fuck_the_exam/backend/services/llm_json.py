@@ -0,0 +1,490 @@
+"""
+Local repair and validation of LLM JSON output, so a slightly malformed response costs a
+repair instead of another API call.
+
+    questions, report = parse_questions(content, topic, stage="generator")
+    # report: {"outcome": "clean" | "repaired" | "unusable", "repairs": [...],
+    #          "items": 5, "valid": 4, "normalized": 2, "dropped": [{"index": 4, "reason": "..."}]}
+
+Parsing tries json.loads first and falls back to a tolerant parser that handles code
+fences and surrounding prose, trailing or missing commas, smart/single quotes used as
+string delimiters, unescaped quotes inside strings, raw newlines, Python literals, unquoted
+keys, and output cut off mid-object (open strings and containers are closed). Each
+question object is then checked against the question schema and normalized field by field
+(options as a list or with "A." keys, answers like "B." or the option text, explanations
+as a dict or list); objects that still lack a usable stem, four options or an answer are
+dropped and the rest are kept.
+
+Outcomes and item results are counted in llm_parse_total and llm_parsed_items_total;
+llm_salvage_ratio is the share of malformed responses that still yielded items.
+"""
+import json
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from .metrics import LLM_PARSE, LLM_PARSED_ITEMS
+
+LETTERS = ("A", "B", "C", "D")
+BLANK = "（　　）"
+DEFAULT_EXPLANATION = "[AI生成辅助] 考点分析加载中，请结合前后文理解。"
+DEFAULT_TIP = "记忆点正在整理中。"
+
+# --- Tolerant JSON ---
+_CLOSING = {'"': '"', "“": "”", "'": "'", "‘": "’", "„": "“"}
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+_LITERALS = {"true": True, "false": False, "null": None, "True": True, "False": False, "None": None}
+_NEXT_KEY = re.compile(r"[\"“'‘][^\"“”'‘’\n]{1,40}[\"”'’]\s*:")
+_MISSING = object()
+
+class _CutStr(str):
+    """A string the reply ended inside of."""
+
+class _TolerantParser:
+    def __init__(self, text: str):
+        self.s = text
+        self.i = 0
+        self.n = len(text)
+        self.repairs: List[str] = []
+
+    def note(self, repair: str):
+        if repair not in self.repairs:
+            self.repairs.append(repair)
+
+    def skip_ws(self) -> bool:
+        """Skips whitespace (and // comments); True if a newline was crossed."""
+        newline = False
+        while self.i < self.n:
+            ch = self.s[self.i]
+            if ch in " \t\r\n﻿　":
+                newline = newline or ch == "\n"
+                self.i += 1
+            elif self.s.startswith("//", self.i):
+                self.note("comment")
+                end = self.s.find("\n", self.i)
+                self.i = self.n if end < 0 else end
+            else:
+                break
+        return newline
+
+    def value(self):
+        self.skip_ws()
+        if self.i >= self.n:
+            self.note("truncated")
+            return _MISSING
+        ch = self.s[self.i]
+        if ch == "{":
+            return self.obj()
+        if ch == "[":
+            return self.array()
+        if ch in _CLOSING:
+            return self.string()
+        return self.bare(",}]\n")
+
+    def string(self) -> str:
+        opener = self.s[self.i]
+        closers = {_CLOSING[opener]} | ({'"'} if opener != "'" else set())
+        if opener != '"':
+            self.note("non-ASCII or single quotes")
+        self.i += 1
+        out = []
+        while self.i < self.n:
+            ch = self.s[self.i]
+            if ch == "\\" and self.i + 1 < self.n:
+                nxt = self.s[self.i + 1]
+                if nxt == "u" and re.fullmatch(r"[0-9a-fA-F]{4}", self.s[self.i + 2:self.i + 6]):
+                    out.append(chr(int(self.s[self.i + 2:self.i + 6], 16)))
+                    self.i += 6
+                else:
+                    out.append(_ESCAPES.get(nxt, nxt))
+                    self.i += 2
+                continue
+            if ch in closers:
+                # A quote ends the string only where JSON can continue; otherwise it is text
+                self.i += 1
+                save = self.i
+                newline = self.skip_ws()
+                follow = self.s[self.i] if self.i < self.n else ""
+                next_key = follow in _CLOSING and _NEXT_KEY.match(self.s, self.i)
+                self.i = save
+                if follow in ("", ",", ":", "}", "]") or (follow in _CLOSING and (newline or next_key)):
+                    return "".join(out)
+                self.note("unescaped quote")
+                out.append(ch)
+                continue
+            out.append(ch)
+            self.i += 1
+        self.note("truncated")
+        return _CutStr("".join(out))
+
+    def bare(self, stops: str):
+        start = self.i
+        while self.i < self.n and self.s[self.i] not in stops:
+            self.i += 1
+        token = self.s[start:self.i].strip()
+        if token in _LITERALS:
+            if token[0].isupper():
+                self.note("Python literal")
+            return _LITERALS[token]
+        try:
+            return int(token)
+        except ValueError:
+            pass
+        try:
+            return float(token)
+        except ValueError:
+            pass
+        self.note("unquoted text")
+        return token
+
+    def _separator(self, close: str) -> bool:
+        """After a member: consumes a comma; False when the container ends (or is cut off)."""
+        newline = self.skip_ws()
+        if self.i >= self.n:
+            self.note("truncated")
+            return False
+        ch = self.s[self.i]
+        if ch == ",":
+            self.i += 1
+            self.skip_ws()
+            if self.i < self.n and self.s[self.i] == close:
+                self.note("trailing comma")
+            return True
+        if ch == close:
+            return True
+        if ch in "}]":
+            self.note("mismatched bracket")
+            return False
+        self.note("missing comma")
+        return True
+
+    def obj(self) -> Dict:
+        self.i += 1
+        out = {}
+        while True:
+            self.skip_ws()
+            if self.i >= self.n:
+                self.note("truncated")
+                return out
+            ch = self.s[self.i]
+            if ch == "}":
+                self.i += 1
+                return out
+            if ch == "]":
+                self.note("mismatched bracket")
+                return out
+            if ch == ",":
+                self.i += 1
+                continue
+            if ch in _CLOSING:
+                key = self.string()
+            else:
+                key = str(self.bare(":,}\n"))
+                self.note("unquoted key")
+            self.skip_ws()
+            if self.i >= self.n:
+                self.note("truncated")
+                return out
+            if self.s[self.i] == ":":
+                self.i += 1
+            else:
+                self.note("missing colon")
+            value = self.value()
+            if value is _MISSING:
+                return out
+            out[key] = value
+            if not self._separator("}"):
+                return out
+
+    def array(self) -> List:
+        self.i += 1
+        out = []
+        while True:
+            self.skip_ws()
+            if self.i >= self.n:
+                self.note("truncated")
+                return out
+            ch = self.s[self.i]
+            if ch == "]":
+                self.i += 1
+                return out
+            if ch == "}":
+                self.note("mismatched bracket")
+                self.i += 1
+                continue
+            if ch == ",":
+                self.i += 1
+                continue
+            value = self.value()
+            if value is _MISSING:
+                return out
+            out.append(value)
+            if not self._separator("]"):
+                return out
+
+def _strip_wrapping(text: str) -> str:
+    """The JSON part of a reply: inside a ```json fence if there is one, from the first bracket on."""
+    fence = re.search(r"```(?:json|JSON)?\s*\n?(.*?)(?:```|$)", text, re.DOTALL)
+    if fence and re.search(r"[\[{]", fence.group(1)):
+        text = fence.group(1)
+    starts = [i for i in (text.find("["), text.find("{")) if i >= 0]
+    return text[min(starts):].strip() if starts else ""
+
+def loads_tolerant(text: str) -> Tuple[Any, List[str]]:
+    """(value, repairs applied); repairs is empty when the text was valid JSON. Raises ValueError if there is no JSON at all."""
+    candidate = _strip_wrapping(text or "")
+    if not candidate:
+        raise ValueError("no JSON object or array in response")
+    try:
+        return json.loads(candidate, strict=False), []
+    except ValueError:
+        pass
+    # Valid JSON followed by prose or a second value
+    try:
+        value, end = json.JSONDecoder(strict=False).raw_decode(candidate)
+        return value, ["trailing text"]
+    except ValueError:
+        pass
+    parser = _TolerantParser(candidate)
+    value = parser.value()
+    if value is _MISSING:
+        raise ValueError("no JSON value in response")
+    return value, parser.repairs
+
+# --- Question schema ---
+_LETTER = re.compile(r"\s*(?:option|选项|答案|正确答案)?\s*[:：]?\s*[\(（\[]?([A-Da-d])[\)）\]]?\s*[.．:：、]?\s*", re.IGNORECASE)
+_LETTER_PREFIX = re.compile(r"^\s*[\(（]?([A-D])[\)）.．:：、]\s*")
+_BLANKS = re.compile(r"[（(][\s　_＿]*[）)]")
+
+def _letter(value) -> Optional[str]:
+    m = _LETTER.fullmatch(str(value))
+    return m.group(1).upper() if m else None
+
+def _text(value) -> str:
+    """Explanations and tips as one string (dicts become 'key: value' lines)."""
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, dict):
+        return "\n".join(f"{k}: {_text(v)}" for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return "\n".join(_text(v) for v in value)
+    return str(value)
+
+def _options(value, notes: List[str]) -> Optional[Dict[str, str]]:
+    if isinstance(value, str):
+        parts = re.split(r"(?:^|\s)[\(（]?([A-D])[\)）.．:：、]\s*", value)
+        value = dict(zip(parts[1::2], parts[2::2]))
+        notes.append("options from text")
+    if isinstance(value, (list, tuple)):
+        if len(value) != len(LETTERS):
+            return None
+        value = dict(zip(LETTERS, value))
+        notes.append("options from list")
+    if not isinstance(value, dict):
+        return None
+    options = {}
+    for key, text in value.items():
+        letter = _letter(key)
+        if letter is None or letter in options:
+            return None
+        if key != letter:
+            notes.append("option keys")
+        text = _text(text)
+        m = _LETTER_PREFIX.match(text)
+        if m and m.group(1) == letter:
+            text = text[m.end():]
+            notes.append("option prefixes")
+        options[letter] = text
+    if set(options) != set(LETTERS) or not all(options.values()) or len(set(options.values())) != len(LETTERS):
+        return None
+    return {letter: options[letter] for letter in LETTERS}
+
+def _answer(value, options: Dict[str, str], notes: List[str]) -> Optional[str]:
+    if isinstance(value, (list, tuple)) and len(value) == 1:
+        value = value[0]
+    if not isinstance(value, str):
+        return None
+    if value in LETTERS:
+        return value
+    notes.append("answer")
+    letter = _letter(value)
+    if letter:
+        return letter
+    text = value.strip()
+    for letter, option in options.items():
+        if text == option:
+            return letter
+    m = _LETTER_PREFIX.match(text)
+    if m and text[m.end():].strip() in ("", options[m.group(1)]):
+        return m.group(1)
+    return None
+
+def _cut_field(value, name: str = "") -> Optional[str]:
+    """Name of the member the reply was cut off in, if any."""
+    if isinstance(value, _CutStr):
+        return name or "value"
+    if isinstance(value, dict):
+        for key, member in value.items():
+            cut = _cut_field(member, name or key)
+            if cut:
+                return cut
+    if isinstance(value, list):
+        for member in value:
+            cut = _cut_field(member, name)
+            if cut:
+                return cut
+    return None
+
+def normalize_question(item: Dict, topic: str) -> Tuple[Optional[Dict], List[str]]:
+    """(question, notes): the schema-conforming question, or None with the reason in notes."""
+    cut = _cut_field(item)
+    if cut:
+        # Half an explanation (or stem) is worse than none: leave it to a later request
+        return None, [f"cut off in {cut}"]
+    notes: List[str] = []
+    content = _text(item.get("content") or item.get("question") or item.get("stem"))
+    if not content:
+        return None, ["missing content"]
+    if BLANK not in content and _BLANKS.search(content):
+        content = _BLANKS.sub(BLANK, content)
+        notes.append("blank")
+    options = _options(item.get("options") or item.get("choices"), notes)
+    if options is None:
+        return None, ["options are not four distinct A-D choices"]
+    answer = _answer(item.get("correct_answer", item.get("answer")), options, notes)
+    if answer is None:
+        return None, [f"unusable correct_answer {item.get('correct_answer', item.get('answer'))!r}"]
+
+    explanation = _text(item.get("explanation"))
+    if not isinstance(item.get("explanation"), (str, type(None))):
+        notes.append("explanation")
+    tip = _text(item.get("memorization_tip"))
+    if not explanation:
+        explanation = DEFAULT_EXPLANATION
+    if not tip:
+        tip = DEFAULT_TIP
+    elif tip in explanation and len(tip) > 10:
+        # The tip only repeats the explanation
+        tip = "见上方详细解析中的逻辑要点。"
+    point = item.get("knowledge_point")
+    return {
+        "content": content,
+        "options": options,
+        "correct_answer": answer,
+        "explanation": explanation,
+        "memorization_tip": tip,
+        "knowledge_point": point.strip() if isinstance(point, str) and point.strip() else topic,
+    }, sorted(set(notes))
+
+def _items(value) -> List:
+    """The list of objects in a reply: the array itself, a {"questions": [...]} wrapper, or one object."""
+    if isinstance(value, list):
+        return value
+    if isinstance(value, dict):
+        lists = [v for v in value.values() if isinstance(v, list) and v and all(isinstance(x, dict) for x in v)]
+        if "questions" in value and isinstance(value["questions"], list):
+            return value["questions"]
+        if len(lists) == 1 and "content" not in value:
+            return lists[0]
+        return [value]
+    return []
+
+def parse_questions(text: str, topic: str, stage: str = "generator") -> Tuple[List[Dict], Dict]:
+    """Valid, normalized questions from an LLM reply, and a report of what was repaired and dropped."""
+    report = {"outcome": "unusable", "repairs": [], "items": 0, "valid": 0, "normalized": 0, "dropped": []}
+    try:
+        value, report["repairs"] = loads_tolerant(text)
+    except ValueError as e:
+        report["error"] = str(e)
+        LLM_PARSE.inc(stage=stage, outcome="unusable")
+        return [], report
+
+    questions = []
+    items = _items(value)
+    report["items"] = len(items)
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            report["dropped"].append({"index": index, "reason": "not an object"})
+            continue
+        question, notes = normalize_question(item, topic)
+        if question is None:
+            report["dropped"].append({"index": index, "reason": notes[0]})
+            continue
+        if notes:
+            report["normalized"] += 1
+        questions.append(question)
+    report["valid"] = len(questions)
+
+    if questions:
+        report["outcome"] = "repaired" if report["repairs"] or report["dropped"] else "clean"
+    LLM_PARSE.inc(stage=stage, outcome=report["outcome"])
+    LLM_PARSED_ITEMS.inc(report["valid"] - report["normalized"], stage=stage, result="ok")
+    LLM_PARSED_ITEMS.inc(report["normalized"], stage=stage, result="normalized")
+    LLM_PARSED_ITEMS.inc(len(report["dropped"]), stage=stage, result="dropped")
+    return questions, report
+
+def parse_reviews(text: str, count: int, stage: str = "reviewer") -> Tuple[Optional[List[Dict]], Dict]:
+    """
+    Reviewer verdicts aligned to the `count` reviewed questions ({"status": PASS|FAIL,
+    "issues": [...]}), placed by their "id" when it is a valid index, else by position;
+    questions without a usable verdict get PASS. None if nothing in the reply was usable.
+    """
+    report = {"outcome": "unusable", "repairs": [], "items": 0, "valid": 0, "normalized": 0, "dropped": []}
+    try:
+        value, report["repairs"] = loads_tolerant(text)
+    except ValueError as e:
+        report["error"] = str(e)
+        LLM_PARSE.inc(stage=stage, outcome="unusable")
+        return None, report
+
+    items = _items(value)
+    report["items"] = len(items)
+    verdicts: List[Optional[Dict]] = [None] * count
+    ids = [item.get("id") for item in items if isinstance(item, dict)]
+    offset = 1 if ids and sorted(ids, key=str) == sorted(range(1, len(ids) + 1), key=str) else 0
+    for index, item in enumerate(items):
+        status = item.get("status") if isinstance(item, dict) else None
+        if isinstance(status, bool):
+            status = "PASS" if status else "FAIL"
+        status = str(status).strip().upper() if status is not None else ""
+        if status not in ("PASS", "FAIL"):
+            report["dropped"].append({"index": index, "reason": f"status {item.get('status') if isinstance(item, dict) else item!r}"})
+            continue
+        issues = item.get("issues") or []
+        if not isinstance(issues, list):
+            issues = [issues]
+            report["normalized"] += 1
+        target = item.get("id")
+        if isinstance(target, int):
+            target -= offset
+        if not (isinstance(target, int) and 0 <= target < count and verdicts[target] is None):
+            target = index
+        if target >= count:
+            report["dropped"].append({"index": index, "reason": "more verdicts than questions"})
+            continue
+        verdicts[target] = {"id": target, "status": status, "issues": [_text(i) for i in issues]}
+        report["valid"] += 1
+
+    if report["valid"]:
+        report["outcome"] = "repaired" if report["repairs"] or report["dropped"] or report["valid"] < count else "clean"
+    LLM_PARSE.inc(stage=stage, outcome=report["outcome"])
+    LLM_PARSED_ITEMS.inc(report["valid"] - report["normalized"], stage=stage, result="ok")
+    LLM_PARSED_ITEMS.inc(report["normalized"], stage=stage, result="normalized")
+    LLM_PARSED_ITEMS.inc(len(report["dropped"]), stage=stage, result="dropped")
+    if not report["valid"]:
+        return None, report
+    return [v or {"id": i, "status": "PASS", "issues": []} for i, v in enumerate(verdicts)], report
+
+def summarize(report: Dict) -> str:
+    """One log line for a parse report."""
+    parts = [f"{report['valid']}/{report['items']} valid"]
+    if report.get("repairs"):
+        parts.append("repaired: " + ", ".join(report["repairs"]))
+    if report.get("normalized"):
+        parts.append(f"{report['normalized']} normalized")
+    for drop in report.get("dropped", []):
+        parts.append(f"dropped #{drop['index']}: {drop['reason']}")
+    if report.get("error"):
+        parts.append(report["error"])
+    return f"{report['outcome']} ({'; '.join(parts)})"
@@ -1,89 +1,329 @@
 import os
 import datetime
 import json
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: single process, no cross-process lock needed
+    fcntl = None
+
+INDEX_VERSION = 1
+RECENT_WRONG = 20
+RECENT_SESSIONS = 10
+
+def _decode_options(options):
+    if isinstance(options, str):
+        try:
+            return json.loads(options)
+        except Exception:
+            return {}
+    return options or {}
 
 class MarkdownService:
-    def __init__(self, base_path: str = "knowledge_base"):
+    """
+    Markdown study log (knowledge_base/): the wrong-question "black book", progress.md and
+    one file per quiz session.
+
+    Requests only snapshot the data and enqueue it; a background worker batches the
+    appends (one write per file per batch), rotates the black book and progress log by
+    month or size, and keeps `log_index.json` up to date so readers (the n1-progress
+    skill scripts) never have to re-read and split the whole log.
+    """
+    def __init__(self, base_path: str = "knowledge_base", max_bytes: int = 1_000_000, rotate: str = "monthly",
+                 flush_interval: float = 1.0, batch_size: int = 200):
         self.base_path = base_path
         os.makedirs(self.base_path, exist_ok=True)
         self.progress_file = os.path.join(self.base_path, "progress.md")
         self.wrong_questions_file = os.path.join(self.base_path, "wrong_questions.md")
+        self.index_file = os.path.join(self.base_path, "log_index.json")
+        self.lock_file = os.path.join(self.base_path, ".log.lock")
+        self.max_bytes = max_bytes
+        self.rotate = rotate  # "monthly", "daily" or None (size only)
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._queue = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
 
-    def _ensure_daily_dir(self):
-        today = datetime.date.today().isoformat()
-        daily_dir = os.path.join(self.base_path, today)
-        os.makedirs(daily_dir, exist_ok=True)
-        return daily_dir, today
-
+    # --- Public API (called from request handlers; cheap) ---
     def log_quiz_session(self, topic: str, questions: list, results: list):
         """
         Logs a quiz session to a markdown file in the daily directory.
         """
-        daily_dir, today = self._ensure_daily_dir()
-        timestamp = datetime.datetime.now().strftime("%H-%M-%S")
-        filename = f"quiz_{timestamp}.md"
-        filepath = os.path.join(daily_dir, filename)
-
-        score = sum(1 for r in results if r['is_correct'])
-        total = len(results)
-        
-        content = f"# Quiz Session: {topic}\n"
-        content += f"**Date**: {today} {timestamp}\n"
-        content += f"**Score**: {score}/{total}\n\n"
-        
-        content += "## Details\n"
-        for i, (q, r) in enumerate(zip(questions, results)):
+        now = datetime.datetime.now()
+        snapshot = {
+            "topic": topic,
+            "date": now.date().isoformat(),
+            "time": now.strftime("%H-%M-%S"),
+            "questions": [{"content": q.content, "correct_answer": q.correct_answer, "explanation": q.explanation} for q in questions],
+            "results": [{"is_correct": bool(r['is_correct']), "selected_answer": r['selected_answer']} for r in results]
+        }
+        self._enqueue(("session", snapshot))
+
+    def log_wrong_question(self, question):
+        """
+        Appends a wrong question to the wrong_questions.md file.
+        """
+        snapshot = {
+            "date": datetime.date.today().isoformat(),
+            "knowledge_point": question.knowledge_point,
+            "content": question.content,
+            "options": _decode_options(question.options),
+            "correct_answer": question.correct_answer,
+            "explanation": question.explanation
+        }
+        self._enqueue(("wrong", snapshot))
+
+    def flush(self):
+        """Blocks until everything enqueued so far is on disk."""
+        if self._worker is not None:
+            self._queue.join()
+
+    def close(self):
+        with self._worker_lock:
+            worker = self._worker
+            if worker is None:
+                return
+            self._queue.put(None)
+        worker.join(timeout=10)
+        self._worker = None
+
+    # --- Worker ---
+    def _enqueue(self, item):
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, daemon=True, name="markdown-log-writer")
+                self._worker.start()
+        self._queue.put(item)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            # Coalesce whatever arrives within flush_interval (bounded by batch_size)
+            deadline = time.monotonic() + self.flush_interval
+            while batch[-1] is not None and len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            stop = batch[-1] is None
+            items = [item for item in batch if item is not None]
+            try:
+                if items:
+                    self._write_batch(items)
+            except Exception as e:
+                print(f"Markdown log writer failed ({len(items)} entries): {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if stop:
+                return
+
+    def _write_batch(self, items):
+        with self._locked():
+            index = self._load_index()
+            wrong_parts, progress_parts = [], []
+            for kind, data in items:
+                if kind == "wrong":
+                    wrong_parts.append(self._format_wrong(data))
+                    self._index_wrong(index["wrong_questions"], data)
+                elif kind == "session":
+                    self._write_session_file(data)
+                    progress_parts.append(self._format_progress(data))
+                    self._index_session(index["progress"], data)
+
+            if wrong_parts:
+                self._append(self.wrong_questions_file, "# Wrong Questions Black Book\n\n", "".join(wrong_parts), index["wrong_questions"])
+            if progress_parts:
+                self._append(self.progress_file, "# Learning Progress Tracker\n\n", "".join(progress_parts), index["progress"])
+            self._save_index(index)
+
+    @contextmanager
+    def _locked(self):
+        """Serializes batches across API workers sharing knowledge_base/."""
+        with open(self.lock_file, "a") as fh:
+            if fcntl is not None:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+
+    # --- Formatting (join-based) ---
+    @staticmethod
+    def _format_wrong(data) -> str:
+        options = data["options"]
+        return "".join([
+            f"## [{data['date']}] {data['knowledge_point']}\n",
+            f"**Q**: {data['content']}\n",
+            f"- A: {options.get('A')}\n",
+            f"- B: {options.get('B')}\n",
+            f"- C: {options.get('C')}\n",
+            f"- D: {options.get('D')}\n",
+            f"\n**Correct Answer**: {data['correct_answer']}\n",
+            f"**Explanation**: {data['explanation']}\n",
+            "---\n\n",
+        ])
+
+    @staticmethod
+    def _session_score(data):
+        return sum(1 for r in data["results"] if r["is_correct"]), len(data["results"])
+
+    def _format_progress(self, data) -> str:
+        score, total = self._session_score(data)
+        percent = int(score / total * 100) if total else 0
+        return f"- **{data['date']}**: Tested on `{data['topic']}`. Score: {score}/{total} ({percent}%)\n"
+
+    def _write_session_file(self, data):
+        daily_dir = os.path.join(self.base_path, data["date"])
+        os.makedirs(daily_dir, exist_ok=True)
+        score, total = self._session_score(data)
+
+        parts = [
+            f"# Quiz Session: {data['topic']}\n",
+            f"**Date**: {data['date']} {data['time']}\n",
+            f"**Score**: {score}/{total}\n\n",
+            "## Details\n",
+        ]
+        for i, (q, r) in enumerate(zip(data["questions"], data["results"])):
             status = "✅" if r['is_correct'] else "❌"
-            content += f"### Q{i+1} {status}\n"
-            content += f"**Question**: {q.content}\n\n"
-            content += f"**Your Answer**: {r['selected_answer']} | **Correct**: {q.correct_answer}\n\n"
+            parts.append(f"### Q{i+1} {status}\n")
+            parts.append(f"**Question**: {q['content']}\n\n")
+            parts.append(f"**Your Answer**: {r['selected_answer']} | **Correct**: {q['correct_answer']}\n\n")
             if not r['is_correct']:
-                content += f"> **Explanation**: {q.explanation}\n\n"
-            content += "---\n"
+                parts.append(f"> **Explanation**: {q['explanation']}\n\n")
+            parts.append("---\n")
 
+        filepath = os.path.join(daily_dir, f"quiz_{data['time']}.md")
         with open(filepath, "w", encoding="utf-8") as f:
-            f.write(content)
+            f.write("".join(parts))
 
-        self._update_daily_progress(today, topic, score, total)
+    # --- Rotation ---
+    def _period(self, date_str: str):
+        if self.rotate == "monthly":
+            return date_str[:7]
+        if self.rotate == "daily":
+            return date_str
+        return None
 
-    def _update_daily_progress(self, date: str, topic: str, score: int, total: int):
-        """
-        Appends a summary line to the main progress.md file.
-        """
-        if not os.path.exists(self.progress_file):
-            with open(self.progress_file, "w", encoding="utf-8") as f:
-                f.write("# Learning Progress Tracker\n\n")
+    def _append(self, path: str, header: str, text: str, section: dict):
+        today = datetime.date.today().isoformat()
+        period = self._period(today)
+        if os.path.exists(path):
+            too_big = self.max_bytes and os.path.getsize(path) + len(text.encode("utf-8")) > self.max_bytes
+            new_period = period is not None and section.get("period") not in (None, period)
+            if too_big or new_period:
+                stem, ext = os.path.splitext(path)
+                label = section.get("period") or today
+                archive = f"{stem}.{label}{ext}"
+                n = 1
+                while os.path.exists(archive):
+                    n += 1
+                    archive = f"{stem}.{label}-{n}{ext}"
+                os.replace(path, archive)
+                section.setdefault("archives", []).append(os.path.basename(archive))
 
-        line = f"- **{date}**: Tested on `{topic}`. Score: {score}/{total} ({int(score/total*100)}%)\n"
-        
-        with open(self.progress_file, "a", encoding="utf-8") as f:
-            f.write(line)
+        if not os.path.exists(path):
+            text = header + text
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(text)
+        section["period"] = period
 
-    def log_wrong_question(self, question):
-        """
-        Appends a wrong question to the wrong_questions.md file.
-        """
-        if not os.path.exists(self.wrong_questions_file):
-            with open(self.wrong_questions_file, "w", encoding="utf-8") as f:
-                f.write("# Wrong Questions Black Book\n\n")
+    # --- Index ---
+    @staticmethod
+    def _empty_index():
+        return {
+            "version": INDEX_VERSION,
+            "wrong_questions": {"total": 0, "by_point": {}, "recent": [], "archives": [], "period": None},
+            "progress": {"sessions": 0, "answered": 0, "correct": 0, "by_date": {}, "recent": [], "archives": [], "period": None}
+        }
 
-        # Basic deduplication check could be added here, but for now we append
-        options = question.options
-        if isinstance(options, str):
+    @staticmethod
+    def _index_wrong(section, data):
+        point = data.get("knowledge_point") or "未分类"
+        section["total"] += 1
+        section["by_point"][point] = section["by_point"].get(point, 0) + 1
+        section["recent"].append({
+            "date": data["date"],
+            "knowledge_point": point,
+            "question": (data.get("content") or "")[:120],
+            "correct_answer": data.get("correct_answer")
+        })
+        del section["recent"][:-RECENT_WRONG]
+
+    def _index_session(self, section, data):
+        score, total = self._session_score(data)
+        section["sessions"] += 1
+        section["answered"] += total
+        section["correct"] += score
+        day = section["by_date"].setdefault(data["date"], {"sessions": 0, "answered": 0, "correct": 0})
+        day["sessions"] += 1
+        day["answered"] += total
+        day["correct"] += score
+        section["recent"].append(self._format_progress(data).strip())
+        del section["recent"][:-RECENT_SESSIONS]
+
+    def _load_index(self):
+        if os.path.exists(self.index_file):
             try:
-                options = json.loads(options)
-            except:
-                options = {}
-        
-        content = f"## [{datetime.date.today()}] {question.knowledge_point}\n"
-        content += f"**Q**: {question.content}\n"
-        content += f"- A: {options.get('A')}\n"
-        content += f"- B: {options.get('B')}\n"
-        content += f"- C: {options.get('C')}\n"
-        content += f"- D: {options.get('D')}\n"
-        content += f"\n**Correct Answer**: {question.correct_answer}\n"
-        content += f"**Explanation**: {question.explanation}\n"
-        content += "---\n\n"
-
-        with open(self.wrong_questions_file, "a", encoding="utf-8") as f:
-            f.write(content)
+                with open(self.index_file, "r", encoding="utf-8") as f:
+                    index = json.load(f)
+                if index.get("version") == INDEX_VERSION:
+                    return index
+            except (OSError, ValueError):
+                pass
+        return self._rebuild_index()
+
+    def _save_index(self, index):
+        tmp = f"{self.index_file}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(index, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, self.index_file)
+
+    def _rebuild_index(self):
+        """One-time scan of existing logs (before the index existed, or after it was deleted)."""
+        index = self._empty_index()
+        wrong = index["wrong_questions"]
+        if os.path.exists(self.wrong_questions_file):
+            with open(self.wrong_questions_file, "r", encoding="utf-8") as f:
+                for block in f.read().split("\n## [")[1:]:
+                    header, _, body = block.partition("\n")
+                    date, _, point = header.partition("] ")
+                    question = ""
+                    for line in body.splitlines():
+                        if line.startswith("**Q**: "):
+                            question = line[len("**Q**: "):]
+                            break
+                    self._index_wrong(wrong, {"date": date, "knowledge_point": point.strip(), "content": question, "correct_answer": None})
+
+        progress = index["progress"]
+        if os.path.exists(self.progress_file):
+            with open(self.progress_file, "r", encoding="utf-8") as f:
+                for line in f:
+                    if not line.startswith("- **"):
+                        continue
+                    progress["sessions"] += 1
+                    date = line[4:14]
+                    try:
+                        score, total = line.split("Score: ", 1)[1].split(" ", 1)[0].split("/")
+                        score, total = int(score), int(total)
+                    except (IndexError, ValueError):
+                        score, total = 0, 0
+                    progress["answered"] += total
+                    progress["correct"] += score
+                    day = progress["by_date"].setdefault(date, {"sessions": 0, "answered": 0, "correct": 0})
+                    day["sessions"] += 1
+                    day["answered"] += total
+                    day["correct"] += score
+                    progress["recent"].append(line.strip())
+            del progress["recent"][:-RECENT_SESSIONS]
+        return index
@@ -0,0 +1,202 @@
+import calendar
+import math
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from .. import models
+from .eligibility import EligibilityIndex
+from .metrics import CACHE_REQUESTS
+
+def _epoch(at: Optional[datetime]) -> float:
+    """Naive datetimes are UTC, as SQLite's CURRENT_TIMESTAMP (and strftime('%s')) see them."""
+    if at is None:
+        return time.time()
+    if at.tzinfo is not None:
+        return at.timestamp()
+    return calendar.timegm(at.timetuple()) + at.microsecond / 1e6
+
+class _Attempts:
+    """One user's attempts as growable columns (question id, correct, epoch seconds)."""
+    __slots__ = ("question_id", "correct", "at", "size", "built_at")
+
+    def __init__(self, question_id: np.ndarray, correct: np.ndarray, at: np.ndarray):
+        self.question_id = question_id
+        self.correct = correct
+        self.at = at
+        self.size = question_id.size
+        self.built_at = time.monotonic()
+
+    def append(self, question_id: int, correct: bool, at: float):
+        if self.size == self.question_id.size:
+            capacity = max(16, self.size * 2)
+            self.question_id = np.resize(self.question_id, capacity)
+            self.correct = np.resize(self.correct, capacity)
+            self.at = np.resize(self.at, capacity)
+        self.question_id[self.size] = question_id
+        self.correct[self.size] = 1 if correct else 0
+        self.at[self.size] = at
+        self.size += 1
+
+    @property
+    def nbytes(self) -> int:
+        return self.question_id.nbytes + self.correct.nbytes + self.at.nbytes
+
+class MasteryEngine:
+    """
+    Knowledge-point mastery from a cached columnar copy of each user's attempts (loaded once,
+    appended on submit), aggregated per point with np.bincount over the question catalog
+    shared with EligibilityIndex:
+
+      attempts   attempt volume
+      accuracy   correct / attempts
+      recency    attempts weighted by 0.5 ** (age / half_life)
+      recent_accuracy  accuracy under the same decay weights
+      trend      recent_accuracy - accuracy (improving > 0, slipping < 0)
+      last_seen  epoch seconds of the latest attempt
+
+    Users are evicted LRU-first beyond `max_bytes`; `ttl_seconds` bounds staleness from writes
+    made in other workers, as in EligibilityIndex. As there, a load that overlapped a
+    `record_attempt` / `clear` is served once but not cached.
+    """
+    def __init__(self, eligibility: EligibilityIndex, half_life_days: float = 14.0,
+                 max_bytes: int = 64 * 1024 * 1024, ttl_seconds: int = 300):
+        self.eligibility = eligibility
+        self.half_life_days = half_life_days
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._users: "OrderedDict[int, _Attempts]" = OrderedDict()
+        self._bytes = 0
+        self._loading: Dict[int, int] = {}  # user_id -> loads in flight
+        self._writes: Dict[int, int] = {}  # user_id -> writes seen while loading
+        self._lock = threading.Lock()
+
+    def _load(self, db: Session, user_id: int) -> _Attempts:
+        rows = db.query(models.AnswerAttempt.question_id, models.AnswerAttempt.is_correct,
+                        func.strftime('%s', models.AnswerAttempt.attempted_at))\
+            .filter(models.AnswerAttempt.user_id == user_id, models.AnswerAttempt.question_id != None)\
+            .order_by(models.AnswerAttempt.id).all()
+        return _Attempts(
+            np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows)),
+            np.fromiter((r[1] or 0 for r in rows), dtype=np.int8, count=len(rows)),
+            np.fromiter((float(r[2]) if r[2] is not None else 0.0 for r in rows), dtype=np.float64, count=len(rows))
+        )
+
+    def _get(self, db: Session, user_id: int) -> _Attempts:
+        with self._lock:
+            cached = self._users.get(user_id)
+            if cached and time.monotonic() - cached.built_at < self.ttl_seconds:
+                self._users.move_to_end(user_id)
+                CACHE_REQUESTS.inc(cache="mastery", result="hit")
+                return cached
+            self._loading[user_id] = self._loading.get(user_id, 0) + 1
+            writes = self._writes.get(user_id, 0)
+        CACHE_REQUESTS.inc(cache="mastery", result="miss")
+
+        loaded = None
+        try:
+            loaded = self._load(db, user_id)
+        finally:
+            with self._lock:
+                fresh = self._writes.get(user_id, 0) == writes
+                self._loading[user_id] -= 1
+                if not self._loading[user_id]:
+                    del self._loading[user_id]
+                    self._writes.pop(user_id, None)
+                if loaded is not None and fresh:
+                    old = self._users.pop(user_id, None)
+                    if old:
+                        self._bytes -= old.nbytes
+                    self._users[user_id] = loaded
+                    self._bytes += loaded.nbytes
+                    while self._bytes > self.max_bytes and len(self._users) > 1:
+                        _, evicted = self._users.popitem(last=False)
+                        self._bytes -= evicted.nbytes
+        return loaded
+
+    # --- Queries ---
+    def matrix(self, db: Session, user_ids: Iterable[int], exam_type: str, now: Optional[float] = None) -> Dict:
+        """
+        Columnar user x knowledge-point matrix for exam_type: {"points": [...], "users": [...],
+        metric: 2-D array (users x points)}. Every point with questions in exam_type gets a
+        column, attempted or not.
+        """
+        now = time.time() if now is None else now
+        catalog = self.eligibility.catalog(db)
+        exam_ids = catalog.exam_ids(exam_type)
+        in_exam = np.zeros(catalog.point_code.size, dtype=bool)
+        in_exam[exam_ids] = True
+        point_codes = np.unique(catalog.point_code[exam_ids])
+        n_points = len(catalog.point_names)
+        decay = math.log(2) / (self.half_life_days * 86400)
+
+        user_ids = list(user_ids)
+        shape = (len(user_ids), point_codes.size)
+        attempts, accuracy, recency = np.zeros(shape), np.zeros(shape), np.zeros(shape)
+        recent_accuracy, last_seen = np.zeros(shape), np.zeros(shape)
+        for row, user_id in enumerate(user_ids):
+            cached = self._get(db, user_id)
+            with self._lock:
+                n = cached.size
+                qids, correct, at = cached.question_id[:n].copy(), cached.correct[:n].copy(), cached.at[:n].copy()
+
+            keep = qids < in_exam.size
+            qids, correct, at = qids[keep], correct[keep], at[keep]
+            keep = in_exam[qids]
+            codes, correct, at = catalog.point_code[qids[keep]], correct[keep], at[keep]
+
+            weights = np.exp(-decay * np.maximum(now - at, 0))
+            volume = np.bincount(codes, minlength=n_points)
+            hits = np.bincount(codes, weights=correct, minlength=n_points)
+            decayed = np.bincount(codes, weights=weights, minlength=n_points)
+            decayed_hits = np.bincount(codes, weights=weights * correct, minlength=n_points)
+            latest = np.zeros(n_points)
+            np.maximum.at(latest, codes, at)
+
+            volume, hits = volume[point_codes], hits[point_codes]
+            decayed, decayed_hits = decayed[point_codes], decayed_hits[point_codes]
+            attempts[row] = volume
+            accuracy[row] = np.divide(hits, volume, out=np.zeros(point_codes.size), where=volume > 0)
+            recency[row] = decayed
+            recent_accuracy[row] = np.divide(decayed_hits, decayed, out=np.zeros(point_codes.size), where=decayed > 0)
+            last_seen[row] = latest[point_codes]
+
+        return {
+            "users": user_ids,
+            "points": [catalog.point_names[c] for c in point_codes],
+            "attempts": attempts,
+            "accuracy": accuracy,
+            "recency": recency,
+            "recent_accuracy": recent_accuracy,
+            "trend": np.where(attempts > 0, recent_accuracy - accuracy, 0.0),
+            "last_seen": last_seen,
+        }
+
+    # --- Updates ---
+    def record_attempt(self, user_id: int, question_id: int, is_correct: bool, attempted_at: Optional[datetime] = None):
+        """Appends to a warm user's columns (cold users load everything on next use)."""
+        with self._lock:
+            if user_id in self._loading:
+                self._writes[user_id] = self._writes.get(user_id, 0) + 1
+            cached = self._users.get(user_id)
+            if cached is None:
+                return
+            before = cached.nbytes
+            cached.append(question_id, is_correct, _epoch(attempted_at))
+            self._bytes += cached.nbytes - before
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+            self._bytes = 0
+            for user_id in self._loading:
+                self._writes[user_id] = self._writes.get(user_id, 0) + 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"users": len(self._users), "bytes": self._bytes, "max_bytes": self.max_bytes}
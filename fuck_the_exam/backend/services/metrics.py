@@ -0,0 +1,235 @@
+import threading
+import time
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Iterable[str], values: Iterable, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _format_number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(labels.get(n, "") for n in self.labelnames), 0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_number(value)}")
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        # key -> [bucket counts..., sum, count]
+        self._values: Dict[Tuple, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        for key, state in items:
+            for bound, count in zip(self.buckets, state):
+                le = f'le="{_format_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {count}")
+            inf = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, inf)} {state[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_number(state[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {state[-1]}")
+        return lines
+
+class CallbackGauge:
+    """Gauge whose samples are read at scrape time: fn() -> {label values tuple: value}."""
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...], fn: Callable[[], Dict[Tuple, float]]):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.fn = fn
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            samples = self.fn()
+        except Exception as e:
+            print(f"Metrics: gauge {self.name} failed: {e}")
+            samples = {}
+        for key, value in sorted(samples.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_number(value)}")
+        return lines
+
+class MetricsRegistry:
+    """In-process metrics rendered in the Prometheus text exposition format (no client library needed)."""
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, help: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def gauge_callback(self, name: str, help: str, labelnames: Tuple[str, ...], fn: Callable[[], Dict[Tuple, float]]) -> CallbackGauge:
+        return self._register(CallbackGauge(name, help, labelnames, fn))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+registry = MetricsRegistry()
+
+# --- Shared instruments ---
+HTTP_LATENCY = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template.", ("method", "route", "status"))
+HTTP_SQL_STATEMENTS = registry.histogram(
+    "http_request_sql_statements", "SQL statements executed per request.", ("route",),
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500))
+HTTP_SQL_SECONDS = registry.histogram(
+    "http_request_sql_seconds", "Time spent in SQL per request.", ("route",))
+SQL_LATENCY = registry.histogram(
+    "sql_statement_duration_seconds", "Individual SQL statement latency by verb.", ("verb",),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+LLM_LATENCY = registry.histogram(
+    "llm_request_duration_seconds", "LLM API call latency per pipeline stage.", ("stage",),
+    buckets=(0.5, 1, 2.5, 5, 10, 20, 30, 60, 90, 120))
+LLM_REQUESTS = registry.counter(
+    "llm_requests_total", "LLM API calls per pipeline stage and outcome.", ("stage", "outcome"))
+LLM_RETRIES = registry.counter(
+    "llm_retries_total", "LLM calls that were retries of a failed attempt.", ("stage",))
+LLM_TOKENS = registry.counter(
+    "llm_tokens_total", "Tokens reported by the LLM API.", ("stage", "kind"))
+AUTOGEN_CYCLE = registry.histogram(
+    "autogen_cycle_duration_seconds", "Duration of one AutoGenService check-and-generate cycle.", ("outcome",),
+    buckets=(1, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600))
+GENERATED_QUESTIONS = registry.counter(
+    "generated_questions_total", "Questions generated, by source (ai/template).", ("source",))
+CACHE_REQUESTS = registry.counter(
+    "cache_requests_total", "Cache lookups by cache and result (hit/miss).", ("cache", "result"))
+SCHEDULER_JOB_DURATION = registry.histogram(
+    "scheduler_job_duration_seconds", "Duration of scheduled background jobs.", ("job", "outcome"),
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 1800, 3600))
+SCHEDULER_JOB_RUNS = registry.counter(
+    "scheduler_job_runs_total", "Scheduled job runs by outcome (ok/error/skipped while still running).", ("job", "outcome"))
+
+def _cache_hit_ratios():
+    with CACHE_REQUESTS._lock:
+        caches = {key[0] for key in CACHE_REQUESTS._values}
+    ratios = {}
+    for cache in caches:
+        hits = CACHE_REQUESTS.value(cache=cache, result="hit")
+        total = hits + CACHE_REQUESTS.value(cache=cache, result="miss")
+        if total:
+            ratios[(cache,)] = hits / total
+    return ratios
+
+registry.gauge_callback("cache_hit_ratio", "Lifetime hit ratio per cache.", ("cache",), _cache_hit_ratios)
+
+LLM_PARSE = registry.counter(
+    "llm_parse_total", "LLM responses by stage and parse outcome (clean/repaired/unusable).", ("stage", "outcome"))
+LLM_PARSED_ITEMS = registry.counter(
+    "llm_parsed_items_total", "Objects in parsed LLM responses by stage and result (ok/normalized/dropped).", ("stage", "result"))
+
+def _llm_salvage_ratios():
+    with LLM_PARSE._lock:
+        stages = {key[0] for key in LLM_PARSE._values}
+    ratios = {}
+    for stage in stages:
+        repaired = LLM_PARSE.value(stage=stage, outcome="repaired")
+        total = repaired + LLM_PARSE.value(stage=stage, outcome="unusable")
+        if total:
+            ratios[(stage,)] = repaired / total
+    return ratios
+
+registry.gauge_callback(
+    "llm_salvage_ratio", "Share of malformed LLM responses salvaged locally (no retry needed).", ("stage",), _llm_salvage_ratios)
+
+# --- Per-request SQL accounting ---
+class _SqlTally:
+    __slots__ = ("statements", "seconds")
+
+    def __init__(self):
+        self.statements = 0
+        self.seconds = 0.0
+
+_current_sql: ContextVar[Optional[_SqlTally]] = ContextVar("current_sql", default=None)
+
+def begin_request_sql() -> Tuple[_SqlTally, object]:
+    tally = _SqlTally()
+    return tally, _current_sql.set(tally)
+
+def end_request_sql(token):
+    _current_sql.reset(token)
+
+def instrument_engine(engine):
+    """Times every cursor execution on a (sync) SQLAlchemy engine and charges it to the current request."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("metrics_query_start")
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        verb = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+        SQL_LATENCY.observe(elapsed, verb=verb)
+        tally = _current_sql.get()
+        if tally is not None:
+            tally.statements += 1
+            tally.seconds += elapsed
@@ -0,0 +1,263 @@
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter as CounterDict
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+class ProfileSession:
+    """Samples and SQL collected for one request."""
+    def __init__(self, request_id: str, method: str, path: str, route: Optional[str], endpoint_code, forced: bool):
+        self.request_id = request_id
+        self.method = method
+        self.path = path
+        self.route = route
+        self.endpoint_code = endpoint_code
+        # Explicitly armed route: always kept. Otherwise kept only above the latency threshold.
+        self.forced = forced
+        self.samples: CounterDict = CounterDict()
+        self.sample_count = 0
+        self.sql: List[Dict] = []
+        self.started_at = time.time()
+
+_current_profile: ContextVar[Optional[ProfileSession]] = ContextVar("current_profile", default=None)
+
+def _frame_name(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class RequestProfiler:
+    """
+    On-demand sampling profiler for slow requests. When armed (per route template and/or
+    with a latency threshold), a sampler thread walks the stacks of all threads every
+    `interval_ms` and charges a sample to a request whenever its endpoint function is on a
+    stack; stacks are stored collapsed (rooted at the endpoint) together with the SQL the
+    request executed. Kept profiles go to a bounded on-disk ring, one JSON file per request id.
+    """
+    def __init__(self, profile_dir: str, max_profiles: int = 50):
+        self.profile_dir = profile_dir
+        self.max_profiles = max_profiles
+        self.routes = set()
+        self.threshold_ms: Optional[float] = None
+        self.interval_ms = 5.0
+        self._active: Dict[str, ProfileSession] = {}
+        self._lock = threading.Lock()
+        self._sampler = None
+        self._wake = threading.Event()
+
+    # --- Configuration ---
+    @property
+    def armed(self) -> bool:
+        return bool(self.routes) or self.threshold_ms is not None
+
+    def arm(self, routes: Optional[List[str]] = None, threshold_ms: Optional[float] = None,
+            interval_ms: Optional[float] = None, max_profiles: Optional[int] = None):
+        self.routes = set(routes or [])
+        self.threshold_ms = threshold_ms
+        if interval_ms:
+            self.interval_ms = max(1.0, float(interval_ms))
+        if max_profiles:
+            self.max_profiles = max(1, int(max_profiles))
+
+    def disarm(self):
+        self.routes = set()
+        self.threshold_ms = None
+
+    def status(self) -> Dict:
+        return {
+            "armed": self.armed,
+            "routes": sorted(self.routes),
+            "threshold_ms": self.threshold_ms,
+            "interval_ms": self.interval_ms,
+            "max_profiles": self.max_profiles,
+            "active": len(self._active)
+        }
+
+    # --- Request lifecycle ---
+    def begin(self, method: str, path: str, route: Optional[str], endpoint) -> Optional[ProfileSession]:
+        forced = route in self.routes
+        if not forced and self.threshold_ms is None:
+            return None
+        code = getattr(endpoint, "__code__", None)
+        session = ProfileSession(uuid.uuid4().hex, method, path, route, code, forced)
+        with self._lock:
+            self._active[session.request_id] = session
+            if self._sampler is None or not self._sampler.is_alive():
+                self._sampler = threading.Thread(target=self._sample_loop, daemon=True, name="request-profiler")
+                self._sampler.start()
+        self._wake.set()
+        return session
+
+    def end(self, session: ProfileSession, status: int, duration_ms: float) -> bool:
+        """Stops sampling for the request; returns True when the profile was written to the ring."""
+        with self._lock:
+            self._active.pop(session.request_id, None)
+        keep = session.forced or (self.threshold_ms is not None and duration_ms >= self.threshold_ms)
+        if not keep:
+            return False
+        try:
+            self._write(session, status, duration_ms)
+            return True
+        except Exception as e:
+            print(f"Profiler: failed to write profile {session.request_id}: {e}")
+            return False
+
+    def record_sql(self, statement: str, duration_ms: float):
+        session = _current_profile.get()
+        if session is not None:
+            session.sql.append({"statement": statement[:2000], "duration_ms": round(duration_ms, 3)})
+
+    # --- Sampling ---
+    def _sample_loop(self):
+        own = threading.get_ident()
+        while True:
+            # Clear before looking, so a begin() racing with this check still wakes us
+            self._wake.clear()
+            with self._lock:
+                sessions = list(self._active.values())
+            if not sessions:
+                # Park until a request is profiled again; exit when idle for a while
+                if not self._wake.wait(30):
+                    with self._lock:
+                        if not self._active:
+                            self._sampler = None
+                            return
+                continue
+
+            for tid, frame in sys._current_frames().items():
+                if tid == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame.f_code)
+                    frame = frame.f_back
+                stack.reverse()
+                for session in sessions:
+                    if session.endpoint_code is None:
+                        continue
+                    try:
+                        root = stack.index(session.endpoint_code)
+                    except ValueError:
+                        continue
+                    session.samples[";".join(_frame_name(c) for c in stack[root:])] += 1
+                    session.sample_count += 1
+            time.sleep(self.interval_ms / 1000.0)
+
+    # --- Ring storage ---
+    def _path(self, request_id: str) -> str:
+        safe = "".join(ch for ch in request_id if ch.isalnum() or ch in "-_")
+        return os.path.join(self.profile_dir, f"{safe}.json")
+
+    def _write(self, session: ProfileSession, status: int, duration_ms: float):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        data = {
+            "request_id": session.request_id,
+            "method": session.method,
+            "path": session.path,
+            "route": session.route,
+            "status": status,
+            "started_at": session.started_at,
+            "duration_ms": round(duration_ms, 3),
+            "interval_ms": self.interval_ms,
+            "sample_count": session.sample_count,
+            "collapsed": dict(session.samples.most_common()),
+            "sql_count": len(session.sql),
+            "sql_ms": round(sum(s["duration_ms"] for s in session.sql), 3),
+            "sql": session.sql
+        }
+        with open(self._path(session.request_id), "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+
+        # Bounded ring: drop the oldest profiles beyond max_profiles
+        files = [os.path.join(self.profile_dir, n) for n in os.listdir(self.profile_dir) if n.endswith(".json")]
+        if len(files) > self.max_profiles:
+            files.sort(key=os.path.getmtime)
+            for stale in files[:len(files) - self.max_profiles]:
+                try:
+                    os.remove(stale)
+                except OSError:
+                    pass
+
+    def list_profiles(self) -> List[Dict]:
+        if not os.path.isdir(self.profile_dir):
+            return []
+        summaries = []
+        for name in os.listdir(self.profile_dir):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.profile_dir, name), "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            summaries.append({k: data.get(k) for k in
+                              ("request_id", "method", "path", "route", "status", "started_at", "duration_ms", "sample_count", "sql_count", "sql_ms")})
+        summaries.sort(key=lambda d: d.get("started_at") or 0, reverse=True)
+        return summaries
+
+    def load(self, request_id: str) -> Optional[Dict]:
+        path = self._path(request_id)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    @staticmethod
+    def to_collapsed(profile: Dict) -> str:
+        """Brendan Gregg's collapsed format: `frame;frame;frame count` per line (flamegraph.pl, speedscope)."""
+        return "\n".join(f"{stack} {count}" for stack, count in profile.get("collapsed", {}).items()) + "\n"
+
+    @staticmethod
+    def to_speedscope(profile: Dict) -> Dict:
+        frames, index = [], {}
+        samples, weights = [], []
+        interval = profile.get("interval_ms", 5.0)
+        for stack, count in profile.get("collapsed", {}).items():
+            ids = []
+            for name in stack.split(";"):
+                if name not in index:
+                    index[name] = len(frames)
+                    frames.append({"name": name})
+                ids.append(index[name])
+            samples.append(ids)
+            weights.append(count * interval)
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": f"{profile.get('method')} {profile.get('path')} ({profile.get('request_id')})",
+            "exporter": "n1-quiz request profiler",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": profile.get("route") or profile.get("path"),
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": samples,
+                "weights": weights
+            }]
+        }
+
+def activate(session: Optional[ProfileSession]):
+    return _current_profile.set(session)
+
+def deactivate(token):
+    _current_profile.reset(token)
+
+def instrument_engine(engine, profiler: RequestProfiler):
+    """Records the SQL text and duration of every statement run on behalf of a profiled request."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        if _current_profile.get() is not None:
+            conn.info.setdefault("profiler_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        if _current_profile.get() is None:
+            return
+        starts = conn.info.get("profiler_query_start")
+        if starts:
+            profiler.record_sql(statement, (time.perf_counter() - starts.pop()) * 1000)
@@ -0,0 +1,299 @@
+"""
+Compact, versioned binary snapshot of the question bank (backend/json_questions/{n1,databricks},
+legacy .json and append-only .jsonl topic files, see topic_store).
+
+The topic files stay the editable source; the snapshot is derived from them and rebuilt
+incrementally (files whose size and mtime did not change are copied over as raw bytes,
+without being parsed). Readers memory-map it:
+
+    snap = QuestionBankSnapshot.open("backend/question_bank.snap")
+    questions = snap.load_all()      # the whole bank with one json.loads
+    snap.record(i), snap.find(hash)  # random access through the offset table
+    snap.column("knowledge_point")   # per-record columns without touching the records
+
+Layout (little-endian):
+    header   8s magic, u32 version, u32 record count, u64 offsets offset, u64 index offset, u64 index length
+    records  one compact JSON array: "[" rec0 "," rec1 ... "]"
+    offsets  (count + 1) u64 record start offsets; record i ends one byte before offset i + 1
+    index    compact JSON: {"files": {relpath: {mtime_ns, size, exam_type, start, count}},
+                            "columns": {"hash": [...], "knowledge_point": [...], "exam_type": [...]}}
+
+    python -m backend.services.question_bank build|info [--json-dir DIR] [--out PATH]
+"""
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+from typing import Dict, List, Optional, Tuple
+
+MAGIC = b"N1QBSNAP"
+VERSION = 1
+HEADER = struct.Struct("<8sIIQQQ")
+MODES = ("n1", "databricks")
+COLUMNS = ("hash", "knowledge_point", "exam_type")
+# Source-format aliases; records only keep the normalized fields
+ALIASES = ("question", "answer", "option_a", "option_b", "option_c", "option_d")
+
+def question_hash(content, options) -> str:
+    unique_string = f"{content}-{json.dumps(options, sort_keys=True)}"
+    return hashlib.sha256(unique_string.encode()).hexdigest()
+
+def normalize_question(q_data: Dict, default_point: str) -> Tuple[Optional[Dict], bool]:
+    """
+    Normalizes one JSON entry in place, as ingestion always has: flat option_a..d,
+    question/answer aliases, knowledge_point backfilled from the file name, hash.
+    Returns (entry or None when required fields are missing, whether the point was backfilled).
+    """
+    if 'options' not in q_data and 'option_a' in q_data:
+        q_data['options'] = {
+            'A': q_data.get('option_a'),
+            'B': q_data.get('option_b'),
+            'C': q_data.get('option_c'),
+            'D': q_data.get('option_d')
+        }
+    if 'question' in q_data and 'content' not in q_data:
+        q_data['content'] = q_data['question']
+    if 'answer' in q_data and 'correct_answer' not in q_data:
+        q_data['correct_answer'] = q_data['answer']
+
+    backfilled = False
+    if not q_data.get('knowledge_point'):
+        q_data['knowledge_point'] = default_point
+        backfilled = True
+
+    if 'content' not in q_data or 'options' not in q_data or 'correct_answer' not in q_data:
+        return None, backfilled
+    if 'hash' not in q_data:
+        q_data['hash'] = question_hash(q_data['content'], q_data['options'])
+    return q_data, backfilled
+
+def _encode(record: Dict) -> bytes:
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+class QuestionBankSnapshot:
+    """Read-only, memory-mapped view of a snapshot file."""
+    def __init__(self, path: str, fh, mm, count: int, offsets, records_end: int, index: Dict):
+        self.path = path
+        self._fh = fh
+        self._mm = mm
+        self._offsets = offsets
+        self._records_end = records_end
+        self.count = count
+        self.files: Dict[str, Dict] = index["files"]
+        self._columns: Dict[str, List] = index["columns"]
+        self._by_hash: Optional[Dict[str, int]] = None
+        st = os.fstat(fh.fileno())
+        self.signature = (st.st_mtime_ns, st.st_size)
+
+    @classmethod
+    def open(cls, path: str) -> Optional["QuestionBankSnapshot"]:
+        """Maps the snapshot; None if it is missing, truncated or from another version."""
+        try:
+            fh = open(path, "rb")
+        except OSError:
+            return None
+        try:
+            size = os.fstat(fh.fileno()).st_size
+            if size < HEADER.size:
+                raise ValueError("truncated")
+            mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, count, offsets_at, index_at, index_len = HEADER.unpack_from(mm, 0)
+            if magic != MAGIC or version != VERSION or index_at + index_len > size:
+                mm.close()
+                raise ValueError("not a v%d question bank snapshot" % VERSION)
+            offsets = memoryview(mm)[offsets_at:offsets_at + 8 * (count + 1)].cast("Q")
+            index = json.loads(mm[index_at:index_at + index_len])
+            return cls(path, fh, mm, count, offsets, offsets_at, index)
+        except (ValueError, struct.error, OSError):
+            fh.close()
+            return None
+
+    def close(self):
+        if self._mm is not None:
+            self._offsets.release()
+            self._mm.close()
+            self._fh.close()
+            self._mm = None
+
+    def __len__(self):
+        return self.count
+
+    def raw(self, i: int) -> bytes:
+        return self._mm[self._offsets[i]:self._offsets[i + 1] - 1]
+
+    def record(self, i: int) -> Dict:
+        return json.loads(self.raw(i))
+
+    def load_all(self) -> List[Dict]:
+        return json.loads(self._mm[HEADER.size:self._records_end])
+
+    def column(self, name: str) -> List:
+        return self._columns[name]
+
+    def find(self, q_hash: str) -> Optional[Dict]:
+        if self._by_hash is None:
+            self._by_hash = {h: i for i, h in enumerate(self._columns["hash"])}
+        i = self._by_hash.get(q_hash)
+        return self.record(i) if i is not None else None
+
+    def file_of(self, q_hash: str) -> Optional[str]:
+        """Relative path of the source JSON file holding q_hash."""
+        if self._by_hash is None:
+            self._by_hash = {h: i for i, h in enumerate(self._columns["hash"])}
+        i = self._by_hash.get(q_hash)
+        if i is None:
+            return None
+        for relpath, meta in self.files.items():
+            if meta["start"] <= i < meta["start"] + meta["count"]:
+                return relpath
+        return None
+
+    def records_of(self, relpath: str) -> range:
+        meta = self.files.get(relpath)
+        return range(meta["start"], meta["start"] + meta["count"]) if meta else range(0)
+
+def _scan_sources(json_dir: str) -> Dict[str, Tuple[str, os.stat_result]]:
+    sources = {}
+    for mode in MODES:
+        mode_dir = os.path.join(json_dir, mode)
+        if not os.path.isdir(mode_dir):
+            continue
+        for name in sorted(os.listdir(mode_dir)):
+            if name.endswith((".json", ".jsonl")):
+                path = os.path.join(mode_dir, name)
+                sources[f"{mode}/{name}"] = (mode.upper(), os.stat(path))
+    return sources
+
+def _parse_source(path: str, exam_type: str) -> Tuple[List[Dict], os.stat_result]:
+    """
+    Normalized records of one topic file and the stat they correspond to. Legacy .json files
+    get knowledge points backfilled from the file name written back; .jsonl topic files are
+    append-only, so they are stat'ed before reading (a concurrent append shows up as a change next time).
+    """
+    default_point = os.path.splitext(os.path.basename(path))[0]
+    if path.endswith(".jsonl"):
+        from .topic_store import read_questions
+        st = os.stat(path)
+        data, original_is_dict = read_questions(path), False
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        original_is_dict = isinstance(data, dict)
+        if original_is_dict:
+            data = [data]
+
+    records, file_modified = [], False
+    for q_data in data:
+        entry, backfilled = normalize_question(q_data, default_point)
+        file_modified = file_modified or backfilled
+        if entry is not None:
+            record = {k: v for k, v in entry.items() if k not in ALIASES}
+            record["exam_type"] = exam_type
+            records.append(record)
+    if path.endswith(".json"):
+        if file_modified:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(data[0] if original_is_dict else data, f, indent=2, ensure_ascii=False)
+        st = os.stat(path)
+    return records, st
+
+def build_snapshot(json_dir: str, out_path: str) -> Tuple[QuestionBankSnapshot, List[str]]:
+    """
+    Brings the snapshot at out_path up to date with json_dir. Returns the open snapshot and
+    the relative paths of source files that were (re)parsed; when nothing changed the
+    existing file is returned untouched.
+    """
+    old = QuestionBankSnapshot.open(out_path)
+    sources = _scan_sources(json_dir)
+
+    def unchanged(relpath, st):
+        meta = old.files.get(relpath) if old else None
+        return meta is not None and meta["mtime_ns"] == st.st_mtime_ns and meta["size"] == st.st_size
+
+    if old and set(old.files) == set(sources) and all(unchanged(p, st) for p, (_, st) in sources.items()):
+        return old, []
+
+    chunks, files, changed = [], {}, []
+    columns = {name: [] for name in COLUMNS}
+    for relpath, (exam_type, st) in sources.items():
+        start = len(chunks)
+        if unchanged(relpath, st):
+            for i in old.records_of(relpath):
+                chunks.append(old.raw(i))
+                for name in COLUMNS:
+                    columns[name].append(old.column(name)[i])
+        else:
+            path = os.path.join(json_dir, relpath)
+            try:
+                records, st = _parse_source(path, exam_type)
+            except (OSError, ValueError) as e:
+                print(f"Error loading {path}: {e}")
+                continue
+            changed.append(relpath)
+            for record in records:
+                chunks.append(_encode(record))
+                for name in COLUMNS:
+                    columns[name].append(record.get(name))
+        files[relpath] = {"mtime_ns": st.st_mtime_ns, "size": st.st_size, "exam_type": exam_type,
+                          "start": start, "count": len(chunks) - start}
+    if old:
+        old.close()
+
+    # Records: a JSON array, so load_all is one json.loads over the region
+    body = bytearray(b"[")
+    offsets = []
+    for i, chunk in enumerate(chunks):
+        if i:
+            body += b","
+        offsets.append(HEADER.size + len(body))
+        body += chunk
+    body += b"]"
+    offsets.append(HEADER.size + len(body))  # one past the last record's terminator
+    if not chunks:
+        offsets = [HEADER.size + 1]
+
+    index = json.dumps({"files": files, "columns": columns}, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    offsets_at = HEADER.size + len(body)
+    index_at = offsets_at + 8 * len(offsets)
+    tmp_path = f"{out_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(chunks), offsets_at, index_at, len(index)))
+        f.write(body)
+        f.write(struct.pack(f"<{len(offsets)}Q", *offsets))
+        f.write(index)
+    os.replace(tmp_path, out_path)
+    return QuestionBankSnapshot.open(out_path), changed
+
+def main():
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    parser = argparse.ArgumentParser(description="Build or inspect the question bank snapshot")
+    parser.add_argument("command", choices=["build", "info"])
+    parser.add_argument("--json-dir", default=os.path.join(backend_dir, "json_questions"))
+    parser.add_argument("--out", default=os.getenv("QUESTION_BANK_SNAPSHOT", os.path.join(backend_dir, "question_bank.snap")))
+    args = parser.parse_args()
+
+    if args.command == "build":
+        snap, changed = build_snapshot(args.json_dir, args.out)
+        print(f"{args.out}: {len(snap)} questions from {len(snap.files)} files ({len(changed)} re-parsed)")
+        return
+
+    snap = QuestionBankSnapshot.open(args.out)
+    if snap is None:
+        print(f"No snapshot at {args.out}; run the build command first.")
+        sys.exit(1)
+    by_exam: Dict[str, int] = {}
+    by_point: Dict[str, int] = {}
+    for exam_type, point in zip(snap.column("exam_type"), snap.column("knowledge_point")):
+        by_exam[exam_type] = by_exam.get(exam_type, 0) + 1
+        by_point[point] = by_point.get(point, 0) + 1
+    print(f"{args.out}: {len(snap)} questions, {len(snap.files)} source files, {os.path.getsize(args.out):,} bytes")
+    for exam_type, n in sorted(by_exam.items()):
+        print(f"  {exam_type}: {n}")
+    for point, n in sorted(by_point.items(), key=lambda kv: -kv[1])[:20]:
+        print(f"  {point}: {n}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Tuple
+from sqlalchemy.orm import Session
+from .. import models
+from .metrics import CACHE_REQUESTS
+
+class QuestionCache:
+    """
+    Client-facing question payloads by id. Deletes and edits invalidate only the worker that
+    made them, so `ttl_seconds` bounds how long other workers serve a stale payload (as in
+    ReviewQueue / EligibilityIndex); at most `max_entries` are kept, least recently used
+    evicted first. Loads run outside the lock: one that overlapped `invalidate` / `clear`
+    is returned but not cached.
+    """
+    def __init__(self, max_entries: int = 50000, ttl_seconds: int = 300):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._payloads: "OrderedDict[int, Tuple[float, Dict]]" = OrderedDict()  # id -> (loaded_at, payload)
+        self._generation = 0  # bumped by invalidate / clear
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def serialize(q: models.Question) -> Dict:
+        """Client-facing payload of a question (options decoded)."""
+        options = q.options
+        if isinstance(options, str):
+            try:
+                options = json.loads(options)
+            except Exception:
+                options = {}
+        return {
+            "id": q.id,
+            "content": q.content,
+            "options": options,
+            "correct_answer": q.correct_answer,
+            "explanation": q.explanation,
+            "memorization_tip": q.memorization_tip,
+            "knowledge_point": q.knowledge_point,
+            "exam_type": q.exam_type
+        }
+
+    def get_many(self, db: Session, question_ids: Iterable[int]) -> Dict[int, Dict]:
+        """
+        Returns {question_id: payload} for the ids that exist.
+        Misses are loaded with a single IN query and kept for later calls.
+        """
+        ids = {int(i) for i in question_ids if i is not None}
+        found = {}
+        now = time.monotonic()
+        with self._lock:
+            for i in ids:
+                entry = self._payloads.get(i)
+                if entry and now - entry[0] < self.ttl_seconds:
+                    self._payloads.move_to_end(i)
+                    found[i] = entry[1]
+            generation = self._generation
+        missing = ids - found.keys()
+        CACHE_REQUESTS.inc(len(found), cache="question", result="hit")
+        CACHE_REQUESTS.inc(len(missing), cache="question", result="miss")
+        if missing:
+            rows = db.query(models.Question).filter(models.Question.id.in_(missing)).all()
+            loaded = {q.id: self.serialize(q) for q in rows}
+            self._store(loaded, generation)
+            found.update(loaded)
+        return found
+
+    def _store(self, loaded: Dict[int, Dict], generation: int):
+        now = time.monotonic()
+        with self._lock:
+            if self._generation != generation:
+                return
+            for qid, payload in loaded.items():
+                self._payloads[qid] = (now, payload)
+                self._payloads.move_to_end(qid)
+            while len(self._payloads) > self.max_entries:
+                self._payloads.popitem(last=False)
+
+    def get_ordered(self, db: Session, question_ids: List[int]) -> List[Dict]:
+        """Same as get_many but keeps the caller's order and drops unknown ids."""
+        payloads = self.get_many(db, question_ids)
+        return [payloads[i] for i in question_ids if i in payloads]
+
+    def warm(self, db: Session, limit: int) -> int:
+        """(Re)loads up to `limit` question payloads (newest first); returns how many are cached."""
+        with self._lock:
+            generation = self._generation
+        rows = db.query(models.Question).order_by(models.Question.id.desc()).limit(min(limit, self.max_entries)).all()
+        # Oldest first, so the newest questions end up most recently used
+        self._store({q.id: self.serialize(q) for q in reversed(rows)}, generation)
+        with self._lock:
+            return len(self._payloads)
+
+    def invalidate(self, question_id: int):
+        with self._lock:
+            self._payloads.pop(question_id, None)
+            self._generation += 1
+
+    def clear(self):
+        with self._lock:
+            self._payloads.clear()
+            self._generation += 1
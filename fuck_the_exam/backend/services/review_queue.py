@@ -0,0 +1,149 @@
+import heapq
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy.orm import Session
+from .. import models
+from .metrics import CACHE_REQUESTS
+
+class _DueHeap:
+    """
+    Min-heap of (next_review_at, question_id) for one user and exam type.
+    Updates push a new entry; superseded entries are skipped lazily via `current`.
+    """
+    def __init__(self, entries: List[Tuple[datetime, int]]):
+        self.heap = list(entries)
+        heapq.heapify(self.heap)
+        self.current: Dict[int, datetime] = {qid: at for at, qid in entries}
+        self.built_at = time.monotonic()
+
+    def is_live(self, entry) -> bool:
+        return self.current.get(entry[1]) == entry[0]
+
+    def push(self, question_id: int, next_review_at: datetime):
+        if self.current.get(question_id) == next_review_at:
+            return
+        self.current[question_id] = next_review_at
+        heapq.heappush(self.heap, (next_review_at, question_id))
+        # Compact once stale entries dominate
+        if len(self.heap) > 2 * len(self.current) + 64:
+            self.heap = [(at, qid) for qid, at in self.current.items()]
+            heapq.heapify(self.heap)
+
+    def discard(self, question_id: int):
+        self.current.pop(question_id, None)
+
+    def pop_due(self, now: datetime, limit: int) -> List[int]:
+        """Next `limit` due question ids, earliest first. O(k log n)."""
+        taken = []
+        while self.heap and len(taken) < limit and self.heap[0][0] <= now:
+            entry = heapq.heappop(self.heap)
+            if self.is_live(entry):
+                taken.append(entry)
+        for entry in taken:
+            heapq.heappush(self.heap, entry)
+        return [qid for _, qid in taken]
+
+    def count_due(self, now: datetime) -> int:
+        """Walks only the heap nodes that are due (children of a future node are future too)."""
+        count = 0
+        stack = [0] if self.heap else []
+        while stack:
+            i = stack.pop()
+            entry = self.heap[i]
+            if entry[0] > now:
+                continue
+            if self.is_live(entry):
+                count += 1
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < len(self.heap):
+                    stack.append(child)
+        return count
+
+class ReviewQueue:
+    """
+    Warm per-(user, exam_type) due-review heaps, built lazily from wrong_questions
+    and kept in step by `update` on every SRS change. An LRU bounds the number of
+    users held in memory; `ttl_seconds` bounds staleness from writes made elsewhere
+    (scripts, other processes).
+
+    Heaps load outside the lock, so `update` / `clear` count the writes that land on a key
+    while it is loading; a load that overlapped one is served once but not cached (it may
+    predate the write), and the check and the swap happen under the same lock.
+    """
+    def __init__(self, max_users: int = 256, ttl_seconds: int = 300):
+        self.max_users = max_users
+        self.ttl_seconds = ttl_seconds
+        self._heaps: "OrderedDict[Tuple[int, str], _DueHeap]" = OrderedDict()
+        self._loading: Dict[Tuple[int, str], int] = {}  # key -> loads in flight
+        self._writes: Dict[Tuple[int, str], int] = {}  # key -> writes seen while loading
+        self._lock = threading.Lock()
+
+    def _load(self, db: Session, user_id: int, exam_type: str) -> _DueHeap:
+        rows = db.query(models.WrongQuestion.next_review_at, models.WrongQuestion.question_id)\
+            .join(models.Question, models.Question.id == models.WrongQuestion.question_id)\
+            .filter(models.WrongQuestion.user_id == user_id, models.Question.exam_type == exam_type)\
+            .all()
+        return _DueHeap([(at.replace(tzinfo=None) if at else datetime.min, qid) for at, qid in rows])
+
+    def _get(self, db: Session, user_id: int, exam_type: str) -> _DueHeap:
+        key = (user_id, exam_type)
+        with self._lock:
+            heap = self._heaps.get(key)
+            if heap and time.monotonic() - heap.built_at < self.ttl_seconds:
+                self._heaps.move_to_end(key)
+                CACHE_REQUESTS.inc(cache="review_queue", result="hit")
+                return heap
+            self._loading[key] = self._loading.get(key, 0) + 1
+            writes = self._writes.get(key, 0)
+        CACHE_REQUESTS.inc(cache="review_queue", result="miss")
+
+        heap = None
+        try:
+            heap = self._load(db, user_id, exam_type)
+        finally:
+            with self._lock:
+                fresh = self._writes.get(key, 0) == writes
+                self._loading[key] -= 1
+                if not self._loading[key]:
+                    del self._loading[key]
+                    self._writes.pop(key, None)
+                if heap is not None and fresh:
+                    self._heaps[key] = heap
+                    self._heaps.move_to_end(key)
+                    while len(self._heaps) > self.max_users:
+                        self._heaps.popitem(last=False)
+        return heap
+
+    def due(self, db: Session, user_id: int, exam_type: str, now: datetime, limit: int) -> List[int]:
+        heap = self._get(db, user_id, exam_type)
+        with self._lock:
+            return heap.pop_due(now, limit)
+
+    def due_count(self, db: Session, user_id: int, exam_type: str, now: datetime) -> int:
+        heap = self._get(db, user_id, exam_type)
+        with self._lock:
+            return heap.count_due(now)
+
+    def update(self, user_id: int, exam_type: str, question_id: int, next_review_at: Optional[datetime]):
+        """Records an SRS change. Users that are not warm are left to the next lazy build."""
+        key = (user_id, exam_type)
+        with self._lock:
+            if key in self._loading:
+                self._writes[key] = self._writes.get(key, 0) + 1
+            heap = self._heaps.get(key)
+            if heap is None:
+                return
+            if next_review_at is None:
+                heap.discard(question_id)
+            else:
+                heap.push(question_id, next_review_at.replace(tzinfo=None))
+
+    def clear(self):
+        """Drops all warm heaps (bulk changes such as rescheduling, restores or deletions)."""
+        with self._lock:
+            self._heaps.clear()
+            for key in self._loading:
+                self._writes[key] = self._writes.get(key, 0) + 1
@@ -0,0 +1,319 @@
+"""
+In-process scheduler for the leader's maintenance jobs (backups, compaction, calibration,
+autogen, ...). Each job has an interval or cron trigger and optional jitter; a job that is
+still running when it comes due again is skipped rather than started twice. Jobs run on a
+small thread pool so a long one (autogen) does not hold up the others.
+
+Last-run state is persisted to `state_path` (JSON), so after a restart or a leader handover
+an hourly job runs when its hour is up, not immediately, and a cron run missed while no
+leader was up is caught up once.
+
+    scheduler = JobScheduler("backend/scheduler_state.json")
+    scheduler.add_job("topic_compaction", topic_store.compact_pending, IntervalTrigger(60))
+    scheduler.add_job("sqlite_maintenance", optimize_db, CronTrigger("30 3 * * *"))
+    scheduler.start()
+"""
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Set
+
+from .metrics import SCHEDULER_JOB_DURATION, SCHEDULER_JOB_RUNS
+
+STATE_VERSION = 1
+MAX_IDLE_WAIT = 60.0  # the loop re-checks at least this often
+
+class IntervalTrigger:
+    """Every `seconds`, measured from the previous start; the first run `initial_delay` after startup."""
+    def __init__(self, seconds: float, initial_delay: float = 0.0):
+        if seconds <= 0:
+            raise ValueError("interval must be positive")
+        self.seconds = seconds
+        self.initial_delay = initial_delay
+
+    def next_run(self, last_started: Optional[float], now: float) -> float:
+        if last_started is None:
+            return now + self.initial_delay
+        return max(last_started + self.seconds, now)
+
+    def describe(self) -> str:
+        return f"every {self.seconds:g}s"
+
+def _cron_field(spec: str, low: int, high: int) -> Set[int]:
+    """One cron field: '*', '*/15', '1-5', '0,30', '10-50/10'."""
+    values = set()
+    for part in spec.split(","):
+        body, _, step = part.partition("/")
+        step = int(step) if step else 1
+        if body == "*":
+            start, end = low, high
+        elif "-" in body:
+            start, end = (int(v) for v in body.split("-", 1))
+        else:
+            start = int(body)
+            end = high if step > 1 else start
+        if start < low or end > high or start > end or step < 1:
+            raise ValueError(f"cron field '{spec}' out of range {low}-{high}")
+        values.update(range(start, end + 1, step))
+    return values
+
+class CronTrigger:
+    """
+    Five-field cron expression (minute hour day-of-month month day-of-week, local time; Sunday
+    is 0 or 7). As in cron, when both day fields are restricted either one matching is enough.
+    """
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"cron expression needs 5 fields: '{expression}'")
+        self.expression = expression
+        self.minutes = _cron_field(fields[0], 0, 59)
+        self.hours = _cron_field(fields[1], 0, 23)
+        self.days = _cron_field(fields[2], 1, 31)
+        self.months = _cron_field(fields[3], 1, 12)
+        self.weekdays = {d % 7 for d in _cron_field(fields[4], 0, 7)}
+        self._any_day = fields[2] == "*"
+        self._any_weekday = fields[4] == "*"
+
+    def _day_matches(self, dt: datetime) -> bool:
+        in_month = dt.day in self.days
+        in_week = (dt.weekday() + 1) % 7 in self.weekdays
+        if self._any_day or self._any_weekday:
+            return in_month and in_week
+        return in_month or in_week
+
+    def next_after(self, t: float) -> float:
+        """The first matching minute strictly after timestamp t."""
+        dt = datetime.fromtimestamp(t).replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = dt + timedelta(days=366 * 5)
+        while dt < limit:
+            if dt.month not in self.months:
+                dt = (dt.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(dt):
+                dt = dt.replace(hour=0, minute=0) + timedelta(days=1)
+            elif dt.hour not in self.hours:
+                dt = dt.replace(minute=0) + timedelta(hours=1)
+            elif dt.minute not in self.minutes:
+                dt += timedelta(minutes=1)
+            else:
+                return dt.timestamp()
+        raise ValueError(f"cron expression '{self.expression}' never matches")
+
+    def next_run(self, last_started: Optional[float], now: float) -> float:
+        if last_started is None:
+            return self.next_after(now)
+        # A run missed while no scheduler was up is made up once, right away
+        return max(self.next_after(last_started), now)
+
+    def describe(self) -> str:
+        return f"cron '{self.expression}'"
+
+class _Job:
+    __slots__ = ("name", "fn", "trigger", "jitter", "next_run", "running", "rerun", "state")
+
+    def __init__(self, name: str, fn: Callable[[], object], trigger, jitter: float, state: Dict):
+        self.name = name
+        self.fn = fn
+        self.trigger = trigger
+        self.jitter = jitter
+        self.next_run: Optional[float] = None
+        self.running = False
+        self.rerun = False  # run_soon() while running: go again right after
+        self.state = state
+
+class JobScheduler:
+    def __init__(self, state_path: str, max_workers: int = 4):
+        self.state_path = state_path
+        self.max_workers = max_workers
+        self._jobs: Dict[str, _Job] = {}
+        self._saved = self._load_state()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._futures = set()
+        self._stopping = False
+        self._save_lock = threading.Lock()
+
+    # --- Registration ---
+    def add_job(self, name: str, fn: Callable[[], object], trigger, jitter: float = 0.0):
+        """Registers (or replaces) a job; `jitter` seconds of random delay are added to each scheduled run."""
+        job = _Job(name, fn, trigger, jitter, self._saved_state(name))
+        with self._cond:
+            self._jobs[name] = job
+            if self._thread is not None:
+                self._schedule(job, time.time())
+                self._cond.notify()
+
+    def _saved_state(self, name: str) -> Dict:
+        state = dict(self._saved.get(name, {}))
+        state.setdefault("runs", 0)
+        state.setdefault("failures", 0)
+        state.setdefault("skipped", 0)
+        return state
+
+    def _schedule(self, job: _Job, now: float, last_started: Optional[float] = None):
+        job.next_run = job.trigger.next_run(last_started or job.state.get("last_started"), now)
+        if job.jitter > 0:
+            job.next_run += random.uniform(0, job.jitter)
+
+    # --- Lifecycle ---
+    def start(self):
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._stopping = False
+            # Another worker may have been running these jobs since this one was built
+            # (leadership moved here): schedule from the state it last saved
+            self._saved = self._load_state()
+            now = time.time()
+            for job in self._jobs.values():
+                job.state = self._saved_state(job.name)
+                self._schedule(job, now)
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="scheduler-job")
+            self._thread = threading.Thread(target=self._run, daemon=True, name="scheduler")
+            self._thread.start()
+        print(f"Scheduler: started with {len(self._jobs)} jobs.")
+
+    def stop(self, timeout: float = 10.0):
+        """Stops scheduling and waits up to `timeout` seconds for running jobs to finish."""
+        with self._cond:
+            if self._thread is None:
+                return
+            self._stopping = True
+            thread, executor = self._thread, self._executor
+            self._cond.notify()
+        thread.join()
+        with self._cond:
+            futures = list(self._futures)
+        if futures:
+            wait_futures(futures, timeout=timeout)
+        executor.shutdown(wait=False)
+        with self._cond:
+            self._thread = self._executor = None
+            for job in self._jobs.values():
+                job.next_run = None
+        print("Scheduler: stopped.")
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._stopping:
+                    return
+                now = time.time()
+                for job in self._jobs.values():
+                    if job.next_run is not None and job.next_run <= now:
+                        self._dispatch(job, now)
+                upcoming = [j.next_run for j in self._jobs.values() if j.next_run is not None]
+                delay = min(upcoming, default=now + MAX_IDLE_WAIT) - now
+                self._cond.wait(min(max(delay, 0.0), MAX_IDLE_WAIT))
+
+    def _dispatch(self, job: _Job, now: float):
+        """Called with the lock held: starts the job on the pool, or skips it if it is still running."""
+        if job.running:
+            job.state["skipped"] += 1
+            SCHEDULER_JOB_RUNS.inc(job=job.name, outcome="skipped")
+            print(f"Scheduler: '{job.name}' is still running, skipping this run.")
+            self._schedule(job, now, last_started=now)
+            return
+        job.running = True
+        job.state["last_started"] = now
+        self._schedule(job, now)
+        future = self._executor.submit(self._execute, job)
+        self._futures.add(future)
+        future.add_done_callback(self._futures.discard)
+
+    def _execute(self, job: _Job):
+        started = time.perf_counter()
+        outcome, error = "ok", None
+        try:
+            job.fn()
+        except Exception as e:
+            outcome, error = "error", str(e)
+            print(f"Scheduler: job '{job.name}' failed: {e}")
+        duration = time.perf_counter() - started
+        SCHEDULER_JOB_DURATION.observe(duration, job=job.name, outcome=outcome)
+        SCHEDULER_JOB_RUNS.inc(job=job.name, outcome=outcome)
+        with self._cond:
+            job.running = False
+            job.state.update(last_finished=time.time(), last_duration=round(duration, 4),
+                             last_outcome=outcome, last_error=error)
+            job.state["runs"] += 1
+            if error:
+                job.state["failures"] += 1
+            if job.rerun and self._thread is not None:
+                job.rerun = False
+                job.next_run = time.time()
+            self._cond.notify()
+        self._save_state()
+
+    # --- Triggering by hand ---
+    def run_soon(self, name: str) -> bool:
+        """Asks for a run as soon as possible (coalesced: one follow-up run if it is running). False if not scheduling."""
+        with self._cond:
+            job = self._jobs.get(name)
+            if job is None or self._thread is None:
+                return False
+            if job.running:
+                job.rerun = True
+            else:
+                job.next_run = time.time()
+                self._cond.notify()
+            return True
+
+    def run_now(self, name: str) -> Optional[Dict]:
+        """
+        Runs the job in the calling thread and returns its state; None if it is already running.
+        Raises KeyError for an unknown job.
+        """
+        with self._cond:
+            job = self._jobs[name]
+            if job.running:
+                return None
+            job.running = True
+            job.state["last_started"] = time.time()
+        self._execute(job)
+        return self.job_status(name)
+
+    # --- Status and persistence ---
+    def job_status(self, name: str) -> Dict:
+        with self._cond:
+            job = self._jobs[name]
+            return {"name": job.name, "trigger": job.trigger.describe(), "jitter": job.jitter,
+                    "running": job.running, "next_run": job.next_run, **job.state}
+
+    def status(self) -> List[Dict]:
+        with self._cond:
+            names = sorted(self._jobs)
+        return [self.job_status(name) for name in names]
+
+    def _load_state(self) -> Dict[str, Dict]:
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if saved.get("version") != STATE_VERSION:
+            return {}
+        return saved.get("jobs", {})
+
+    def _save_state(self):
+        with self._cond:
+            jobs = dict(self._saved)
+            jobs.update({name: dict(job.state) for name, job in self._jobs.items()})
+        tmp = f"{self.state_path}.{os.getpid()}.tmp"
+        with self._save_lock:
+            try:
+                os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump({"version": STATE_VERSION, "jobs": jobs}, f, indent=2, sort_keys=True)
+                os.replace(tmp, self.state_path)
+            except OSError as e:
+                print(f"Scheduler: could not save state: {e}")
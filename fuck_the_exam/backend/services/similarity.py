@@ -0,0 +1,265 @@
+import json
+import math
+import os
+import threading
+import time
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from .. import models
+
+TABLE_VERSION = 3
+SAMPLE_QUESTIONS = 3  # question stems used as text for points without a 语法.md row
+
+def suggestion_entries(entries: List[Dict], db_points: Set[str], exam_type: str) -> List[Dict]:
+    """The knowledge points /api/suggestions offers, out of get_all_knowledge_points entries."""
+    filtered = []
+    for p in entries:
+        # If it has questions in DB, definitely keep it
+        if p['point'] in db_points:
+            filtered.append(p)
+        # If it's N1 and from MD, keep it (allows user to see topics to generate)
+        elif exam_type == "N1" and p.get('source_file', '').endswith('.md'):
+            filtered.append(p)
+    return filtered
+
+def _ngrams(text: str, sizes=(2, 3)) -> Counter:
+    text = "".join(text.split())
+    grams = Counter()
+    for n in sizes:
+        grams.update(text[i:i + n] for i in range(len(text) - n + 1))
+    return grams
+
+def _normalize_rows(m: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(m, axis=1, keepdims=True)
+    return np.divide(m, norms, out=np.zeros_like(m), where=norms > 0)
+
+def text_similarity(documents: List[str], max_df: float = 0.5) -> np.ndarray:
+    """
+    Cosine similarity of character 2/3-gram TF-IDF vectors. Only n-grams shared by at least two
+    documents can contribute, so the dense matrix is built over those alone; n-grams in more
+    than max_df of the documents (particles, 〜) are dropped as well.
+    """
+    grams = [_ngrams(d) for d in documents]
+    df = Counter(g for doc in grams for g in doc)
+    n = len(documents)
+    vocab = {g: i for i, g in enumerate(g for g, c in df.items() if 2 <= c <= max(2, max_df * n))}
+    if not vocab or n < 2:
+        return np.zeros((n, n), dtype=np.float32)
+    idf = np.zeros(len(vocab), dtype=np.float32)
+    for g, i in vocab.items():
+        idf[i] = math.log((1 + n) / (1 + df[g])) + 1
+    m = np.zeros((n, len(vocab)), dtype=np.float32)
+    for row, doc in enumerate(grams):
+        for g, count in doc.items():
+            col = vocab.get(g)
+            if col is not None:
+                m[row, col] = (1 + math.log(count)) * idf[col]
+    m = _normalize_rows(m)
+    return m @ m.T
+
+class PointNeighbors:
+    """
+    Related knowledge points: a precomputed top-k neighbor table per exam type, blending
+
+      text      character n-gram TF-IDF over point names plus the 语法.md row (meaning,
+                collocations, pitfalls, example sentence), or sample question stems
+      co_error  cosine between points' per-user wrong-answer counts (log-scaled)
+
+    as `text_weight * text + (1 - text_weight) * co_error`. A full build scans attempts; when
+    only new points appear, `update` reuses the co-error matrix (new points have no attempts
+    yet) and recomputes the text side, which is cheap at a few hundred points; a full build runs
+    again every `full_rebuild_hours`. The table is persisted as JSON so every worker serves it
+    with a dict lookup; it also carries the parsed knowledge-point entries and the
+    /api/suggestions list per exam type, which change on the same events (points added,
+    knowledge base edits picked up by the daily build), so no request re-parses 语法.md.
+    """
+    def __init__(self, knowledge_service, path: str, k: int = 10, text_weight: float = 0.6,
+                 full_rebuild_hours: float = 24.0):
+        self.knowledge_service = knowledge_service
+        self.path = path
+        self.k = k
+        self.text_weight = text_weight
+        self.full_rebuild_hours = full_rebuild_hours
+        self._table: Optional[Dict] = None
+        self._table_mtime = None
+        self._co_error: Dict[str, Dict] = {}  # exam_type -> {"points": [...], "matrix": ndarray}
+        self._lock = threading.Lock()
+
+    # --- Building ---
+    def _documents(self, db: Session, exam_type: str, entries: List[Dict]) -> Tuple[Dict[str, str], Set[str]]:
+        """Text per point, and the points that have questions in the DB."""
+        docs: Dict[str, str] = {}
+        for p in entries:
+            if p.get("source_file", "").endswith(".md"):
+                docs[p["point"]] = " ".join(str(v) for k, v in p.items() if k != "source_file")
+        samples: Dict[str, List[str]] = {}
+        db_points: Set[str] = set()
+        for point, content in db.query(models.Question.knowledge_point, models.Question.content)\
+                .filter(models.Question.exam_type == exam_type, models.Question.knowledge_point != None)\
+                .order_by(models.Question.id):
+            db_points.add(point)
+            if point in docs:
+                continue
+            stems = samples.setdefault(point, [])
+            if len(stems) < SAMPLE_QUESTIONS:
+                stems.append(content)
+        for point, stems in samples.items():
+            docs[point] = point + " " + " ".join(stems)
+        return docs, db_points
+
+    def _load_co_error(self, db: Session, exam_type: str) -> Dict:
+        rows = db.query(models.AnswerAttempt.user_id, models.Question.knowledge_point, func.count(models.AnswerAttempt.id))\
+            .join(models.Question, models.Question.id == models.AnswerAttempt.question_id)\
+            .filter(models.AnswerAttempt.is_correct == 0, models.Question.exam_type == exam_type,
+                    models.Question.knowledge_point != None)\
+            .group_by(models.AnswerAttempt.user_id, models.Question.knowledge_point).all()
+        users = {u: i for i, u in enumerate(sorted({u or 1 for u, _, _ in rows}))}
+        points = sorted({p for _, p, _ in rows})
+        codes = {p: i for i, p in enumerate(points)}
+        counts = np.zeros((len(points), len(users)), dtype=np.float32)
+        for user_id, point, n in rows:
+            counts[codes[point], users[user_id or 1]] += n
+        m = _normalize_rows(np.log1p(counts))
+        return {"points": points, "matrix": m @ m.T}
+
+    def _co_error_for(self, points: List[str], co: Dict) -> np.ndarray:
+        """The cached co-error matrix re-indexed to `points` (zeros for points it has not seen)."""
+        index = {p: i for i, p in enumerate(co["points"])}
+        rows = np.array([index.get(p, -1) for p in points], dtype=np.int64)
+        known = rows >= 0
+        out = np.zeros((len(points), len(points)), dtype=np.float32)
+        out[np.ix_(known, known)] = co["matrix"][np.ix_(rows[known], rows[known])]
+        return out
+
+    def _neighbors(self, points: List[str], score: np.ndarray) -> Dict[str, List]:
+        np.fill_diagonal(score, -np.inf)
+        k = min(self.k, max(len(points) - 1, 0))
+        table = {}
+        if k == 0:
+            return {p: [] for p in points}
+        top = np.argpartition(-score, k - 1, axis=1)[:, :k]
+        for row, point in enumerate(points):
+            cols = top[row][np.argsort(-score[row, top[row]])]
+            table[point] = [[points[c], round(float(score[row, c]), 4)] for c in cols if score[row, c] > 0]
+        return table
+
+    def build(self, db: Session, exam_types: Iterable[str] = ("N1", "DATABRICKS"), full: bool = True) -> Dict:
+        """Rebuilds the table; full=False reuses cached co-error matrices where available."""
+        started = time.perf_counter()
+        previous = self._get_table()
+        now = time.time()
+        table = {"version": TABLE_VERSION, "built_at": now, "exam_types": {},
+                 "full_built_at": now if full or previous is None else previous.get("full_built_at", now)}
+        for exam_type in exam_types:
+            entries = self.knowledge_service.get_all_knowledge_points(exam_type=exam_type)
+            docs, db_points = self._documents(db, exam_type, entries)
+            points = sorted(docs)
+            if full or exam_type not in self._co_error:
+                self._co_error[exam_type] = self._load_co_error(db, exam_type)
+            text = text_similarity([docs[p] for p in points])
+            co = self._co_error_for(points, self._co_error[exam_type])
+            score = self.text_weight * text + (1 - self.text_weight) * co
+            table["exam_types"][exam_type] = {"points": points, "neighbors": self._neighbors(points, score),
+                                              "entries": {p["point"]: p for p in entries},
+                                              "suggestions": suggestion_entries(entries, db_points, exam_type)}
+        table["seconds"] = round(time.perf_counter() - started, 3)
+        self._save(table)
+        return {"exam_types": {e: len(t["points"]) for e, t in table["exam_types"].items()},
+                "full": full, "seconds": table["seconds"]}
+
+    def update(self, db: Session) -> Optional[Dict]:
+        """
+        Leader tick: a full build when there is no table or it is older than full_rebuild_hours
+        (fresh co-error statistics), an incremental one when points were added.
+        """
+        table = self._get_table()
+        if table is None or time.time() - table.get("full_built_at", 0) > self.full_rebuild_hours * 3600:
+            return self.build(db, full=True)
+        exam_types = list(table["exam_types"])
+        for exam_type in exam_types:
+            known = set(table["exam_types"][exam_type]["points"])
+            current = {p for (p,) in db.query(models.Question.knowledge_point).filter(
+                models.Question.exam_type == exam_type, models.Question.knowledge_point != None).distinct()}
+            if current - known:
+                return self.build(db, exam_types, full=False)
+        return None
+
+    # --- Persistence ---
+    def _save(self, table: Dict):
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(table, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, self.path)
+        with self._lock:
+            self._table = table
+            self._table_mtime = os.stat(self.path).st_mtime_ns
+
+    def _get_table(self) -> Optional[Dict]:
+        """The persisted table, re-read when another worker replaced the file."""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+        with self._lock:
+            if self._table is not None and self._table_mtime == mtime:
+                return self._table
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                table = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if table.get("version") != TABLE_VERSION:
+            return None
+        with self._lock:
+            self._table, self._table_mtime = table, mtime
+        return table
+
+    # --- Lookups ---
+    def neighbors(self, point: str, exam_type: str = "N1") -> List[Dict]:
+        table = self._get_table()
+        entry = (table or {}).get("exam_types", {}).get(exam_type)
+        if not entry:
+            return []
+        return [{"point": p, "score": s} for p, s in entry["neighbors"].get(point, [])]
+
+    def suggestions(self, exam_type: str = "N1") -> Optional[List[Dict]]:
+        """The precomputed /api/suggestions list; None until the table has been built."""
+        entry = (self._get_table() or {}).get("exam_types", {}).get(exam_type)
+        return entry["suggestions"] if entry else None
+
+    def entries(self, exam_type: str = "N1") -> Dict[str, Dict]:
+        """{point: parsed knowledge-point entry} as of the last build ({} before the first one)."""
+        entry = (self._get_table() or {}).get("exam_types", {}).get(exam_type)
+        return entry["entries"] if entry else {}
+
+    def related(self, weighted_points: Dict[str, float], exam_type: str = "N1", limit: int = 5) -> List[Dict]:
+        """
+        Points related to the given ones ({point: weight}, e.g. wrong-answer counts): neighbor
+        scores summed with those weights, excluding the input points themselves.
+        """
+        table = self._get_table()
+        entry = (table or {}).get("exam_types", {}).get(exam_type)
+        if not entry:
+            return []
+        scores: Dict[str, float] = {}
+        because: Dict[str, List[str]] = {}
+        for source, weight in weighted_points.items():
+            for point, score in entry["neighbors"].get(source, []):
+                if point in weighted_points:
+                    continue
+                scores[point] = scores.get(point, 0.0) + weight * score
+                because.setdefault(point, []).append(source)
+        ranked = sorted(scores.items(), key=lambda kv: -kv[1])[:limit]
+        return [{"point": p, "score": round(s, 4), "related_to": because[p]} for p, s in ranked]
+
+    def status(self) -> Dict:
+        table = self._get_table()
+        if table is None:
+            return {"built": False}
+        return {"built": True, "built_at": table["built_at"], "full_built_at": table.get("full_built_at"),
+                "seconds": table.get("seconds"),
+                "exam_types": {e: len(t["points"]) for e, t in table["exam_types"].items()}}
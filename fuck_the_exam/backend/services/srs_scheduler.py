@@ -0,0 +1,350 @@
+import json
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+MICROS_PER_DAY = 86400 * 1000000
+MICROS_PER_HOUR = 3600 * 1000000
+
+def utc_to_local_micros(ts: np.ndarray) -> np.ndarray:
+    """
+    Naive-UTC epoch microseconds (attempted_at) as naive server-local ones, the frame the
+    submit paths compute next_review_at in. The offset is looked up once per distinct hour.
+    """
+    hours, inverse = np.unique(ts // MICROS_PER_HOUR, return_inverse=True)
+    offsets = np.array([datetime.fromtimestamp(int(h) * 3600, timezone.utc).astimezone().utcoffset().total_seconds()
+                        for h in hours], dtype=np.int64) * 1000000
+    return ts + offsets[inverse]
+
+def quality_from_correct(is_correct) -> int:
+    """Binary answers map to SM-2 quality 4 (Good) / 1 (Forgot), same as the submit endpoint."""
+    return 4 if is_correct else 1
+
+class Scheduler:
+    """
+    Common interface for spaced-repetition algorithms.
+
+    State is what the wrong_questions table can hold: an integer `interval` in days
+    and an integer `ease_factor` (each algorithm decides what it encodes there).
+    `review` updates one item, `review_bulk` applies one review step to many items
+    at once with NumPy arrays; `reschedule_all` replays attempt histories with it.
+    """
+    name = "base"
+
+    def __init__(self, **params):
+        self.params = params
+
+    def first_lapse(self, quality: int) -> Tuple[int, int]:
+        """State for an item entering SRS on its first failed answer."""
+        raise NotImplementedError
+
+    def review(self, interval: int, ease_factor: int, quality: int, elapsed_days: float) -> Tuple[int, int]:
+        """Returns the new (interval, ease_factor) after one review."""
+        raise NotImplementedError
+
+    def review_bulk(self, interval: np.ndarray, ease_factor: np.ndarray, quality: np.ndarray, elapsed_days: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Vectorized `review` over aligned arrays."""
+        raise NotImplementedError
+
+    def first_lapse_bulk(self, quality: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        pairs = [self.first_lapse(int(q)) for q in quality]
+        return (np.array([p[0] for p in pairs], dtype=np.float64),
+                np.array([p[1] for p in pairs], dtype=np.float64))
+
+class SM2Scheduler(Scheduler):
+    """The app's original SM-2 variant (ease stored x100, e.g. 2.5 -> 250)."""
+    name = "sm2"
+
+    def __init__(self, initial_ease: int = 250, min_ease: int = 130, lapse_penalty: int = 20, easy_bonus: float = 1.3,
+                 max_interval: int = 36500):
+        super().__init__(initial_ease=initial_ease, min_ease=min_ease, lapse_penalty=lapse_penalty, easy_bonus=easy_bonus,
+                         max_interval=max_interval)
+        self.initial_ease = initial_ease
+        self.min_ease = min_ease
+        self.lapse_penalty = lapse_penalty
+        self.easy_bonus = easy_bonus
+        # Long correct streaks grow the interval geometrically; cap it before datetime overflows
+        self.max_interval = max_interval
+
+    def first_lapse(self, quality: int) -> Tuple[int, int]:
+        return 1, self.initial_ease
+
+    def review(self, interval, ease_factor, quality, elapsed_days=0.0):
+        if interval is None: interval = 1
+        if ease_factor is None: ease_factor = self.initial_ease
+
+        if quality < 3:
+            return 1, max(self.min_ease, ease_factor - self.lapse_penalty)
+
+        # EF' = EF + (0.1 - (5-q) * (0.08 + (5-q) * 0.02))
+        q = quality
+        ef_change = (0.1 - (5-q) * (0.08 + (5-q) * 0.02)) * 100
+        ease_factor = max(self.min_ease, int(ease_factor + ef_change))
+
+        new_interval = int(interval * (ease_factor / 100.0))
+        if new_interval <= interval: new_interval = interval + 1
+        if q == 5: new_interval = int(new_interval * self.easy_bonus)
+        return min(new_interval, self.max_interval), ease_factor
+
+    def review_bulk(self, interval, ease_factor, quality, elapsed_days):
+        q = quality.astype(np.float64)
+        failed = quality < 3
+
+        ef_change = (0.1 - (5-q) * (0.08 + (5-q) * 0.02)) * 100
+        ok_ease = np.maximum(self.min_ease, np.trunc(ease_factor + ef_change))
+        ok_interval = np.trunc(interval * (ok_ease / 100.0))
+        ok_interval = np.where(ok_interval <= interval, interval + 1, ok_interval)
+        ok_interval = np.where(quality == 5, np.trunc(ok_interval * self.easy_bonus), ok_interval)
+        ok_interval = np.minimum(ok_interval, self.max_interval)
+
+        new_interval = np.where(failed, 1.0, ok_interval)
+        new_ease = np.where(failed, np.maximum(self.min_ease, ease_factor - self.lapse_penalty), ok_ease)
+        return new_interval, new_ease
+
+    def first_lapse_bulk(self, quality):
+        return np.ones(len(quality)), np.full(len(quality), float(self.initial_ease))
+
+# FSRS v4.5 default weights
+FSRS_DEFAULT_WEIGHTS = [0.4, 0.6, 2.4, 5.8, 4.93, 0.94, 0.86, 0.01, 1.49, 0.14, 0.94, 2.18, 0.05, 0.34, 1.26, 0.29, 2.61]
+
+class FSRSScheduler(Scheduler):
+    """
+    FSRS-style scheduler. Stability (days) is kept in `interval`, difficulty (1-10)
+    in `ease_factor` x100. With the default 90% retention the interval equals the stability.
+    """
+    name = "fsrs"
+
+    def __init__(self, weights=None, desired_retention: float = 0.9, max_interval: int = 3650):
+        super().__init__(weights=weights, desired_retention=desired_retention, max_interval=max_interval)
+        self.w = np.array(weights or FSRS_DEFAULT_WEIGHTS, dtype=np.float64)
+        self.desired_retention = desired_retention
+        self.max_interval = max_interval
+
+    @staticmethod
+    def grade(quality):
+        """SM-2 quality (0-5) -> FSRS grade (1 Again, 2 Hard, 3 Good, 4 Easy)."""
+        q = np.asarray(quality)
+        return np.where(q < 3, 1, np.where(q == 3, 2, np.where(q == 4, 3, 4)))
+
+    def _init_difficulty(self, g):
+        return np.clip(self.w[4] - np.exp(self.w[5] * (g - 1)) + 1, 1, 10)
+
+    def _next_interval(self, stability):
+        ivl = 9 * stability * (1 / self.desired_retention - 1)
+        return np.clip(np.round(ivl), 1, self.max_interval)
+
+    def first_lapse(self, quality):
+        interval, ease = self.first_lapse_bulk(np.array([quality]))
+        return int(interval[0]), int(ease[0])
+
+    def first_lapse_bulk(self, quality):
+        g = self.grade(quality)
+        stability = self.w[g - 1]
+        difficulty = self._init_difficulty(g)
+        return self._next_interval(stability), np.round(difficulty * 100)
+
+    def review(self, interval, ease_factor, quality, elapsed_days=0.0):
+        if interval is None: interval = 1
+        if ease_factor is None: ease_factor = 500
+        new_interval, new_ease = self.review_bulk(
+            np.array([interval], dtype=np.float64), np.array([ease_factor], dtype=np.float64),
+            np.array([quality]), np.array([elapsed_days], dtype=np.float64)
+        )
+        return int(new_interval[0]), int(new_ease[0])
+
+    def review_bulk(self, interval, ease_factor, quality, elapsed_days):
+        w = self.w
+        g = self.grade(quality)
+        stability = np.maximum(interval * self.desired_retention / (9 * (1 - self.desired_retention)), 0.1)
+        difficulty = np.clip(ease_factor / 100.0, 1, 10)
+        retrievability = np.power(1 + np.maximum(elapsed_days, 0) / (9 * stability), -1)
+
+        new_d = difficulty - w[6] * (g - 3)
+        new_d = np.clip(w[7] * self._init_difficulty(3) + (1 - w[7]) * new_d, 1, 10)
+
+        hard_penalty = np.where(g == 2, w[15], 1.0)
+        easy_bonus = np.where(g == 4, w[16], 1.0)
+        recall_s = stability * (np.exp(w[8]) * (11 - difficulty) * np.power(stability, -w[9])
+                                * (np.exp(w[10] * (1 - retrievability)) - 1) * hard_penalty * easy_bonus + 1)
+        lapse_s = (w[11] * np.power(difficulty, -w[12]) * (np.power(stability + 1, w[13]) - 1)
+                   * np.exp(w[14] * (1 - retrievability)))
+        new_s = np.where(g == 1, np.minimum(lapse_s, stability), recall_s)
+        return self._next_interval(new_s), np.round(new_d * 100)
+
+SCHEDULERS = {
+    SM2Scheduler.name: SM2Scheduler,
+    FSRSScheduler.name: FSRSScheduler,
+}
+
+def get_scheduler(name: str = "sm2", **params) -> Scheduler:
+    if name not in SCHEDULERS:
+        raise ValueError(f"Unknown SRS algorithm '{name}'. Available: {', '.join(SCHEDULERS)}")
+    return SCHEDULERS[name](**params)
+
+class ActiveScheduler:
+    """
+    The algorithm in srs_settings, shared by every worker and kept across restarts; the
+    `default` (SRS_ALGORITHM) applies until the first reschedule stores one. Callers fetch
+    the scheduler per request: the one-row lookup compares the stored version, so a switch
+    made by any worker takes effect everywhere on the next review.
+    """
+    QUERY = "SELECT version, algorithm, params FROM srs_settings WHERE id = 1"
+
+    def __init__(self, default: Scheduler):
+        self.default = default
+        self._version: Optional[int] = None
+        self._scheduler = default
+        self._lock = threading.Lock()
+
+    def _resolve(self, row) -> Scheduler:
+        if row is None:
+            return self.default
+        version, algorithm, params = row
+        with self._lock:
+            if version != self._version:
+                try:
+                    self._scheduler = get_scheduler(algorithm, **json.loads(params or "{}"))
+                except (ValueError, TypeError) as e:
+                    print(f"SRS: stored algorithm '{algorithm}' is unusable ({e}), using {self.default.name}")
+                    self._scheduler = self.default
+                self._version = version
+            return self._scheduler
+
+    def get(self, db: Session) -> Scheduler:
+        return self._resolve(db.execute(text(self.QUERY)).first())
+
+    async def get_async(self, db: AsyncSession) -> Scheduler:
+        return self._resolve((await db.execute(text(self.QUERY))).first())
+
+    @staticmethod
+    def store(db: Session, scheduler: Scheduler):
+        """Makes `scheduler` the active algorithm, in the caller's transaction (commit it with the rescheduled rows)."""
+        db.execute(text("""
+            INSERT INTO srs_settings (id, algorithm, params, version, updated_at)
+            VALUES (1, :algorithm, :params, 1, CURRENT_TIMESTAMP)
+            ON CONFLICT (id) DO UPDATE SET algorithm = excluded.algorithm, params = excluded.params,
+                version = srs_settings.version + 1, updated_at = excluded.updated_at
+        """), {"algorithm": scheduler.name, "params": json.dumps(scheduler.params, sort_keys=True)})
+
+def reschedule_all(db: Session, scheduler: Scheduler, user_id: Optional[int] = None) -> Dict:
+    """
+    Recomputes interval / ease_factor / review_count / next_review_at for every
+    (user, question) pair from the attempt history.
+
+    Attempts are grouped per pair and replayed step by step; each step is a single
+    vectorized call over all pairs that still have attempts left. An item enters SRS
+    on its first failure (as in the submit endpoint); pairs that never failed keep
+    whatever row they have (e.g. restored from backup). Writes go through a temp
+    table and two set-based statements.
+    """
+    started_at = time.perf_counter()
+    params = {}
+    user_filter = ""
+    if user_id is not None:
+        user_filter = "AND user_id = :user_id"
+        params["user_id"] = user_id
+
+    # Raw DBAPI cursor and a NumPy sort: avoids per-row Result objects and SQLite's temp b-tree
+    cursor = db.connection().connection.cursor()
+    cursor.execute(f"""
+        SELECT user_id, question_id, is_correct, attempted_at
+        FROM answer_attempts
+        WHERE user_id IS NOT NULL AND question_id IS NOT NULL AND attempted_at IS NOT NULL {user_filter}
+    """, params)
+    rows = cursor.fetchall()
+    cursor.close()
+    if not rows:
+        return {"algorithm": scheduler.name, "attempts": 0, "items": 0, "updated": 0, "inserted": 0, "seconds": 0.0}
+
+    user_col, question_col, correct_col, ts_col = zip(*rows)
+    users = np.array(user_col, dtype=np.int64)
+    questions = np.array(question_col, dtype=np.int64)
+    correct = np.array(correct_col, dtype=np.int64)
+    # Exact microsecond timestamps (SQLite stores "YYYY-MM-DD HH:MM:SS[.ffffff]")
+    ts = np.array(ts_col, dtype="datetime64[us]").astype(np.int64)
+
+    order = np.lexsort((ts, questions, users))
+    users, questions, correct, ts = users[order], questions[order], correct[order], ts[order]
+    # Replayed in answer order, but in server-local time: next_review_at is local, as in apply_srs_review
+    ts = utc_to_local_micros(ts)
+    quality = np.where(correct > 0, quality_from_correct(True), quality_from_correct(False))
+
+    # Pair id per attempt and position of the attempt inside its pair
+    new_pair = np.r_[True, (users[1:] != users[:-1]) | (questions[1:] != questions[:-1])]
+    pair_id = np.cumsum(new_pair) - 1
+    pair_start = np.flatnonzero(new_pair)
+    step = np.arange(len(rows)) - pair_start[pair_id]
+    n_pairs = len(pair_start)
+
+    started = np.zeros(n_pairs, dtype=bool)
+    interval = np.zeros(n_pairs)
+    ease = np.zeros(n_pairs)
+    review_count = np.zeros(n_pairs, dtype=np.int64)
+    last_ts = np.zeros(n_pairs, dtype=np.int64)
+
+    by_step = np.argsort(step, kind="stable")
+    bounds = np.r_[0, np.cumsum(np.bincount(step))]
+    for k in range(len(bounds) - 1):
+        idx = by_step[bounds[k]:bounds[k + 1]]
+        p, q, t = pair_id[idx], quality[idx], ts[idx]
+
+        active = started[p]
+        if active.any():
+            pa = p[active]
+            new_i, new_e = scheduler.review_bulk(interval[pa], ease[pa], q[active], (t[active] - last_ts[pa]) / MICROS_PER_DAY)
+            interval[pa], ease[pa] = new_i, new_e
+            review_count[pa] += q[active] < 3
+            last_ts[pa] = t[active]
+
+        entering = ~active & (q < 3)
+        if entering.any():
+            pe = p[entering]
+            interval[pe], ease[pe] = scheduler.first_lapse_bulk(q[entering])
+            review_count[pe] = 1
+            last_ts[pe] = t[entering]
+            started[pe] = True
+
+    sel = np.flatnonzero(started)
+    next_ts = (last_ts[sel] + interval[sel].astype(np.int64) * MICROS_PER_DAY).astype("datetime64[us]")
+    next_str = np.char.replace(np.datetime_as_string(next_ts, unit="us"), "T", " ")
+    out = list(zip(
+        users[pair_start[sel]].tolist(), questions[pair_start[sel]].tolist(),
+        interval[sel].astype(np.int64).tolist(), ease[sel].astype(np.int64).tolist(),
+        review_count[sel].tolist(), next_str.tolist()
+    ))
+
+    conn = db.connection()
+    conn.execute(text("DROP TABLE IF EXISTS temp.srs_reschedule"))
+    conn.execute(text(
+        "CREATE TEMP TABLE srs_reschedule (user_id INTEGER, question_id INTEGER, interval INTEGER, "
+        "ease_factor INTEGER, review_count INTEGER, next_review_at DATETIME, PRIMARY KEY (user_id, question_id))"
+    ))
+    conn.exec_driver_sql("INSERT INTO temp.srs_reschedule VALUES (?, ?, ?, ?, ?, ?)", out)
+    updated = conn.execute(text("""
+        UPDATE wrong_questions SET interval = r.interval, ease_factor = r.ease_factor,
+               review_count = r.review_count, next_review_at = r.next_review_at
+        FROM temp.srs_reschedule AS r
+        WHERE wrong_questions.user_id = r.user_id AND wrong_questions.question_id = r.question_id
+    """)).rowcount
+    inserted = conn.execute(text("""
+        INSERT INTO wrong_questions (user_id, question_id, interval, ease_factor, review_count, next_review_at)
+        SELECT r.user_id, r.question_id, r.interval, r.ease_factor, r.review_count, r.next_review_at
+        FROM temp.srs_reschedule AS r
+        WHERE NOT EXISTS (SELECT 1 FROM wrong_questions w WHERE w.user_id = r.user_id AND w.question_id = r.question_id)
+    """)).rowcount
+    conn.execute(text("DROP TABLE temp.srs_reschedule"))
+    db.commit()
+
+    return {
+        "algorithm": scheduler.name,
+        "attempts": len(rows),
+        "items": int(len(sel)),
+        "updated": updated,
+        "inserted": inserted,
+        "seconds": round(time.perf_counter() - started_at, 3)
+    }
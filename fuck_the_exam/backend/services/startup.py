@@ -0,0 +1,67 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+
+class StartupPhases:
+    """
+    Named startup phases and their state (pending, running, done, failed, skipped), for
+    /readyz. The app is ready once no phase is pending or running and no required phase
+    (the schema) has failed; other failures are reported but do not hold readiness back
+    (the app ran degraded before, too). Readiness latches: work re-run later, e.g. when a
+    follower takes over the leader lease, does not take a serving worker out of rotation.
+    """
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self._phases: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._ready = False
+
+    def expect(self, *names: str):
+        with self._lock:
+            for name in names:
+                self._phases.setdefault(name, {"state": "pending"})
+
+    def run(self, name: str, fn: Callable[[], Optional[object]], required: bool = False):
+        """
+        Runs fn as phase `name`; exceptions are recorded and printed, not raised. A failed
+        `required` phase keeps the app unready.
+        """
+        with self._lock:
+            self._phases[name] = {"state": "running"}
+        started = time.perf_counter()
+        try:
+            result = fn()
+            entry = {"state": "done"}
+            if result is not None:
+                entry["result"] = result
+        except Exception as e:
+            print(f"Startup: phase {name} failed: {e}")
+            entry = {"state": "failed", "error": str(e)}
+        if required:
+            entry["required"] = True
+        entry["seconds"] = round(time.perf_counter() - started, 3)
+        with self._lock:
+            self._phases[name] = entry
+
+    def skip(self, name: str, reason: str):
+        with self._lock:
+            self._phases[name] = {"state": "skipped", "reason": reason}
+
+    @property
+    def ready(self) -> bool:
+        with self._lock:
+            if not self._ready:
+                self._ready = all(p["state"] not in ("pending", "running") and not (p["state"] == "failed" and p.get("required"))
+                                  for p in self._phases.values())
+            return self._ready
+
+    def status(self) -> Dict:
+        ready = self.ready
+        with self._lock:
+            return {
+                "ready": ready,
+                "failed": {name: p["error"] for name, p in self._phases.items() if p["state"] == "failed"},
+                "uptime_seconds": round(time.monotonic() - self.started_at, 3),
+                "phases": {name: dict(p) for name, p in self._phases.items()}
+            }
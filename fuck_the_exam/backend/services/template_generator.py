@@ -0,0 +1,229 @@
+"""
+Offline cloze questions from the grammar table (knowledge_base/N1/语法.md), no LLM calls.
+
+Each row's example sentence (N1 常见例句) becomes the stem: the grammar's surface form is
+located in it and replaced by （　　）. Distractors are the surface forms of the most
+confusable rows in the same table, ranked by n-gram similarity of the rows and boosted when
+one row's 易错点 names the other ("易与こそすれ混"). Explanations are assembled from the
+row columns. Output is deterministic (same table, same questions), so regenerating a topic
+adds nothing the topic store has not already deduplicated.
+
+    gen = TemplateGenerator(knowledge_service)
+    gen.generate("〜しつつ", 5)   # same dict shape as ai_client.generate_questions_from_topic
+"""
+import itertools
+import random
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from .question_bank import question_hash
+from .similarity import text_similarity
+
+BLANK = "（　　）"
+LETTERS = ("A", "B", "C", "D")
+CANDIDATES = 8  # most confusable rows considered as distractors
+_PART_SPLIT = re.compile(r"[〜~～、…]+")
+_SENTENCE_SPLIT = re.compile(r"[／/；;]|\s{2,}")
+
+def _column(row: Dict, *names: str) -> str:
+    """A 语法.md column by header prefix (headers carry notes, e.g. 原型（含说明）)."""
+    for name in names:
+        for header, value in row.items():
+            if header.startswith(name) or name in header:
+                return value
+    return ""
+
+def _parts(point: str) -> List[str]:
+    """'必ずしも〜とは限らない' -> ['必ずしも', 'とは限らない']; '〜しつつ' -> ['しつつ']"""
+    return [p for p in _PART_SPLIT.split(point) if p.strip()]
+
+def _is_kana(ch: str) -> bool:
+    return "ぁ" <= ch <= "ゟ"
+
+def _locate(part: str, sentence: str, start: int) -> Optional[Tuple[int, int]]:
+    """
+    Span of `part` in sentence at or after start. Falls back to its longest suffix (the verb
+    stem differs: しつつある in 進みつつある; a two-character match takes in the kana before it,
+    ようが -> ろうが) and then to dropping up to two trailing characters, extended over the
+    conjugated ending (ざるをえない -> ざるをえなかった).
+    """
+    i = sentence.find(part, start)
+    if i >= 0:
+        return i, i + len(part)
+    for cut in range(1, len(part) - 1):
+        i = sentence.find(part[cut:], start)
+        if i >= 0:
+            begin = i
+            if len(part) - cut == 2 and begin > start and _is_kana(sentence[begin - 1]):
+                begin -= 1
+            return begin, i + len(part) - cut
+    for cut in (1, 2):
+        if len(part) - cut >= 2:
+            i = sentence.find(part[:-cut], start)
+            if i >= 0:
+                end = i + len(part) - cut
+                while end < len(sentence) and _is_kana(sentence[end]):
+                    end += 1
+                return i, end
+    return None
+
+def make_cloze(point: str, sentence: str) -> Optional[Tuple[str, str]]:
+    """(stem with blanks, answer text) for a sentence using `point`, or None if it cannot be located."""
+    spans, pos = [], 0
+    for part in _parts(point):
+        span = _locate(part, sentence, pos)
+        if span is None:
+            return None
+        spans.append(span)
+        pos = span[1]
+    if not spans:
+        return None
+    stem, last = [], 0
+    for begin, end in spans:
+        stem.append(sentence[last:begin])
+        stem.append(BLANK)
+        last = end
+    stem.append(sentence[last:])
+    return "".join(stem), "…".join(sentence[b:e] for b, e in spans)
+
+class _Row:
+    __slots__ = ("point", "form", "logic", "translation", "collocation", "pitfall", "sentences", "answer", "blanks")
+
+    def __init__(self, row: Dict):
+        self.point = row["point"]
+        self.form = _column(row, "原型")
+        self.logic = _column(row, "核心逻辑")
+        self.translation = _column(row, "常见中文翻译", "翻译")
+        self.collocation = _column(row, "常见搭配", "搭配")
+        self.pitfall = _column(row, "易错点")
+        examples = _column(row, "例句")
+        self.sentences = [s.strip() for s in _SENTENCE_SPLIT.split(examples) if s.strip()]
+        # Surface form as it appears in the row's own first usable example; the bare parts otherwise
+        self.answer = "…".join(_parts(self.point))
+        self.blanks = len(_parts(self.point))
+        for sentence in self.sentences:
+            cloze = make_cloze(self.point, sentence)
+            if cloze:
+                self.answer = cloze[1]
+                break
+
+class TemplateGenerator:
+    """
+    In-process question generator over one exam type's grammar table, reloaded after
+    `ttl_seconds` so edits to 语法.md are picked up without a restart.
+    """
+    def __init__(self, knowledge_service, exam_type: str = "N1", ttl_seconds: int = 300):
+        self.knowledge_service = knowledge_service
+        self.exam_type = exam_type
+        self.ttl_seconds = ttl_seconds
+        self._rows: Dict[str, _Row] = {}
+        self._confusable: Dict[str, List[str]] = {}
+        self._loaded_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        rows = [_Row(p) for p in self.knowledge_service.get_all_knowledge_points(exam_type=self.exam_type)
+                if p.get("source_file", "").endswith(".md")]
+        rows = [r for r in rows if r.sentences]
+        points = [r.point for r in rows]
+        confusable: Dict[str, List[str]] = {}
+        if len(rows) > 1:
+            score = text_similarity([" ".join((r.point, r.form, r.logic, r.translation, r.collocation)) for r in rows])
+            for i, a in enumerate(rows):
+                for j, b in enumerate(rows):
+                    # Named as a pitfall of each other ("易与こそすれ混"), or sharing a surface form
+                    if i != j and (any(p in a.pitfall for p in _parts(b.point))
+                                   or any(p in b.pitfall for p in _parts(a.point))):
+                        score[i, j] += 1.0
+                    if b.blanks == a.blanks:
+                        score[i, j] += 0.25
+            np.fill_diagonal(score, -np.inf)
+            for i, a in enumerate(rows):
+                order = np.argsort(-score[i], kind="stable")
+                confusable[a.point] = [points[j] for j in order if j != i][:CANDIDATES]
+        with self._lock:
+            self._rows = {r.point: r for r in rows}
+            self._confusable = confusable
+            self._loaded_at = time.monotonic()
+
+    def _ensure_loaded(self):
+        with self._lock:
+            fresh = self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl_seconds
+        if not fresh:
+            self._load()
+
+    def points(self) -> List[str]:
+        self._ensure_loaded()
+        return list(self._rows)
+
+    def can_generate(self, topic: str) -> bool:
+        self._ensure_loaded()
+        return topic in self._rows
+
+    def _distractor_sets(self, row: _Row):
+        """Triples of distractor rows, most confusable first, without repeating an answer text."""
+        seen = {row.answer}
+        options = []
+        for point in self._confusable.get(row.point, []):
+            other = self._rows[point]
+            if other.answer not in seen and row.answer not in other.answer and other.answer not in row.answer:
+                seen.add(other.answer)
+                options.append(other)
+        return itertools.combinations(options, len(LETTERS) - 1)
+
+    def _question(self, row: _Row, stem: str, answer: str, sentence: str, distractors) -> Dict:
+        # Option order is seeded by the question itself so reruns produce identical questions
+        rng = random.Random(f"{row.point}|{sentence}|" + "|".join(d.point for d in distractors))
+        choices = [(answer, row)] + [(d.answer, d) for d in distractors]
+        rng.shuffle(choices)
+        options = {letter: text for letter, (text, _) in zip(LETTERS, choices)}
+        correct = next(letter for letter, (_, r) in zip(LETTERS, choices) if r is row)
+
+        analysis = []
+        for letter, (text, r) in zip(LETTERS, choices):
+            if r is row:
+                analysis.append(f"{letter}. {text}：正确。{r.logic}，{r.translation}。")
+            else:
+                analysis.append(f"{letter}. {text}：错误。「{r.point}」{r.logic}，{r.translation}，与本句语境不符。")
+        explanation = (
+            f"[本题考点]: 「{row.point}」{row.form}。核心逻辑：{row.logic}。\n"
+            f"[语境分析]: 完整句子为「{sentence}」。常见搭配：{row.collocation}。\n"
+            f"[选项解析]:\n" + "\n".join(analysis)
+        )
+        nearest = distractors[0]
+        tip = f"易错点：{row.pitfall}。对比「{row.point}」（{row.translation}）与「{nearest.point}」（{nearest.translation}）。"
+        return {
+            "content": stem,
+            "options": options,
+            "correct_answer": correct,
+            "explanation": explanation,
+            "memorization_tip": tip,
+            "knowledge_point": row.point,
+            "source": "template",
+            "hash": question_hash(stem, options),
+        }
+
+    def generate(self, topic: str, num_questions: int = 5) -> List[Dict]:
+        """Up to num_questions distinct cloze questions for topic; [] when the table has no usable row."""
+        self._ensure_loaded()
+        row = self._rows.get(topic)
+        if row is None:
+            return []
+        # Round-robin over example sentences, each paired with its next-best distractor set
+        streams = [((sentence,) + cloze, self._distractor_sets(row)) for sentence in row.sentences
+                   for cloze in [make_cloze(row.point, sentence)] if cloze]
+        questions = []
+        while streams and len(questions) < num_questions:
+            live = []
+            for (sentence, stem, answer), sets in streams:
+                distractors = next(sets, None)
+                if distractors is None:
+                    continue
+                live.append(((sentence, stem, answer), sets))
+                if len(questions) < num_questions:
+                    questions.append(self._question(row, stem, answer, sentence, distractors))
+            streams = live
+        return questions
@@ -0,0 +1,297 @@
+"""
+Append-only per-topic question files under backend/json_questions/{n1,databricks}/.
+
+    <topic>.jsonl   one question per line; later lines may be ops on earlier questions:
+                    {"_op": "delete", "hash": ...} or {"_op": "update", "hash": ..., "set": {...}}
+    <topic>.hashes  sidecar, one line per .jsonl line: "<hash>" (question), "-<hash>" (delete),
+                    "~<hash>" (update). Also the flock target serializing writers of the topic.
+
+Appending reads the sidecar (not the questions) to dedupe, then appends the new lines:
+O(new questions) instead of re-hashing and rewriting the topic. Deletes and field updates
+are appended as ops; `compact` folds them away once they make up enough of the file.
+Writers first check that the sidecar has one line per .jsonl line (a newline count, no
+parsing) and rebuild it from the .jsonl when a crash left the two apart.
+Legacy pretty-printed <topic>.json files are converted on the first append to the topic,
+or all at once with `python -m backend.services.topic_store convert`.
+"""
+import argparse
+import json
+import os
+import re
+from typing import Dict, Iterable, List
+
+from .leader_lease import exclusive_file_lock
+from .question_bank import MODES, normalize_question, question_hash
+
+def safe_topic_name(topic: str) -> str:
+    return re.sub(r'[\\/*?:"<>|]', "", topic).replace(" ", "_")
+
+def read_questions(path: str) -> List[Dict]:
+    """Live questions of a .jsonl topic file, ops applied. A torn trailing line (append in progress) is ignored."""
+    questions: Dict[str, Dict] = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.endswith("\n"):
+                break
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            op = entry.get("_op")
+            if op == "delete":
+                questions.pop(entry.get("hash"), None)
+            elif op == "update":
+                if entry.get("hash") in questions:
+                    questions[entry["hash"]].update(entry.get("set") or {})
+            else:
+                q_hash = entry.get("hash") or question_hash(entry.get("content"), entry.get("options"))
+                questions[q_hash] = entry
+    return list(questions.values())
+
+def _encode(entry: Dict) -> str:
+    return json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+def _count_lines(path: str) -> int:
+    """Complete lines of a .jsonl file (a torn trailing line is not counted, as in read_questions)."""
+    if not os.path.exists(path):
+        return 0
+    count = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            count += chunk.count(b"\n")
+    return count
+
+def _sidecar_line(entry: Dict) -> str:
+    op = entry.get("_op")
+    if op == "delete":
+        return "-" + entry.get("hash", "")
+    if op == "update":
+        return "~" + entry.get("hash", "")
+    return entry.get("hash") or question_hash(entry.get("content"), entry.get("options"))
+
+class TopicStore:
+    def __init__(self, base_dir: str, compact_ratio: float = 0.2, compact_min_ops: int = 50):
+        self.base_dir = base_dir
+        self.compact_ratio = compact_ratio
+        self.compact_min_ops = compact_min_ops
+        self._checked: Dict[str, int] = {}  # sidecar path -> mtime_ns last looked at by compact_pending
+
+    def path_for(self, topic: str, exam_type: str = "N1") -> str:
+        return os.path.join(self.base_dir, (exam_type or "N1").lower(), safe_topic_name(topic) + ".jsonl")
+
+    @staticmethod
+    def _sidecar(path: str) -> str:
+        return path[:-len(".jsonl")] + ".hashes"
+
+    @staticmethod
+    def _read_sidecar(sidecar: str) -> Dict:
+        """{"live": set of hashes, "ops": op line count, "lines": total}"""
+        live, ops, lines = set(), 0, 0
+        if os.path.exists(sidecar):
+            with open(sidecar, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    lines += 1
+                    if line[0] == "-":
+                        live.discard(line[1:])
+                        ops += 1
+                    elif line[0] == "~":
+                        ops += 1
+                    else:
+                        live.add(line)
+        return {"live": live, "ops": ops, "lines": lines}
+
+    def _load_sidecar(self, path: str) -> Dict:
+        """
+        _read_sidecar for a topic, under its lock. A sidecar that does not have one line per
+        .jsonl line (crash between the two appends, or during compact's in-place rewrite) is
+        rebuilt from the .jsonl first, so dedupe never runs against a partial hash set.
+        """
+        sidecar = self._sidecar(path)
+        stats = self._read_sidecar(sidecar)
+        if stats["lines"] != _count_lines(path):
+            self._rebuild_sidecar(path)
+            stats = self._read_sidecar(sidecar)
+        return stats
+
+    def _rebuild_sidecar(self, path: str):
+        lines = []
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if not line.endswith("\n"):
+                        break
+                    if line.strip():
+                        lines.append(_sidecar_line(json.loads(line)))
+        # The sidecar is also the lock file: rewrite it in place rather than replacing the locked inode
+        with open(self._sidecar(path), "w", encoding="utf-8") as f:
+            f.write("".join(line + "\n" for line in lines))
+        print(f"Rebuilt {self._sidecar(path)} from {path} ({len(lines)} lines)")
+
+    def _append_lines(self, path: str, entries: List[Dict], sidecar_lines: List[str]):
+        with open(path, "a", encoding="utf-8") as f:
+            f.write("".join(_encode(e) for e in entries))
+        with open(self._sidecar(path), "a", encoding="utf-8") as f:
+            f.write("".join(line + "\n" for line in sidecar_lines))
+
+    # --- Writes ---
+    def append(self, topic: str, questions: Iterable[Dict], exam_type: str = "N1") -> int:
+        """Appends the questions not already in the topic; returns how many were new."""
+        path = self.path_for(topic, exam_type)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with exclusive_file_lock(self._sidecar(path)):
+            legacy = path[:-len(".jsonl")] + ".json"
+            if os.path.exists(legacy):
+                self._convert_locked(legacy, path)
+            existing = self._load_sidecar(path)["live"]
+
+            new_entries = []
+            for q in questions:
+                entry = dict(q)
+                if not entry.get("knowledge_point"):
+                    entry["knowledge_point"] = topic
+                if "hash" not in entry:
+                    entry["hash"] = question_hash(entry.get("content"), entry.get("options"))
+                if entry["hash"] not in existing:
+                    new_entries.append(entry)
+                    existing.add(entry["hash"])
+            if new_entries:
+                self._append_lines(path, new_entries, [e["hash"] for e in new_entries])
+        if new_entries:
+            print(f"Saved {len(new_entries)} new questions to {path}")
+        return len(new_entries)
+
+    def remove(self, path: str, q_hash: str) -> bool:
+        with exclusive_file_lock(self._sidecar(path)):
+            if q_hash not in self._load_sidecar(path)["live"]:
+                return False
+            self._append_lines(path, [{"_op": "delete", "hash": q_hash}], ["-" + q_hash])
+        print(f"Removed question {q_hash} from {path}")
+        return True
+
+    def update(self, path: str, q_hash: str, updates: Dict) -> bool:
+        with exclusive_file_lock(self._sidecar(path)):
+            if q_hash not in self._load_sidecar(path)["live"]:
+                return False
+            self._append_lines(path, [{"_op": "update", "hash": q_hash, "set": updates}], ["~" + q_hash])
+        return True
+
+    def delete_topic(self, topic: str, exam_type: str) -> bool:
+        path = self.path_for(topic, exam_type)
+        removed = False
+        for p in (path, self._sidecar(path)):
+            if os.path.exists(p):
+                os.remove(p)
+                removed = True
+        return removed
+
+    # --- Compaction ---
+    def compact(self, path: str) -> bool:
+        """Rewrites the topic with ops folded in (and a matching sidecar)."""
+        sidecar = self._sidecar(path)
+        with exclusive_file_lock(sidecar):
+            if not os.path.exists(path):
+                return False
+            questions = read_questions(path)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write("".join(_encode(q) for q in questions))
+            os.replace(tmp, path)
+            # The sidecar is also the lock file: rewrite it in place rather than replacing the locked inode.
+            # A crash before this completes leaves it short of the .jsonl; _load_sidecar rebuilds it.
+            with open(sidecar, "w", encoding="utf-8") as f:
+                f.write("".join(_sidecar_line(q) + "\n" for q in questions))
+        return True
+
+    def compact_pending(self) -> List[str]:
+        """Compacts topics whose sidecars changed and carry enough ops; cheap (stat only) otherwise."""
+        compacted = []
+        for mode in MODES:
+            mode_dir = os.path.join(self.base_dir, mode)
+            if not os.path.isdir(mode_dir):
+                continue
+            for name in os.listdir(mode_dir):
+                if not name.endswith(".hashes"):
+                    continue
+                sidecar = os.path.join(mode_dir, name)
+                mtime = os.stat(sidecar).st_mtime_ns
+                if self._checked.get(sidecar) == mtime:
+                    continue
+                stats = self._read_sidecar(sidecar)
+                if stats["ops"] >= self.compact_min_ops and stats["ops"] >= self.compact_ratio * stats["lines"]:
+                    path = sidecar[:-len(".hashes")] + ".jsonl"
+                    try:
+                        if self.compact(path):
+                            compacted.append(path)
+                    except (OSError, ValueError) as e:
+                        print(f"Topic compaction failed for {path}: {e}")
+                self._checked[sidecar] = os.stat(sidecar).st_mtime_ns
+        return compacted
+
+    # --- Legacy JSON conversion ---
+    def _convert_locked(self, legacy: str, path: str) -> int:
+        with open(legacy, "r", encoding="utf-8") as f:
+            content = f.read().strip()
+        data = json.loads(content) if content else []
+        if isinstance(data, dict):
+            data = [data]
+        default_point = os.path.basename(legacy)[:-len(".json")]
+        existing = self._load_sidecar(path)["live"]
+        entries = []
+        for q in data:
+            entry, _ = normalize_question(q, default_point)
+            if entry is None or entry["hash"] in existing:
+                continue
+            entries.append(entry)
+            existing.add(entry["hash"])
+        if entries:
+            self._append_lines(path, entries, [e["hash"] for e in entries])
+        elif not os.path.exists(path):
+            open(path, "a").close()
+        os.remove(legacy)
+        return len(entries)
+
+    def convert(self, legacy: str) -> int:
+        """Migrates one legacy <topic>.json into <topic>.jsonl (merging if both exist)."""
+        path = legacy[:-len(".json")] + ".jsonl"
+        with exclusive_file_lock(self._sidecar(path)):
+            if not os.path.exists(legacy):
+                return 0
+            return self._convert_locked(legacy, path)
+
+    def convert_all(self) -> Dict[str, int]:
+        converted = {}
+        for mode in MODES:
+            mode_dir = os.path.join(self.base_dir, mode)
+            if not os.path.isdir(mode_dir):
+                continue
+            for name in sorted(os.listdir(mode_dir)):
+                if name.endswith(".json"):
+                    legacy = os.path.join(mode_dir, name)
+                    try:
+                        converted[f"{mode}/{name}"] = self.convert(legacy)
+                    except (OSError, ValueError) as e:
+                        print(f"Error converting {legacy}: {e}")
+        return converted
+
+def main():
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    parser = argparse.ArgumentParser(description="Maintain the per-topic JSONL question files")
+    parser.add_argument("command", choices=["convert", "compact"])
+    parser.add_argument("--json-dir", default=os.path.join(backend_dir, "json_questions"))
+    args = parser.parse_args()
+
+    store = TopicStore(args.json_dir)
+    if args.command == "convert":
+        converted = store.convert_all()
+        for relpath, n in converted.items():
+            print(f"{relpath}: {n} questions -> {relpath[:-len('.json')]}.jsonl")
+        print(f"Converted {len(converted)} files.")
+    else:
+        store.compact_ratio, store.compact_min_ops = 0.0, 1
+        print(f"Compacted {len(store.compact_pending())} topics.")
+
+if __name__ == "__main__":
+    main()
@@ -77,6 +77,39 @@ export default function QuizSession() {
         }
     };
 
+    // The server stores question ids only; full payloads are rehydrated on load.
+    const buildSessionPayload = ({ questions: qs, results: rs, currentIndex: idx, topic: t }) => ({
+        session_key: 'default',
+        topic: t,
+        question_ids: qs.map(q => q.id),
+        results: rs,
+        current_index: idx
+    });
+
+    // Latest state for the PATCH fallback (avoids stale closures in async callbacks)
+    const sessionStateRef = useRef({ questions: [], results: [], currentIndex: 0, topic: '' });
+    sessionStateRef.current = { questions, results, currentIndex, topic };
+
+    // Sends a small delta (one result slot and/or the index) instead of the whole session.
+    const patchSession = async (patch) => {
+        if (isFinishingRef.current) return;
+        localStorage.setItem('sessionUpdatedAt', new Date().toISOString());
+
+        try {
+            const response = await fetch(`${getApiBase()}/api/quiz/session`, {
+                method: 'PATCH',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ session_key: 'default', ...patch })
+            });
+            if (response.status === 404) {
+                // No server copy yet: fall back to a full save
+                await saveSession(buildSessionPayload(sessionStateRef.current));
+            }
+        } catch (error) {
+            console.error('Failed to patch session:', error);
+        }
+    };
+
     const clearSession = async () => {
         try {
             await fetch(`${getApiBase()}/api/quiz/session?session_key=default`, {
@@ -87,9 +120,10 @@ export default function QuizSession() {
         }
     };
 
-    const persistIndex = (index) => {
+    const persistIndex = (index, extraPatch = {}) => {
         localStorage.setItem('currentIndex', String(index));
         setCurrentIndex(index);
+        patchSession({ current_index: index, ...extraPatch });
     };
 
     const applySession = (session) => {
@@ -146,13 +180,7 @@ export default function QuizSession() {
                     }
 
                     applySession(localSession);
-                    await saveSession({
-                        session_key: 'default',
-                        topic: localSession.topic,
-                        questions: localSession.questions,
-                        results: localSession.results,
-                        current_index: localSession.currentIndex
-                    });
+                    await saveSession(buildSessionPayload(localSession));
                     return;
                 }
 
@@ -163,13 +191,7 @@ export default function QuizSession() {
 
                 if (localSession) {
                     applySession(localSession);
-                    await saveSession({
-                        session_key: 'default',
-                        topic: localSession.topic,
-                        questions: localSession.questions,
-                        results: localSession.results,
-                        current_index: localSession.currentIndex
-                    });
+                    await saveSession(buildSessionPayload(localSession));
                     return;
                 }
             } catch (error) {
@@ -182,19 +204,13 @@ export default function QuizSession() {
         loadSession();
     }, [router]);
 
+    // Full save only when the question set changes; answers and navigation go through patchSession.
     useEffect(() => {
         if (loading || questions.length === 0 || isFinishingRef.current) return;
         const updatedAt = new Date().toISOString();
         localStorage.setItem('sessionUpdatedAt', updatedAt);
-        const payload = {
-            session_key: 'default',
-            topic,
-            questions,
-            results,
-            current_index: currentIndex
-        };
-        saveSession(payload);
-    }, [loading, questions, results, currentIndex, topic]);
+        saveSession(buildSessionPayload(sessionStateRef.current));
+    }, [loading, questions, topic]);
 
     const handleNext = async (result) => {
         const newResults = [...results];
@@ -213,10 +229,11 @@ export default function QuizSession() {
         localStorage.setItem('currentIndex', String(currentIndex));
 
         const shouldAdvance = result.autoAdvance !== false;
+        const resultPatch = result.skipped ? {} : { result_index: currentIndex, result };
 
         if (shouldAdvance) {
             if (currentIndex < questions.length - 1) {
-                persistIndex(currentIndex + 1);
+                persistIndex(currentIndex + 1, resultPatch);
             } else {
                 // Check if all questions are answered or if we should just finish
                 const finishedResults = newResults.filter(r => r !== null && !r.skipped);
@@ -226,6 +243,8 @@ export default function QuizSession() {
                     router.push('/');
                 }
             }
+        } else if (!result.skipped) {
+            patchSession(resultPatch);
         }
     };
 
@@ -1,12 +1,39 @@
 'use client';
 
+import { useState, useEffect } from 'react';
 import Link from 'next/link';
 import { Button } from './ui/button';
 import { useUser } from '../contexts/UserContext';
 import { User, LogOut, RefreshCw, BookOpen, Database } from 'lucide-react';
 
+const getApiBase = () => {
+  if (typeof window === 'undefined') return '';
+  const { protocol, hostname } = window.location;
+  return `${protocol}//${hostname}:28888`;
+};
+
 const Navbar = () => {
   const { user, logout, examType, switchMode } = useUser();
+  const [dueCount, setDueCount] = useState(0);
+
+  // Due-review badge (served from the backend's in-memory review queue, cheap to poll)
+  useEffect(() => {
+    if (!user) return;
+    const fetchDueCount = async () => {
+      try {
+        const response = await fetch(`${getApiBase()}/api/reviews/due-count?exam_type=${examType}`, {
+          headers: { 'X-User-Id': String(user.id) }
+        });
+        const data = await response.json();
+        setDueCount(data?.due || 0);
+      } catch (error) {
+        console.error('Failed to fetch due count:', error);
+      }
+    };
+    fetchDueCount();
+    const timer = setInterval(fetchDueCount, 60000);
+    return () => clearInterval(timer);
+  }, [user, examType]);
 
   if (!user) return null;
   return (
@@ -25,8 +52,13 @@ const Navbar = () => {
             <Link href="/knowledge" className="text-sm font-medium text-muted-foreground transition-colors hover:text-indigo-400">
               知识库
             </Link>
-            <Link href="/wrong-questions" className="text-sm font-medium text-muted-foreground transition-colors hover:text-indigo-400 whitespace-nowrap">
+            <Link href="/wrong-questions" className="text-sm font-medium text-muted-foreground transition-colors hover:text-indigo-400 whitespace-nowrap flex items-center gap-1">
               错题复习
+              {dueCount > 0 && (
+                <span className="min-w-[18px] h-[18px] px-1 rounded-full bg-red-500 text-white text-[10px] font-bold flex items-center justify-center">
+                  {dueCount > 99 ? '99+' : dueCount}
+                </span>
+              )}
             </Link>
           </div>
         </div>